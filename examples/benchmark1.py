@@ -0,0 +1,98 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import gc
+import tracemalloc
+from twunnel3 import local_proxy_server, logger, proxy_server
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+loop = asyncio.get_event_loop()
+
+transports = []
+
+class IdleProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        transports.append(transport)
+
+idle_server = loop.run_until_complete(loop.create_server(IdleProtocol, host="127.0.0.1", port=0))
+idle_server_port = idle_server.sockets[0].getsockname()[1]
+
+configuration = \
+{
+    "PROXY_SERVERS": [],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 0
+    }
+}
+
+socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+socks5_server_port = socks5_server.sockets[0].getsockname()[1]
+
+configuration = \
+{
+    "PROXY_SERVERS":
+    [
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": socks5_server_port,
+            "ACCOUNT":
+            {
+                "NAME": "",
+                "PASSWORD": ""
+            }
+        }
+    ]
+}
+
+def create_connections(number_of_connections):
+    futures = []
+    
+    i = 0
+    while i < number_of_connections:
+        tunnel = proxy_server.create_tunnel(configuration)
+        futures.append(asyncio.async(tunnel.create_connection(IdleProtocol, "127.0.0.1", idle_server_port)))
+        i = i + 1
+    
+    loop.run_until_complete(asyncio.wait(futures))
+    loop.run_until_complete(asyncio.sleep(1))
+
+# the first connections warm up the caches of the tunnel and the event loop
+create_connections(100)
+
+number_of_connections = 1000
+
+gc.collect()
+tracemalloc.start()
+size1, maximum_size1 = tracemalloc.get_traced_memory()
+
+create_connections(number_of_connections)
+
+gc.collect()
+size2, maximum_size2 = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+# an idle tunnel is a client connection, a SOCKS5 input and output connection and a server connection
+print("bytes per idle tunnel: %d" % ((size2 - size1) // number_of_connections))
+
+for transport in transports:
+    transport.close()
+
+loop.run_until_complete(asyncio.sleep(1))
+socks5_server.close()
+idle_server.close()
+loop.close()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import resource
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+number_of_connections = 200
+
+data_length = 8 * 1024 * 1024
+
+# the clients read nothing for stall_time seconds, like clients on a slow link during a traffic surge
+stall_time = 2
+
+buffer_pool_sizes = [0, 16 * 1024 * 1024]
+
+# the local proxy server runs in a process of its own, so its peak memory can be measured
+
+if len(sys.argv) > 1:
+    from twunnel3 import buffer_pool, local_proxy_server, logger
+    
+    configuration = \
+    {
+        "LOGGER":
+        {
+            "LEVEL": 0
+        },
+        "BUFFER_POOL":
+        {
+            "SIZE": int(sys.argv[1]),
+            "CONNECTION_SIZE": 0
+        }
+    }
+    
+    logger.configure(configuration)
+    buffer_pool.configure(configuration)
+    
+    configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": 0
+        }
+    }
+    
+    loop = asyncio.get_event_loop()
+    
+    socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+    
+    print(socks5_server.sockets[0].getsockname()[1])
+    sys.stdout.flush()
+    
+    # the peak memory is printed when the benchmark is done
+    def stdin_ready():
+        sys.stdin.readline()
+        
+        print("%d %d" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, buffer_pool.buffer_pool.pauses))
+        sys.stdout.flush()
+        
+        loop.stop()
+    
+    loop.add_reader(sys.stdin, stdin_ready)
+    loop.run_forever()
+    
+    sys.exit(0)
+
+class SourceProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.data = b"\x00" * 65536
+        self.data_length = 0
+        self.writing_paused = False
+        self.write_data()
+    
+    def write_data(self):
+        while self.data_length < data_length and self.writing_paused == False:
+            self.transport.write(self.data)
+            
+            self.data_length = self.data_length + len(self.data)
+    
+    def pause_writing(self):
+        self.writing_paused = True
+    
+    def resume_writing(self):
+        self.writing_paused = False
+        self.write_data()
+
+loop = asyncio.get_event_loop()
+
+source_server = loop.run_until_complete(loop.create_server(SourceProtocol, "127.0.0.1", 0))
+source_server_port = source_server.sockets[0].getsockname()[1]
+
+thread = threading.Thread(target=loop.run_forever)
+thread.daemon = True
+thread.start()
+
+def connect(socks5_server_port):
+    client_socket = socket.create_connection(("127.0.0.1", socks5_server_port))
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+    client_socket.sendall(b"\x05\x01\x00")
+    client_socket.recv(2)
+    client_socket.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", source_server_port))
+    client_socket.recv(10)
+    
+    return client_socket
+
+def measure_surge(buffer_pool_size):
+    process = subprocess.Popen([sys.executable, sys.argv[0], str(buffer_pool_size)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    
+    socks5_server_port = int(process.stdout.readline())
+    
+    client_sockets = []
+    
+    i = 0
+    while i < number_of_connections:
+        client_sockets.append(connect(socks5_server_port))
+        
+        i = i + 1
+    
+    time.sleep(stall_time)
+    
+    start_time = time.time()
+    
+    data = bytearray(262144)
+    
+    for client_socket in client_sockets:
+        i = 0
+        while i < data_length:
+            i = i + client_socket.recv_into(data)
+        
+        client_socket.close()
+    
+    end_time = time.time()
+    
+    process.stdin.write(b"\n")
+    process.stdin.flush()
+    
+    maximum_rss, pauses = process.stdout.readline().split()
+    
+    process.wait()
+    
+    return int(maximum_rss) / 1024, int(pauses), number_of_connections * data_length / (end_time - start_time) / 1024 / 1024
+
+for buffer_pool_size in buffer_pool_sizes:
+    maximum_rss, pauses, throughput = measure_surge(buffer_pool_size)
+    
+    print("BUFFER_POOL SIZE %d MiB: peak memory %.0f MiB, %d pauses, %.0f MB/s" % (buffer_pool_size / 1024 / 1024, maximum_rss, pauses, throughput))
\ No newline at end of file
@@ -0,0 +1,168 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import tempfile
+import time
+from twunnel3 import local_proxy_server, logger, proxy_server, tracing
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+loop = asyncio.get_event_loop()
+
+class EchoProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(data)
+
+echo_server = loop.run_until_complete(loop.create_server(EchoProtocol, host="127.0.0.1", port=0))
+echo_server_port = echo_server.sockets[0].getsockname()[1]
+
+configuration = \
+{
+    "PROXY_SERVERS": [],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 0
+    }
+}
+
+socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+socks5_server_port = socks5_server.sockets[0].getsockname()[1]
+
+# the connections go through a second local proxy server, so a traced connection also has the spans of a proxy server handshake
+configuration = \
+{
+    "PROXY_SERVERS":
+    [
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": socks5_server_port
+        }
+    ],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 0
+    }
+}
+
+socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+socks5_server_port = socks5_server.sockets[0].getsockname()[1]
+
+configuration = \
+{
+    "PROXY_SERVERS":
+    [
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": socks5_server_port
+        }
+    ]
+}
+
+class PingProtocol(asyncio.Protocol):
+    def __init__(self, connections):
+        self.connections = connections
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.transport.write(b"ping")
+    
+    def data_received(self, data):
+        self.transport.close()
+    
+    def connection_lost(self, exception):
+        self.connections.connection_closed()
+
+class Connections(object):
+    # every connection is made after the previous one is closed, number_of_parallel_connections at a time
+    def __init__(self, number_of_connections, number_of_parallel_connections):
+        self.number_of_connections = number_of_connections
+        self.number_of_parallel_connections = number_of_parallel_connections
+        self.number_of_created_connections = 0
+        self.number_of_closed_connections = 0
+        self.future = asyncio.Future()
+    
+    def start(self):
+        i = 0
+        while i < self.number_of_parallel_connections:
+            self.create_connection()
+            
+            i = i + 1
+        
+        return self.future
+    
+    def connection_closed(self):
+        self.number_of_closed_connections = self.number_of_closed_connections + 1
+        
+        if self.number_of_closed_connections == self.number_of_connections:
+            self.future.set_result(None)
+        else:
+            self.create_connection()
+    
+    def create_connection(self):
+        if self.number_of_created_connections == self.number_of_connections:
+            return
+        
+        self.number_of_created_connections = self.number_of_created_connections + 1
+        
+        tunnel = proxy_server.create_tunnel(configuration)
+        asyncio.async(tunnel.create_connection(lambda: PingProtocol(self), "127.0.0.1", echo_server_port))
+
+def create_connections(number_of_connections, number_of_parallel_connections):
+    loop.run_until_complete(Connections(number_of_connections, number_of_parallel_connections).start())
+
+number_of_connections = 4000
+number_of_parallel_connections = 20
+
+sample_rates = [0.0, 0.01, 1.0]
+
+number_of_measurements = 3
+
+# the first connections warm up the caches of the tunnel and the event loop
+create_connections(400, number_of_parallel_connections)
+
+with tempfile.TemporaryDirectory() as directory:
+    for sample_rate in sample_rates:
+        file = os.path.join(directory, "spans-%s.json" % sample_rate)
+        
+        tracing.configure({"TRACING": {"SAMPLE_RATE": sample_rate, "FILE": file}})
+        
+        connections_per_second = 0
+        
+        i = 0
+        while i < number_of_measurements:
+            start_time = time.time()
+            
+            create_connections(number_of_connections, number_of_parallel_connections)
+            
+            end_time = time.time()
+            
+            connections_per_second = max(connections_per_second, number_of_connections / (end_time - start_time))
+            
+            i = i + 1
+        
+        tracing.tracer.flush()
+        
+        file_size = 0
+        if os.path.exists(file) == True:
+            file_size = os.path.getsize(file)
+        
+        print("SAMPLE_RATE %s: %.0f connections/s, %d spans exported, %d spans dropped, %.1f MiB of spans" % (sample_rate, connections_per_second, tracing.tracer.exported_spans, tracing.tracer.dropped_spans, file_size / 1024 / 1024))
\ No newline at end of file
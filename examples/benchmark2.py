@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import socket
+import struct
+import timeit
+from twunnel3 import address, socks
+
+number_of_handshakes = 100000
+
+# the format string encoding and decoding which was used before the codec
+
+def encode_socks5_request(address, port):
+    request = struct.pack("!BBB", 0x05, 0x01, 0x00)
+    
+    try:
+        address = socket.inet_pton(socket.AF_INET, address)
+        address, = struct.unpack("!I", address)
+        
+        request = request + struct.pack("!BI", 0x01, address)
+    except socket.error:
+        address = address.encode()
+        address_length = len(address)
+        
+        request = request + struct.pack("!BB%ds" % address_length, 0x03, address_length, address)
+    
+    request = request + struct.pack("!H", port)
+    
+    return request
+
+def decode_socks5_request(data):
+    version, method, reserved, address_type = struct.unpack("!BBBB", data[:4])
+    
+    data = data[4:]
+    
+    if address_type == 0x01:
+        address, = struct.unpack("!I", data[:4])
+        address = struct.pack("!I", address)
+        address = socket.inet_ntop(socket.AF_INET, address)
+        
+        data = data[4:]
+    else:
+        address_length, = struct.unpack("!B", data[:1])
+        
+        data = data[1:]
+        
+        address, = struct.unpack("!%ds" % address_length, data[:address_length])
+        address = address.decode()
+        
+        data = data[address_length:]
+    
+    port, = struct.unpack("!H", data[:2])
+    
+    return (address, port)
+
+def classify_address_with_exceptions(address):
+    try:
+        socket.inet_pton(socket.AF_INET, address)
+        
+        return 0x01
+    except socket.error:
+        try:
+            socket.inet_pton(socket.AF_INET6, address)
+            
+            return 0x04
+        except socket.error:
+            return 0x03
+
+def handshake_with_format_strings(address, port):
+    request = encode_socks5_request(address, port)
+    decode_socks5_request(request)
+    struct.pack("!BBBBIH", 0x05, 0x00, 0x00, 0x01, 0, 0)
+
+def handshake_with_codec(remote_address, remote_port):
+    request = socks.encode_socks5_request(address.get_address(remote_address), remote_port)
+    socks.decode_socks5_address(request, socks.socks5_header_struct.size)
+    socks.SOCKS5_REPLY_SUCCEEDED
+
+for remote_address in ["127.0.0.1", "www.example.com"]:
+    time1 = timeit.timeit(lambda: handshake_with_format_strings(remote_address, 443), number=number_of_handshakes)
+    time2 = timeit.timeit(lambda: handshake_with_codec(remote_address, 443), number=number_of_handshakes)
+    
+    print("%s: format strings %.2f us, codec %.2f us per handshake" % (remote_address, time1 * 1000000 / number_of_handshakes, time2 * 1000000 / number_of_handshakes))
+
+for remote_address in ["127.0.0.1", "www.example.com"]:
+    time1 = timeit.timeit(lambda: classify_address_with_exceptions(remote_address), number=number_of_handshakes)
+    time2 = timeit.timeit(lambda: address.get_address(remote_address).address_type, number=number_of_handshakes)
+    
+    print("%s: exceptions %.2f us, cache %.2f us per address classification" % (remote_address, time1 * 1000000 / number_of_handshakes, time2 * 1000000 / number_of_handshakes))
\ No newline at end of file
@@ -0,0 +1,73 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import json
+import subprocess
+import tempfile
+import time
+
+number_of_starts = 10
+
+# the time from starting the twunnel3 command until it is listening, which matters for socket activated or short lived proxy servers
+
+def measure_start(arguments):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.path.abspath("..")
+    
+    times = []
+    
+    i = 0
+    while i < number_of_starts:
+        start_time = time.time()
+        
+        process = subprocess.Popen([sys.executable, "-u"] + arguments, stdout=subprocess.PIPE, env=environment)
+        
+        while True:
+            line = process.stdout.readline()
+            
+            if line.startswith(b"listening") or line == b"":
+                break
+        
+        times.append(time.time() - start_time)
+        
+        process.terminate()
+        process.wait()
+        
+        i = i + 1
+    
+    times.sort()
+    
+    return times[len(times) // 2]
+
+configuration_files = {}
+
+for type in ["SOCKS5", "HTTPS"]:
+    configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": type,
+            "ADDRESS": "127.0.0.1",
+            "PORT": 0
+        }
+    }
+    
+    file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump(configuration, file)
+    file.close()
+    
+    configuration_files[type] = file.name
+
+time1 = measure_start(["-c", "import asyncio; print('listening')"])
+
+print("python and asyncio: %.1f ms" % (time1 * 1000))
+
+for type in ["SOCKS5", "HTTPS"]:
+    time2 = measure_start(["-m", "twunnel3", "--log-level", "1", configuration_files[type]])
+    
+    print("%s: %.1f ms until listening" % (type, time2 * 1000))
+
+for file_name in configuration_files.values():
+    os.unlink(file_name)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import socket
+import ssl
+import threading
+import time
+from twunnel3 import local_proxy_server, logger
+
+number_of_handshakes = 500
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+configuration = \
+{
+    "PROXY_SERVERS": [],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 0,
+        "TLS":
+        {
+            "CERTIFICATE_FILE": "tls_certificate.pem",
+            "KEY_FILE": "tls_key.pem",
+            "ALPN_PROTOCOLS": ["socks"]
+        }
+    }
+}
+
+loop = asyncio.get_event_loop()
+
+socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+socks5_server_port = socks5_server.sockets[0].getsockname()[1]
+
+thread = threading.Thread(target=loop.run_forever)
+thread.daemon = True
+thread.start()
+
+# a client which reconnects often only pays for a full handshake once, later handshakes resume the session with a session ticket
+
+def measure_handshakes(options, resume):
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    ssl_context.options |= options
+    
+    session = None
+    sessions_reused = 0
+    
+    start_time = time.time()
+    
+    i = 0
+    while i < number_of_handshakes:
+        client_socket = socket.create_connection(("127.0.0.1", socks5_server_port))
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        ssl_socket = ssl_context.wrap_socket(client_socket, session=session)
+        
+        # with TLS 1.3 the session ticket arrives after the handshake, together with the first data
+        ssl_socket.sendall(b"\x05\x01\x00")
+        ssl_socket.recv(2)
+        
+        if ssl_socket.session_reused == True:
+            sessions_reused = sessions_reused + 1
+        
+        if resume == True:
+            session = ssl_socket.session
+        
+        ssl_socket.close()
+        
+        i = i + 1
+    
+    return ((time.time() - start_time) / number_of_handshakes, sessions_reused)
+
+# ssl.TLSVersion and SSLContext.maximum_version are not in Python 3.6, so TLS 1.3 is turned off with an option
+for version, options in [("TLSv1_2", ssl.OP_NO_TLSv1_3), ("TLSv1_3", 0)]:
+    time1, sessions_reused1 = measure_handshakes(options, False)
+    time2, sessions_reused2 = measure_handshakes(options, True)
+    
+    print("%s: full handshake %.0f us, resumed handshake %.0f us (%d of %d resumed)" % (version, time1 * 1000000, time2 * 1000000, sessions_reused2, number_of_handshakes))
\ No newline at end of file
@@ -0,0 +1,98 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import socket
+import struct
+import threading
+import time
+from twunnel3 import local_proxy_server, logger
+
+number_of_round_trips = 200
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+# the server only replies to a whole message, like most request and reply protocols
+
+class EchoProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.data = b""
+    
+    def data_received(self, data):
+        self.data = self.data + data
+        
+        if len(self.data) >= 36:
+            self.transport.write(self.data)
+            
+            self.data = b""
+
+loop = asyncio.get_event_loop()
+
+echo_server = loop.run_until_complete(loop.create_server(EchoProtocol, "127.0.0.1", 0))
+echo_server_port = echo_server.sockets[0].getsockname()[1]
+
+socks5_server_ports = {}
+
+for socket_profile_name in ["INTERACTIVE", "BULK", "LONG_IDLE"]:
+    configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": 0,
+            "SOCKET_PROFILE":
+            {
+                "NAME": socket_profile_name
+            }
+        }
+    }
+    
+    socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+    socks5_server_ports[socket_profile_name] = socks5_server.sockets[0].getsockname()[1]
+
+thread = threading.Thread(target=loop.run_forever)
+thread.daemon = True
+thread.start()
+
+# an interactive session writes small messages in more than one write, with Nagle's algorithm the second write waits for the delayed ACK of the first
+
+def measure_round_trips(socks5_server_port):
+    client_socket = socket.create_connection(("127.0.0.1", socks5_server_port))
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    client_socket.sendall(b"\x05\x01\x00")
+    client_socket.recv(2)
+    client_socket.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", echo_server_port))
+    client_socket.recv(10)
+    
+    start_time = time.time()
+    
+    i = 0
+    while i < number_of_round_trips:
+        client_socket.sendall(b"\x00" * 4)
+        time.sleep(0.0005)
+        client_socket.sendall(b"\x00" * 32)
+        
+        data_length = 0
+        while data_length < 36:
+            data_length = data_length + len(client_socket.recv(36 - data_length))
+        
+        i = i + 1
+    
+    client_socket.close()
+    
+    return (time.time() - start_time) / number_of_round_trips
+
+for socket_profile_name in ["INTERACTIVE", "BULK", "LONG_IDLE"]:
+    print("%s: %.2f ms per round trip" % (socket_profile_name, measure_round_trips(socks5_server_ports[socket_profile_name]) * 1000))
\ No newline at end of file
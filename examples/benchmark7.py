@@ -0,0 +1,150 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import time
+from twunnel3 import local_proxy_server, logger, proxy_server
+
+number_of_connections = 20
+
+delay = 0.025
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class EchoProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(data)
+
+# the link to the proxy server delays every write, like a link with a round trip time of 2 * delay
+
+class DelayProtocol(asyncio.Protocol):
+    def __init__(self, other_protocol=None):
+        self.other_protocol = other_protocol
+        self.transport = None
+        self.data = []
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        if self.other_protocol is None:
+            self.other_protocol = DelayProtocol(self)
+            
+            asyncio.async(loop.create_connection(lambda: self.other_protocol, "127.0.0.1", socks5_server_port))
+        else:
+            self.other_protocol.other_protocol = self
+            
+            for data in self.data:
+                self.transport.write(data)
+    
+    def connection_lost(self, exception):
+        loop.call_later(delay, self.other_protocol.close)
+    
+    def data_received(self, data):
+        loop.call_later(delay, self.other_protocol.write, data)
+    
+    def write(self, data):
+        if self.transport is None:
+            self.data.append(data)
+        else:
+            self.transport.write(data)
+    
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+class ClientProtocol(asyncio.Protocol):
+    def __init__(self, future):
+        self.future = future
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.transport.write(b"\x00" * 64)
+    
+    def data_received(self, data):
+        if self.future.done() == False:
+            self.future.set_result(time.time())
+        
+        self.transport.close()
+
+loop = asyncio.get_event_loop()
+
+echo_server = loop.run_until_complete(loop.create_server(EchoProtocol, "127.0.0.1", 0))
+echo_server_port = echo_server.sockets[0].getsockname()[1]
+
+configuration = \
+{
+    "PROXY_SERVERS": [],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 0,
+        "ACCOUNTS":
+        [
+            {
+                "NAME": "1",
+                "PASSWORD": "2"
+            }
+        ]
+    }
+}
+
+socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+socks5_server_port = socks5_server.sockets[0].getsockname()[1]
+
+delay_server = loop.run_until_complete(loop.create_server(DelayProtocol, "127.0.0.1", 0))
+delay_server_port = delay_server.sockets[0].getsockname()[1]
+
+# the time from the connect until the first byte of the reply, which includes the handshake with the proxy server
+
+def measure_first_byte(optimistic):
+    configuration = \
+    {
+        "PROXY_SERVERS":
+        [
+            {
+                "TYPE": "SOCKS5",
+                "ADDRESS": "127.0.0.1",
+                "PORT": delay_server_port,
+                "ACCOUNT":
+                {
+                    "NAME": "1",
+                    "PASSWORD": "2"
+                },
+                "OPTIMISTIC": optimistic
+            }
+        ]
+    }
+    
+    tunnel = proxy_server.create_tunnel(configuration)
+    
+    total_time = 0
+    
+    i = 0
+    while i < number_of_connections:
+        future = asyncio.Future()
+        
+        start_time = time.time()
+        
+        loop.run_until_complete(tunnel.create_connection(lambda: ClientProtocol(future), "127.0.0.1", echo_server_port))
+        
+        total_time = total_time + loop.run_until_complete(future) - start_time
+        
+        i = i + 1
+    
+    return total_time / number_of_connections
+
+for optimistic in [False, True]:
+    print("OPTIMISTIC %s: %.1f ms to the first byte, %.1f ms round trip time" % (optimistic, measure_first_byte(optimistic) * 1000, delay * 2 * 1000))
\ No newline at end of file
@@ -0,0 +1,116 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import timeit
+from twunnel3 import local_proxy_server, logger, proxy_server
+
+number_of_chunks = 200000
+
+maximum_proxy_servers_length = 5
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class EchoProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(data)
+
+class ClientProtocol(asyncio.Protocol):
+    def __init__(self, future):
+        self.future = future
+        self.data_length = 0
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.future.set_result(self)
+    
+    def data_received(self, data):
+        self.data_length = self.data_length + len(data)
+
+loop = asyncio.get_event_loop()
+
+echo_server = loop.run_until_complete(loop.create_server(EchoProtocol, "127.0.0.1", 0))
+echo_server_port = echo_server.sockets[0].getsockname()[1]
+
+socks5_server_ports = []
+
+i = 0
+while i < maximum_proxy_servers_length:
+    configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": 0
+        }
+    }
+    
+    socks5_server = loop.run_until_complete(local_proxy_server.create_server(configuration))
+    socks5_server_ports.append(socks5_server.sockets[0].getsockname()[1])
+    
+    i = i + 1
+
+# the time the protocol of the transport of the tunnel takes to pass a chunk to the client protocol
+
+def measure_chunk(proxy_servers_length, optimistic):
+    configuration = \
+    {
+        "PROXY_SERVERS": []
+    }
+    
+    i = 0
+    while i < proxy_servers_length:
+        configuration["PROXY_SERVERS"].append({"TYPE": "SOCKS5", "ADDRESS": "127.0.0.1", "PORT": socks5_server_ports[i], "OPTIMISTIC": optimistic})
+        
+        i = i + 1
+    
+    future = asyncio.Future()
+    
+    tunnel = proxy_server.create_tunnel(configuration)
+    loop.run_until_complete(tunnel.create_connection(lambda: ClientProtocol(future), "127.0.0.1", echo_server_port))
+    
+    client_protocol = loop.run_until_complete(future)
+    
+    # the reply of the last proxy server is read after the connection is made by an optimistic tunnel
+    loop.run_until_complete(asyncio.sleep(0.1))
+    
+    protocol = client_protocol.transport.get_protocol()
+    
+    chunk = b"\x00" * 16
+    
+    time = timeit.timeit(lambda: protocol.data_received(chunk), number=number_of_chunks)
+    
+    client_protocol.transport.close()
+    
+    return time * 1000000000 / number_of_chunks
+
+set_output_protocol = proxy_server.TunnelProtocol.set_output_protocol
+
+for optimistic in [False, True]:
+    proxy_servers_length = 1
+    while proxy_servers_length <= maximum_proxy_servers_length:
+        proxy_server.TunnelProtocol.set_output_protocol = lambda self: None
+        
+        time1 = measure_chunk(proxy_servers_length, optimistic)
+        
+        proxy_server.TunnelProtocol.set_output_protocol = set_output_protocol
+        
+        time2 = measure_chunk(proxy_servers_length, optimistic)
+        
+        print("OPTIMISTIC %s, %d proxy servers: tunnel protocols %.0f ns, client protocol %.0f ns per chunk" % (optimistic, proxy_servers_length, time1, time2))
+        
+        proxy_servers_length = proxy_servers_length + 1
\ No newline at end of file
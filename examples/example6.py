@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+from twunnel3 import local_proxy_server, logger
+from examples import example
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 3
+    }
+}
+
+logger.configure(configuration)
+
+loop = asyncio.get_event_loop()
+
+configuration = \
+{
+    "PROXY_SERVERS": [],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 8080,
+        "ACCOUNTS":
+        [
+            {
+                "NAME": "",
+                "PASSWORD": ""
+            }
+        ]
+    }
+}
+
+socks5_server1 = loop.run_until_complete(local_proxy_server.create_server(configuration))
+
+configuration = \
+{
+    "PROXY_SERVERS": [],
+    "LOCAL_PROXY_SERVER":
+    {
+        "TYPE": "SOCKS5",
+        "ADDRESS": "127.0.0.1",
+        "PORT": 8081,
+        "ACCOUNTS":
+        [
+            {
+                "NAME": "",
+                "PASSWORD": ""
+            }
+        ]
+    }
+}
+
+socks5_server2 = loop.run_until_complete(local_proxy_server.create_server(configuration))
+
+configuration = \
+{
+    "PROXY_SERVERS":
+    [
+        {
+            "TYPE": "GROUP",
+            "STRATEGY": "WEIGHTED_ROUND_ROBIN",
+            "PROXY_SERVERS":
+            [
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": 8080,
+                    "ACCOUNT":
+                    {
+                        "NAME": "",
+                        "PASSWORD": ""
+                    },
+                    "WEIGHT": 1
+                },
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": 8081,
+                    "ACCOUNT":
+                    {
+                        "NAME": "",
+                        "PASSWORD": ""
+                    },
+                    "WEIGHT": 2
+                }
+            ]
+        }
+    ]
+}
+
+loop.call_later(5, example.create_connection, configuration)
+loop.call_later(10, example.create_connection, configuration, True)
+loop.call_later(15, socks5_server2.close)
+loop.call_later(20, socks5_server1.close)
+loop.call_later(25, loop.stop)
+loop.run_forever()
\ No newline at end of file
@@ -0,0 +1,24 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+from twunnel3 import configuration, local_proxy_server, logger
+from examples import example
+
+server_configuration = configuration.load_configuration("example8_server.json")
+
+logger.configure(server_configuration)
+
+loop = asyncio.get_event_loop()
+
+socks5_server = loop.run_until_complete(local_proxy_server.create_server(server_configuration))
+
+# the configuration is validated and compiled once, all tunnels share it
+client_configuration = configuration.get_configuration(configuration.load_configuration("example8_client.json"))
+
+loop.call_later(5, example.create_connection, client_configuration)
+loop.call_later(10, example.create_connection, client_configuration, True)
+loop.call_later(15, socks5_server.close)
+loop.call_later(20, loop.stop)
+loop.run_forever()
\ No newline at end of file
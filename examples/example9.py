@@ -0,0 +1,26 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+from twunnel3 import configuration, local_proxy_server, logger
+from examples import example
+
+server_configuration = configuration.load_configuration("example8_server.json")
+
+logger.configure(server_configuration)
+
+loop = asyncio.get_event_loop()
+
+# on SIGHUP the configuration file is read again, new connections use the new configuration while established connections keep the old one
+socks5_server_manager = loop.run_until_complete(local_proxy_server.create_server_manager([server_configuration]))
+socks5_server_manager.add_signal_handler(lambda: [configuration.load_configuration("example8_server.json")])
+
+client_configuration = configuration.get_configuration(configuration.load_configuration("example8_client.json"))
+
+loop.call_later(5, example.create_connection, client_configuration)
+loop.call_later(10, socks5_server_manager.reload, [configuration.load_configuration("example8_server.json")])
+loop.call_later(15, example.create_connection, client_configuration, True)
+loop.call_later(20, socks5_server_manager.close)
+loop.call_later(25, loop.stop)
+loop.run_forever()
\ No newline at end of file
@@ -28,6 +28,12 @@ requires = [
     'asyncio'
 ]
 
+entry_points = {
+    'console_scripts': [
+        'twunnel3 = twunnel3.cli:main',
+    ],
+}
+
 classifiers=[
     'Programming Language :: Python',
     'Programming Language :: Python :: 3',
@@ -42,6 +48,7 @@ setup(
     packages=packages,
     package_data=package_data,
     install_requires=requires,
+    entry_points=entry_points,
     author='Jeroen Van Steirteghem',
     author_email='jeroen.vansteirteghem@gmail.com',
     url='https://github.com/jvansteirteghem/twunnel3',
@@ -0,0 +1,55 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import twunnel3.accounting
+from tests import upstream
+
+class AccountingTestCase(upstream.TestCase):
+    def setUp(self):
+        upstream.TestCase.setUp(self)
+        
+        self.directory = tempfile.mkdtemp()
+        self.write_rows = twunnel3.accounting.write_rows
+    
+    def tearDown(self):
+        twunnel3.accounting.write_rows = self.write_rows
+        
+        shutil.rmtree(self.directory)
+        
+        upstream.TestCase.tearDown(self)
+    
+    def test_flush_after_pending_writes(self):
+        # the batch of the executor is written after the rows of flush, unless flush waits for it
+        def write_rows(rows, file, format):
+            if threading.current_thread() is not threading.main_thread():
+                time.sleep(0.2)
+            
+            self.write_rows(rows, file, format)
+        
+        twunnel3.accounting.write_rows = write_rows
+        
+        file = os.path.join(self.directory, "accounting.json")
+        
+        accounting = twunnel3.accounting.Accounting()
+        accounting.file = file
+        
+        account_usage = accounting.get_account_usage("account1")
+        account_usage.update(100, 200)
+        
+        accounting.write_rows()
+        
+        account_usage.update(1000, 2000)
+        
+        accounting.flush()
+        
+        self.loop.run_until_complete(asyncio.sleep(0.4))
+        
+        self.assertEqual(accounting.failed_writes, 0)
+        self.assertEqual(twunnel3.accounting.read_rows(file, "JSON"), [("account1", "", 1100, 2200, 0)])
+        self.assertEqual(os.listdir(self.directory), ["accounting.json"])
\ No newline at end of file
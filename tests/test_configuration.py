@@ -0,0 +1,38 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import gc
+import weakref
+import twunnel3.configuration
+from tests import upstream
+
+class Dictionary(dict):
+    # a dictionary which can be referenced weakly
+    pass
+
+class ConfigurationTestCase(upstream.TestCase):
+    def test_changed_dictionaries(self):
+        configuration = {"PROXY_SERVERS": [{"TYPE": "SOCKS5", "ADDRESS": "127.0.0.1", "PORT": 1080}]}
+        
+        compiled_configuration = twunnel3.configuration.get_configuration(configuration)
+        
+        self.assertIs(twunnel3.configuration.get_configuration(configuration), compiled_configuration)
+        
+        configuration["PROXY_SERVERS"][0]["PORT"] = 1081
+        
+        compiled_configuration = twunnel3.configuration.get_configuration(configuration)
+        
+        self.assertEqual(compiled_configuration.proxy_servers[0].port, 1081)
+        self.assertIs(twunnel3.configuration.get_configuration(configuration), compiled_configuration)
+    
+    def test_dictionaries_are_not_kept(self):
+        configuration = Dictionary({"PROXY_SERVERS": []})
+        
+        twunnel3.configuration.get_configuration(configuration)
+        
+        reference = weakref.ref(configuration)
+        
+        del configuration
+        gc.collect()
+        
+        self.assertIsNone(reference())
\ No newline at end of file
@@ -0,0 +1,84 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import os
+import shutil
+import tempfile
+import twunnel3.configuration
+import twunnel3.http_cache
+from tests import upstream
+
+class HTTPCacheTestCase(upstream.TestCase):
+    def setUp(self):
+        upstream.TestCase.setUp(self)
+        
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+        upstream.TestCase.tearDown(self)
+    
+    def create_cache(self, directory_size=1048576):
+        # the entries do not fit in memory, they are all written to the directory
+        configuration = twunnel3.configuration.create_configuration({"LOCAL_PROXY_SERVER": {"TYPE": "HTTPS", "ADDRESS": "127.0.0.1", "PORT": 0, "CACHE": {"SIZE": 0, "DIRECTORY": self.directory, "DIRECTORY_SIZE": directory_size}}})
+        
+        return twunnel3.http_cache.HTTPCache(configuration, None)
+    
+    def add_entry(self, cache, uri, data):
+        entry = twunnel3.http_cache.HTTPCacheEntry(cache, ("127.0.0.1", 80, uri))
+        entry.data = [data]
+        entry.data_length = len(data)
+        entry.data_state = 1
+        
+        cache.add_entry(entry)
+        
+        return entry
+    
+    def wait_for_files(self, cache):
+        while len(cache.file_writes) > 0:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+    
+    def test_removed_entries_remove_their_files(self):
+        cache = self.create_cache(2048)
+        
+        self.add_entry(cache, b"/1", b"1" * 1024)
+        self.wait_for_files(cache)
+        self.add_entry(cache, b"/2", b"2" * 1024)
+        self.add_entry(cache, b"/3", b"3" * 1024)
+        
+        # the entry is removed while its file is written
+        cache.remove_entry(("127.0.0.1", 80, b"/3"))
+        self.wait_for_files(cache)
+        
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        
+        cache.remove_entry(("127.0.0.1", 80, b"/1"))
+        cache.remove_entry(("127.0.0.1", 80, b"/2"))
+        
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(cache.file_entries_size, 0)
+    
+    def test_replaced_files_keep_their_data(self):
+        cache = self.create_cache()
+        
+        entry = self.add_entry(cache, b"/", b"1" * 100000)
+        self.wait_for_files(cache)
+        
+        data = self.run_future(entry.get_data())
+        
+        self.add_entry(cache, b"/", b"2" * 100000)
+        self.wait_for_files(cache)
+        
+        # the file which is mapped is replaced, not truncated
+        self.assertEqual(b"".join(data), b"1" * 100000)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+    
+    def test_files_of_earlier_runs_are_removed(self):
+        with open(os.path.join(self.directory, "0.cache"), "wb") as file:
+            file.write(b"0")
+        
+        self.create_cache()
+        
+        self.assertEqual(os.listdir(self.directory), [])
\ No newline at end of file
@@ -0,0 +1,115 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import time
+import unittest
+import twunnel3.http_parser
+
+class Handler(object):
+    # the handler of a parser which is fed directly, it keeps what the parser reports
+    def __init__(self):
+        self.messages = []
+        self.data = b""
+        self.completed = 0
+        self.error = False
+    
+    def http_parser__message_received(self, message):
+        self.messages.append(message)
+    
+    def http_parser__message_data_received(self, data):
+        self.data = self.data + data
+    
+    def http_parser__message_completed(self):
+        self.completed = self.completed + 1
+    
+    def http_parser__message_error(self):
+        self.error = True
+
+def parse(data, request=True):
+    handler = Handler()
+    
+    parser = twunnel3.http_parser.HTTPParser(handler, request)
+    parser.data_received(data)
+    
+    return handler
+
+def parse_fragmented_head(data, head, request=True):
+    handler = Handler()
+    
+    parser = twunnel3.http_parser.HTTPParser(handler, request)
+    parser.data_received(data)
+    
+    t = time.perf_counter()
+    
+    # the head is received one byte at a time, the worst case of a fragmented head
+    i = 0
+    while i < len(head):
+        parser.data_received(head[i:i + 1])
+        
+        i = i + 1
+    
+    t = time.perf_counter() - t
+    
+    return (handler, t)
+
+class HTTPParserTestCase(unittest.TestCase):
+    def test_chunked_requests(self):
+        handler = parse(b"POST http://127.0.0.1/ HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5;name=value\r\nhello\r\nA\r\n0123456789\r\n0\r\n\r\n")
+        
+        self.assertFalse(handler.error)
+        self.assertEqual(handler.completed, 1)
+        self.assertEqual(handler.data, b"5;name=value\r\nhello\r\nA\r\n0123456789\r\n0\r\n\r\n")
+    
+    def test_invalid_chunk_sizes(self):
+        # a negative chunk size made the parser loop forever
+        for chunk_size in [b"-5", b"+5", b"0x5", b"5_0", b" ", b"g"]:
+            handler = parse(b"POST http://127.0.0.1/ HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n" + chunk_size + b"\r\nhello\r\n0\r\n\r\n")
+            
+            self.assertTrue(handler.error, chunk_size)
+            self.assertEqual(handler.completed, 0, chunk_size)
+    
+    def test_requests_with_two_lengths(self):
+        for head in [b"Transfer-Encoding: gzip\r\nContent-Length: 5", b"Transfer-Encoding: gzip", b"Transfer-Encoding: chunked\r\nContent-Length: 5", b"Content-Length: 5\r\nContent-Length: 5", b"Content-Length: 5, 6", b"Content-Length: +5", b"Content-Length: "]:
+            handler = parse(b"POST http://127.0.0.1/ HTTP/1.1\r\n" + head + b"\r\n\r\n5\r\nhello\r\n0\r\n\r\n")
+            
+            self.assertTrue(handler.error, head)
+            self.assertEqual(handler.messages, [], head)
+    
+    def test_responses_with_two_lengths(self):
+        # the Transfer-Encoding of a response overrides its Content-Length
+        handler = parse(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nContent-Length: 100\r\n\r\n5\r\nhello\r\n0\r\n\r\n", False)
+        
+        self.assertFalse(handler.error)
+        self.assertEqual(handler.completed, 1)
+        self.assertIsNone(handler.messages[0].get_header(b"content-length"))
+        
+        # a response which is not chunked last ends when the connection is closed
+        handler = parse(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: gzip\r\nContent-Length: 5\r\n\r\nhello world", False)
+        
+        self.assertFalse(handler.error)
+        self.assertEqual(handler.completed, 0)
+        self.assertEqual(handler.data, b"hello world")
+        
+        handler = parse(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\nContent-Length: 6\r\n\r\nhello world", False)
+        
+        self.assertTrue(handler.error)
+    
+    def check_parsing_is_linear(self, data, head, request):
+        # a head of 4 times the length takes about 4 times as long, a parser which copies or searches the whole head for every byte takes more than 10 times as long
+        t1 = min(parse_fragmented_head(data, head.replace(b"%s", b"x" * 15000), request)[1] for i in range(3))
+        t4 = min(parse_fragmented_head(data, head.replace(b"%s", b"x" * 60000), request)[1] for i in range(3))
+        
+        self.assertLess(t4, t1 * 8)
+        
+        handler = parse_fragmented_head(data, head.replace(b"%s", b"x"), request)[0]
+        
+        self.assertFalse(handler.error)
+        self.assertEqual(handler.completed, len(handler.messages))
+        self.assertEqual(handler.messages[-1].get_header(b"x-header"), b"x")
+    
+    def test_parsing_is_linear(self):
+        # the next request of a kept alive connection, which is forwarded
+        self.check_parsing_is_linear(b"GET http://127.0.0.1/ HTTP/1.1\r\n\r\n", b"GET http://127.0.0.1/ HTTP/1.1\r\nX-Header: %s\r\n\r\n", True)
+        
+        # the response of the server
+        self.check_parsing_is_linear(b"", b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nX-Header: %s\r\n\r\n", False)
\ No newline at end of file
@@ -0,0 +1,320 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import gc
+import socket
+import struct
+import time
+import tracemalloc
+import twunnel3.buffer_pool
+import twunnel3.configuration
+import twunnel3.local_proxy_server
+from tests import upstream
+
+def get_port(local_proxy_server):
+    return local_proxy_server.sockets[0].getsockname()[1]
+
+def encode_request(type, port):
+    if type == "HTTPS":
+        return b"CONNECT 127.0.0.1:" + str(port).encode() + b" HTTP/1.1\r\n\r\n"
+    else:
+        if type == "SOCKS4":
+            return struct.pack("!BBH4s", 0x04, 0x01, port, socket.inet_aton("127.0.0.1")) + b"\x00"
+        else:
+            return b"\x05\x01\x00" + b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", port)
+
+# an idle tunnel through a local proxy server (the client connection, the input and output connections of the local proxy server and the remote connection) is at most this size, it is about 8500 bytes on Python 3.6
+maximum_idle_tunnel_size = 12000
+
+class IdleProtocol(asyncio.Protocol):
+    def __init__(self, transports):
+        self.transports = transports
+    
+    def connection_made(self, transport):
+        self.transports.append(transport)
+
+# the replies of the local proxy servers to encode_request
+replies = \
+{
+    "HTTPS": b"HTTP/1.1 200 OK\r\n\r\n",
+    "SOCKS4": b"\x00\x5a\x00\x00\x00\x00\x00\x00",
+    "SOCKS5": b"\x05\x00\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00"
+}
+
+class LocalProxyServerTestCase(upstream.TestCase):
+    types = ["HTTPS", "SOCKS4", "SOCKS5"]
+    
+    def create_local_proxy_server(self, type, upstream_server):
+        return upstream.TestCase.create_local_proxy_server(self, type, [upstream_server.get_configuration()])
+    
+    def create_client_connection(self, local_proxy_server, protocol):
+        return asyncio.async(self.loop.create_connection(lambda: protocol, "127.0.0.1", get_port(local_proxy_server)))
+    
+    def write_fragments(self, transport, data):
+        # the request is written one byte at a time
+        i = 0
+        while i < len(data):
+            self.loop.call_later(i * upstream.fragment_interval, transport.write, data[i:i + 1])
+            
+            i = i + 1
+    
+    def test_local_proxy_servers(self):
+        for type in self.types:
+            for upstream_type in self.types:
+                upstream_server = self.create_upstream_server(upstream_type, upstream.UpstreamFaults(fragment_length=1))
+                local_proxy_server = self.create_local_proxy_server(type, upstream_server)
+                
+                data = b"d" * 100000
+                client_protocol = upstream.ClientProtocol(data, len(data))
+                
+                self.run_future(self.create_tunnel_connection([{"TYPE": type, "ADDRESS": "127.0.0.1", "PORT": get_port(local_proxy_server)}], client_protocol, "127.0.0.1", 8080))
+                
+                self.assertEqual(self.run_future(client_protocol.received_future), data, (type, upstream_type))
+                self.assertEqual(upstream_server.requests[0][:2], ("127.0.0.1", 8080), (type, upstream_type))
+                
+                client_protocol.transport.close()
+    
+    def test_fragmented_requests(self):
+        for type in self.types:
+            upstream_server = self.create_upstream_server("SOCKS4")
+            local_proxy_server = self.create_local_proxy_server(type, upstream_server)
+            
+            client_protocol = upstream.ClientProtocol(b"", len(replies[type]) + 4)
+            
+            self.run_future(self.create_client_connection(local_proxy_server, client_protocol))
+            
+            self.write_fragments(client_protocol.transport, encode_request(type, 8080) + b"ping")
+            
+            self.assertEqual(self.run_future(client_protocol.received_future), replies[type] + b"ping", type)
+            
+            client_protocol.transport.close()
+    
+    def check_refused_tunnel(self, upstream_types, faults):
+        # the client of a local proxy server gets a reply when the proxy server refuses the tunnel, also when it refuses it during its handshake
+        for type in self.types:
+            for upstream_type in upstream_types:
+                upstream_server = self.create_upstream_server(upstream_type, faults)
+                local_proxy_server = self.create_local_proxy_server(type, upstream_server)
+                
+                client_protocol = upstream.ClientProtocol()
+                
+                with self.assertRaises(ConnectionRefusedError, msg=(type, upstream_type)):
+                    self.run_future(self.create_tunnel_connection([{"TYPE": type, "ADDRESS": "127.0.0.1", "PORT": get_port(local_proxy_server)}], client_protocol))
+                
+                self.assertEqual(local_proxy_server.get_connections_length(), 0, (type, upstream_type))
+    
+    def test_refused_connections(self):
+        self.check_refused_tunnel(self.types, upstream.UpstreamFaults(refuse_connection=True, fragment_length=1))
+    
+    def test_refused_authentication(self):
+        self.check_refused_tunnel(["HTTPS", "SOCKS5"], upstream.UpstreamFaults(refuse_authentication=True))
+    
+    def test_reset_connections(self):
+        for type in self.types:
+            upstream_server = self.create_upstream_server("SOCKS5", upstream.UpstreamFaults(reset_length=10000))
+            local_proxy_server = self.create_local_proxy_server(type, upstream_server)
+            
+            data = b"d" * 1000000
+            client_protocol = upstream.ClientProtocol(data, len(data))
+            
+            self.run_future(self.create_tunnel_connection([{"TYPE": type, "ADDRESS": "127.0.0.1", "PORT": get_port(local_proxy_server)}], client_protocol))
+            
+            self.run_future(client_protocol.lost_future)
+            
+            self.assertLess(client_protocol.received_length, len(data), type)
+    
+    def test_early_request_bodies(self):
+        # the body of a forwarded request which is received before the connection is made stops the reading of the client
+        upstream_server = self.create_upstream_server("SOCKS4", upstream.UpstreamFaults(delay=1.0))
+        local_proxy_server = self.create_local_proxy_server("HTTPS", upstream_server)
+        
+        client_protocol = upstream.ClientProtocol()
+        
+        self.run_future(self.create_client_connection(local_proxy_server, client_protocol))
+        
+        body_length = 16777216
+        
+        client_protocol.transport.write(b"POST http://127.0.0.1:8080/ HTTP/1.1\r\nContent-Length: " + str(body_length).encode() + b"\r\n\r\n")
+        client_protocol.transport.write(b"b" * body_length)
+        
+        self.loop.run_until_complete(asyncio.sleep(0.5))
+        
+        input_protocol, = local_proxy_server.input_protocol_factory.input_protocols
+        
+        # the reading stops after the read which passes maximum_early_data_length, a read is at most 262144 bytes
+        self.assertIsNotNone(input_protocol.request_data)
+        self.assertGreaterEqual(input_protocol.request_data_length, twunnel3.local_proxy_server.maximum_early_data_length)
+        self.assertLessEqual(input_protocol.request_data_length, twunnel3.local_proxy_server.maximum_early_data_length + 262144 + 1024)
+        self.assertGreaterEqual(input_protocol.buffer_account.data_size, input_protocol.request_data_length)
+        
+        client_protocol.transport.close()
+    
+    def test_slow_readers(self):
+        # a client which does not read stops the local proxy server from reading from its tunnel, so neither buffers what the proxy server sends
+        flood_length = 268435456
+        
+        for type in self.types:
+            upstream_server = self.create_upstream_server("SOCKS4", upstream.UpstreamFaults(flood_length=flood_length))
+            local_proxy_server = self.create_local_proxy_server(type, upstream_server)
+            
+            client_protocol = upstream.ClientProtocol()
+            
+            self.run_future(self.create_client_connection(local_proxy_server, client_protocol))
+            
+            client_protocol.transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+            client_protocol.transport.pause_reading()
+            client_protocol.transport.write(encode_request(type, 8080))
+            
+            # the proxy server sends until all buffers are full
+            upstream_flood_length = -1
+            while upstream_server.flood_length != upstream_flood_length:
+                upstream_flood_length = upstream_server.flood_length
+                
+                self.loop.run_until_complete(asyncio.sleep(0.2))
+            
+            input_protocol, = local_proxy_server.input_protocol_factory.input_protocols
+            
+            self.assertLess(upstream_server.flood_length, flood_length // 4, type)
+            
+            # the reading stops after the read which passes the budget, a read is at most 262144 bytes
+            self.assertLessEqual(input_protocol.transport.get_write_buffer_size(), twunnel3.buffer_pool.buffer_pool.maximum_connection_size + 262144, type)
+            self.assertLessEqual(input_protocol.buffer_account.data_size, twunnel3.buffer_pool.buffer_pool.maximum_connection_size + 262144, type)
+            
+            client_protocol.transport.close()
+    
+    def create_idle_tunnels(self, local_proxy_server, port, transports, length):
+        futures = []
+        
+        i = 0
+        while i < length:
+            futures.append(self.create_tunnel_connection([{"TYPE": "SOCKS5", "ADDRESS": "127.0.0.1", "PORT": get_port(local_proxy_server)}], IdleProtocol(transports), "127.0.0.1", port))
+            
+            i = i + 1
+        
+        self.run_future(asyncio.wait(futures))
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+    
+    def test_idle_tunnels(self):
+        transports = []
+        
+        idle_server = self.run_future(self.loop.create_server(lambda: IdleProtocol(transports), "127.0.0.1", 0))
+        port = idle_server.sockets[0].getsockname()[1]
+        
+        local_proxy_server = upstream.TestCase.create_local_proxy_server(self, "SOCKS5", [])
+        
+        # the first tunnels fill the caches of the tunnels and of the event loop
+        self.create_idle_tunnels(local_proxy_server, port, transports, 50)
+        
+        length = 500
+        
+        gc.collect()
+        tracemalloc.start()
+        
+        try:
+            size1, maximum_size1 = tracemalloc.get_traced_memory()
+            
+            self.create_idle_tunnels(local_proxy_server, port, transports, length)
+            
+            gc.collect()
+            
+            size2, maximum_size2 = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        self.assertEqual(len(transports), (50 + length) * 2)
+        self.assertLess((size2 - size1) // length, maximum_idle_tunnel_size)
+        
+        for transport in transports:
+            transport.close()
+        
+        idle_server.close()
+    
+    def test_closed_mux_streams(self):
+        # a remote server which closes its connection after its response, the stream is closed once the whole response is sent
+        flood_length = 3000000
+        
+        for compression_type in ["", "ZLIB"]:
+            upstream_server = self.create_upstream_server("SOCKS4", upstream.UpstreamFaults(flood_length=flood_length))
+            local_proxy_server = self.create_local_proxy_server("MUX", upstream_server)
+            
+            client_protocol = upstream.ClientProtocol()
+            
+            self.run_future(self.create_tunnel_connection([{"TYPE": "MUX", "ADDRESS": "127.0.0.1", "PORT": get_port(local_proxy_server), "COMPRESSION": {"TYPE": compression_type}}], client_protocol, "127.0.0.1", 8080))
+            
+            self.assertEqual(len(self.run_future(client_protocol.received_future)), flood_length, compression_type)
+
+class HTTPSInputProtocolTestCase(upstream.TestCase):
+    def create_protocol(self, type):
+        configuration = twunnel3.configuration.get_configuration({"PROXY_SERVERS": [], "LOCAL_PROXY_SERVER": {"TYPE": type, "ADDRESS": "127.0.0.1", "PORT": 0}})
+        
+        input_protocol_factory = twunnel3.local_proxy_server.get_input_protocol_factory_class(type)(configuration)
+        
+        protocol = input_protocol_factory()
+        protocol.connection_made(upstream.FakeTransport())
+        
+        return protocol
+    
+    def parse_request(self, length):
+        # the request is not a CONNECT request and not a request of an absolute uri, so it gets its reply without a connection
+        request = b"GET / HTTP/1.1\r\nX-Header: " + b"x" * length + b"\r\n\r\n"
+        
+        protocol = self.create_protocol("HTTPS")
+        transport = protocol.transport
+        
+        t = time.perf_counter()
+        
+        # the request is received one byte at a time, the worst case of a fragmented request
+        i = 0
+        while i < len(request):
+            protocol.data_received(request[i:i + 1])
+            
+            i = i + 1
+        
+        t = time.perf_counter() - t
+        
+        self.assertTrue(transport.data.startswith(b"HTTP/1.1 405 Method Not Allowed\r\n"))
+        
+        protocol.connection_lost(None)
+        
+        return t
+    
+    def test_parsing_is_linear(self):
+        # a request of 4 times the length takes about 4 times as long, a parser which copies or searches the whole request for every byte takes more than 10 times as long
+        t1 = min(self.parse_request(15000) for i in range(3))
+        t4 = min(self.parse_request(60000) for i in range(3))
+        
+        self.assertLess(t4, t1 * 8)
+    
+    def test_requests_are_bounded(self):
+        protocol = self.create_protocol("HTTPS")
+        transport = protocol.transport
+        
+        protocol.data_received(b"CONNECT 127.0.0.1:443 HTTP/1.1\r\n")
+        
+        i = 0
+        while i < 100 and transport.closed == False:
+            protocol.data_received(b"X-Header: " + b"x" * 1000 + b"\r\n")
+            
+            i = i + 1
+        
+        self.assertTrue(transport.data.startswith(b"HTTP/1.1 431 Request Header Fields Too Large\r\n"))
+        self.assertLessEqual(i, twunnel3.local_proxy_server.maximum_request_length // 1012 + 1)
+        
+        protocol.connection_lost(None)
+        
+        protocol = self.create_protocol("SOCKS4")
+        transport = protocol.transport
+        
+        protocol.data_received(struct.pack("!BBH4s", 0x04, 0x01, 443, socket.inet_aton("127.0.0.1")))
+        
+        i = 0
+        while i < 100 and transport.closed == False:
+            protocol.data_received(b"x" * 1000)
+            
+            i = i + 1
+        
+        self.assertEqual(transport.data, b"\x00\x5b\x00\x00\x00\x00\x00\x00")
+        self.assertLessEqual(i, twunnel3.local_proxy_server.maximum_request_length // 1000 + 1)
+        
+        protocol.connection_lost(None)
\ No newline at end of file
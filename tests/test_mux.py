@@ -0,0 +1,177 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import socket
+import unittest
+import twunnel3.compression
+import twunnel3.configuration
+import twunnel3.local_proxy_server
+import twunnel3.mux
+import twunnel3.proxy_server
+from tests import upstream
+
+def encode_frame(frame_type, frame_flags, stream_id, payload):
+    return twunnel3.mux.frame_header.pack(frame_type, frame_flags, stream_id, len(payload)) + payload
+
+def decode_frames(data):
+    frames = []
+    
+    i = 0
+    while i < len(data):
+        frame_type, frame_flags, stream_id, length = twunnel3.mux.frame_header.unpack_from(data, i)
+        
+        i = i + twunnel3.mux.frame_header.size
+        
+        frames.append((frame_type, frame_flags, stream_id, data[i:i + length]))
+        
+        i = i + length
+    
+    return frames
+
+class MUXInputProtocolTestCase(upstream.TestCase):
+    def create_protocol(self):
+        configuration = twunnel3.configuration.get_configuration({"PROXY_SERVERS": [], "LOCAL_PROXY_SERVER": {"TYPE": "MUX", "ADDRESS": "127.0.0.1", "PORT": 0}})
+        
+        input_protocol_factory = twunnel3.local_proxy_server.get_input_protocol_factory_class("MUX")(configuration)
+        
+        protocol = input_protocol_factory()
+        protocol.connection_made(upstream.FakeTransport())
+        
+        return protocol
+    
+    def test_streams_are_bounded(self):
+        # the connections of the streams are refused, a port which is not listened on
+        port_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        port_socket.bind(("127.0.0.1", 0))
+        port = port_socket.getsockname()[1]
+        port_socket.close()
+        
+        protocol = self.create_protocol()
+        transport = protocol.transport
+        
+        data = encode_frame(twunnel3.mux.FRAME_HELLO, 0, 0, b"\x01\x00\x00")
+        
+        # the connections of the streams are refused later, so all streams are open at once
+        i = 0
+        while i <= twunnel3.mux.maximum_streams:
+            data = data + encode_frame(twunnel3.mux.FRAME_OPEN, 0, i * 2 + 1, twunnel3.mux.open_struct.pack(262144, port, 9) + b"127.0.0.1")
+            
+            i = i + 1
+        
+        protocol.data_received(data)
+        
+        frames = decode_frames(transport.data)
+        
+        self.assertEqual(len(protocol.streams), twunnel3.mux.maximum_streams)
+        self.assertEqual(frames[-1], (twunnel3.mux.FRAME_OPEN_REPLY, 0, twunnel3.mux.maximum_streams * 2 + 1, twunnel3.mux.open_reply_struct.pack(0x01, 0)))
+        self.assertFalse(transport.closed)
+        
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        
+        self.assertEqual(len(protocol.streams), 0)
+        
+        protocol.connection_lost(None)
+    
+    def test_frames_of_the_wrong_length(self):
+        protocol = self.create_protocol()
+        transport = protocol.transport
+        
+        data = encode_frame(twunnel3.mux.FRAME_HELLO, 0, 0, b"\x01\x00\x00")
+        data = data + encode_frame(twunnel3.mux.FRAME_OPEN, 0, 1, twunnel3.mux.open_struct.pack(262144, 80, 9) + b"127.0.0.1")
+        
+        # a WINDOW_UPDATE frame which is too short closes the session instead of raising struct.error
+        protocol.data_received(data + encode_frame(twunnel3.mux.FRAME_WINDOW_UPDATE, 0, 1, b"\x00\x00\x01"))
+        
+        self.assertTrue(transport.closed)
+        self.assertEqual(len(protocol.data), 0)
+        
+        protocol.connection_lost(None)
+    
+    def test_receive_windows_are_bounded(self):
+        protocol = self.create_protocol()
+        transport = protocol.transport
+        
+        data = encode_frame(twunnel3.mux.FRAME_HELLO, 0, 0, b"\x01\x00\x00")
+        data = data + encode_frame(twunnel3.mux.FRAME_OPEN, 0, 1, twunnel3.mux.open_struct.pack(262144, 80, 9) + b"127.0.0.1")
+        
+        # the stream is paused until its connection is made, so the data waits in the receive window
+        i = 0
+        while i < protocol.window // 65536:
+            data = data + encode_frame(twunnel3.mux.FRAME_DATA, 0, 1, b"d" * 65535)
+            
+            i = i + 1
+        
+        protocol.data_received(data)
+        
+        self.assertFalse(transport.closed)
+        
+        # a peer which ignores the flow control sends more than the receive window
+        protocol.data_received(encode_frame(twunnel3.mux.FRAME_DATA, 0, 1, b"d" * 65535))
+        
+        self.assertTrue(transport.closed)
+        self.assertLessEqual(protocol.streams[1].received_length, protocol.window)
+        
+        protocol.connection_lost(None)
+
+class MUXTunnelOutputProtocolTestCase(upstream.TestCase):
+    def test_frames_of_the_wrong_length(self):
+        protocol = twunnel3.mux.MUXTunnelOutputProtocol()
+        protocol.transport = upstream.FakeTransport()
+        protocol.connection_state = 1
+        protocol.add_stream(twunnel3.mux.MUXTunnelStream(protocol, 1, 0))
+        
+        # an OPEN_REPLY frame which is too long closes the session instead of raising struct.error
+        protocol.data_received(encode_frame(twunnel3.mux.FRAME_OPEN_REPLY, 0, 1, twunnel3.mux.open_reply_struct.pack(0x00, 262144) + b"\x00"))
+        
+        self.assertTrue(protocol.transport.closed)
+        self.assertEqual(len(protocol.data), 0)
+    
+    
+    def test_stream_ids_end(self):
+        upstream_server = self.create_upstream_server("SOCKS4")
+        local_proxy_server = self.create_local_proxy_server("MUX", [upstream_server.get_configuration()])
+        
+        # the tunnels of a configuration share its sessions
+        tunnel = twunnel3.proxy_server.create_tunnel({"PROXY_SERVERS": [{"TYPE": "MUX", "ADDRESS": "127.0.0.1", "PORT": local_proxy_server.sockets[0].getsockname()[1]}]})
+        
+        client_protocol1 = upstream.ClientProtocol(b"1", 1)
+        
+        self.run_future(tunnel.create_connection(lambda: client_protocol1, "127.0.0.1", 80))
+        
+        session1 = client_protocol1.transport.session
+        session1.stream_id = twunnel3.mux.maximum_stream_id
+        
+        # the session gets its last stream, the stream after it goes to a new session
+        client_protocol2 = upstream.ClientProtocol(b"2", 1)
+        client_protocol3 = upstream.ClientProtocol(b"3", 1)
+        
+        self.run_future(tunnel.create_connection(lambda: client_protocol2, "127.0.0.1", 80))
+        self.run_future(tunnel.create_connection(lambda: client_protocol3, "127.0.0.1", 80))
+        
+        self.assertIs(client_protocol2.transport.session, session1)
+        self.assertEqual(client_protocol2.transport.stream_id, twunnel3.mux.maximum_stream_id)
+        self.assertIsNot(client_protocol3.transport.session, session1)
+        self.assertEqual(self.run_future(client_protocol2.received_future), b"2")
+        
+        client_protocol1.transport.close()
+        client_protocol2.transport.close()
+        
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        
+        self.assertEqual(session1.connection_state, 2)
+        self.assertEqual(client_protocol3.transport.session.connection_state, 1)
+        
+        client_protocol3.transport.close()
+
+class DecompressorTestCase(unittest.TestCase):
+    def test_decompression_is_bounded(self):
+        compressor = twunnel3.compression.ZLIBCompressor(3)
+        decompressor = twunnel3.compression.ZLIBDecompressor()
+        
+        data = b"d" * twunnel3.mux.maximum_compression_length
+        
+        self.assertEqual(decompressor.decompress(compressor.compress(data), twunnel3.mux.maximum_compression_length), data)
+        
+        # a frame of less than 65535 bytes which decompresses to 32 MB
+        self.assertIsNone(decompressor.decompress(compressor.compress(b"\x00" * 33554432), twunnel3.mux.maximum_compression_length))
\ No newline at end of file
@@ -0,0 +1,223 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import time
+import twunnel3.address
+import twunnel3.configuration
+import twunnel3.proxy_server
+from tests import upstream
+
+def get_proxy_server_configuration(upstream_server, optimistic=False):
+    configuration = upstream_server.get_configuration()
+    configuration["OPTIMISTIC"] = optimistic
+    return configuration
+
+class FakeTunnelProtocol(object):
+    # the tunnel protocol of a tunnel output protocol which is fed directly
+    def __init__(self):
+        self.address = twunnel3.address.get_address("127.0.0.1")
+        self.port = 80
+        self.data = None
+    
+    def tunnel_output_protocol__connection_made(self, transport, data):
+        self.data = data
+
+class TunnelTestCase(upstream.TestCase):
+    types = ["HTTPS", "SOCKS4", "SOCKS5"]
+    
+    def check_tunnel(self, faults, optimistic=False):
+        for type in self.types:
+            upstream_server = self.create_upstream_server(type, faults)
+            
+            data = b"d" * 100000
+            client_protocol = upstream.ClientProtocol(data, len(data))
+            
+            transport, output_protocol = self.run_future(self.create_tunnel_connection([get_proxy_server_configuration(upstream_server, optimistic)], client_protocol, "127.0.0.1", 8080))
+            
+            self.assertIs(output_protocol, client_protocol)
+            self.assertEqual(self.run_future(client_protocol.received_future), data, type)
+            self.assertEqual(upstream_server.requests[0][:2], ("127.0.0.1", 8080), type)
+            
+            client_protocol.transport.close()
+    
+    def check_refused_tunnel(self, types, faults, optimistic=False):
+        for type in types:
+            upstream_server = self.create_upstream_server(type, faults)
+            
+            client_protocol = upstream.ClientProtocol(b"d" * 1000)
+            
+            future = self.create_tunnel_connection([get_proxy_server_configuration(upstream_server, optimistic)], client_protocol)
+            
+            if optimistic == True:
+                # the output protocol of an optimistic proxy server is made before the reply, it loses its connection
+                self.run_future(future)
+                
+                self.assertIsInstance(self.run_future(client_protocol.lost_future), ConnectionRefusedError, type)
+            else:
+                with self.assertRaises(ConnectionRefusedError, msg=type):
+                    self.run_future(future)
+                
+                self.assertIsNone(client_protocol.transport, type)
+    
+    def test_tunnels(self):
+        self.check_tunnel(upstream.UpstreamFaults())
+    
+    def test_fragmented_replies(self):
+        self.check_tunnel(upstream.UpstreamFaults(fragment_length=1))
+    
+    def test_delayed_replies(self):
+        t = time.time()
+        
+        self.check_tunnel(upstream.UpstreamFaults(delay=0.1, fragment_length=3))
+        
+        self.assertGreaterEqual(time.time() - t, 0.3)
+    
+    def test_optimistic_tunnels(self):
+        self.check_tunnel(upstream.UpstreamFaults(fragment_length=1), True)
+    
+    def test_refused_authentication(self):
+        self.check_refused_tunnel(["HTTPS", "SOCKS5"], upstream.UpstreamFaults(refuse_authentication=True))
+        self.check_refused_tunnel(["HTTPS", "SOCKS5"], upstream.UpstreamFaults(refuse_authentication=True, fragment_length=1))
+    
+    def test_refused_connections(self):
+        self.check_refused_tunnel(self.types, upstream.UpstreamFaults(refuse_connection=True))
+        self.check_refused_tunnel(self.types, upstream.UpstreamFaults(refuse_connection=True, fragment_length=1, delay=0.05))
+    
+    def test_optimistic_refused_connections(self):
+        self.check_refused_tunnel(self.types, upstream.UpstreamFaults(refuse_connection=True), True)
+    
+    def test_reset_connections(self):
+        for type in self.types:
+            upstream_server = self.create_upstream_server(type, upstream.UpstreamFaults(reset_length=10000))
+            
+            data = b"d" * 1000000
+            client_protocol = upstream.ClientProtocol(data, len(data))
+            
+            self.run_future(self.create_tunnel_connection([get_proxy_server_configuration(upstream_server)], client_protocol))
+            
+            self.run_future(client_protocol.lost_future)
+            
+            self.assertLess(client_protocol.received_length, len(data), type)
+    
+    def test_closed_proxy_server(self):
+        upstream_server = self.create_upstream_server("SOCKS4")
+        
+        port = upstream_server.port
+        
+        upstream_server.close()
+        
+        configuration = upstream_server.get_configuration()
+        configuration["PORT"] = port
+        
+        with self.assertRaises(ConnectionRefusedError):
+            self.run_future(self.create_tunnel_connection([configuration], upstream.ClientProtocol()))
+    
+    def test_failed_handshakes_of_group_members(self):
+        upstream_server1 = self.create_upstream_server("SOCKS4")
+        upstream_server2 = self.create_upstream_server("SOCKS4")
+        
+        port = upstream_server1.port
+        
+        upstream_server1.close()
+        
+        configuration1 = upstream_server1.get_configuration()
+        configuration1["PORT"] = port
+        
+        tunnel = twunnel3.proxy_server.create_tunnel({"PROXY_SERVERS": [{"TYPE": "GROUP", "STRATEGY": "POWER_OF_TWO_CHOICES", "PROXY_SERVERS": [configuration1, upstream_server2.get_configuration()]}]})
+        
+        # the member which refuses the connections is selected once at most, then its latency is raised
+        failures = 0
+        
+        i = 0
+        while i < 10:
+            client_protocol = upstream.ClientProtocol()
+            
+            try:
+                self.run_future(tunnel.create_connection(lambda: client_protocol, "127.0.0.1", 80))
+                
+                client_protocol.transport.close()
+            except ConnectionRefusedError:
+                failures = failures + 1
+            
+            i = i + 1
+        
+        self.assertLessEqual(failures, 1)
+        self.assertEqual(len(upstream_server2.requests), 10 - failures)
+    
+    def test_factories_of_reloaded_configurations(self):
+        upstream_server = self.create_upstream_server("SOCKS4")
+        
+        factories = []
+        
+        for configuration in [twunnel3.configuration.create_configuration({"PROXY_SERVERS": [upstream_server.get_configuration()]}) for i in range(2)]:
+            tunnel = twunnel3.proxy_server.create_tunnel(configuration)
+            
+            i = 0
+            while i < 2:
+                client_protocol = upstream.ClientProtocol()
+                
+                self.run_future(tunnel.create_connection(lambda: client_protocol, "127.0.0.1", 80))
+                
+                client_protocol.transport.close()
+                
+                i = i + 1
+            
+            # the connections through a configuration share its factory, a reloaded configuration gets its own
+            self.assertIs(configuration.proxy_servers[0].tunnel_output_protocol_factory.configuration, configuration.proxy_servers[0])
+            
+            factories.append(configuration.proxy_servers[0].tunnel_output_protocol_factory)
+        
+        self.assertIsNot(factories[0], factories[1])
+
+class HTTPSTunnelOutputProtocolTestCase(upstream.TestCase):
+    def create_protocol(self):
+        configuration = twunnel3.configuration.get_configuration({"PROXY_SERVERS": [{"TYPE": "HTTPS", "ADDRESS": "127.0.0.1", "PORT": 8080}]})
+        
+        protocol = twunnel3.proxy_server.HTTPSTunnelOutputProtocolFactory(configuration.proxy_servers[0])()
+        protocol.tunnel_protocol = FakeTunnelProtocol()
+        protocol.connection_made(upstream.FakeTransport())
+        
+        return protocol
+    
+    def parse_reply(self, length):
+        reply = b"HTTP/1.1 200 Connection established\r\nX-Header: " + b"x" * length + b"\r\n\r\n"
+        
+        protocol = self.create_protocol()
+        
+        t = time.perf_counter()
+        
+        # the reply is received one byte at a time, the worst case of a fragmented reply
+        i = 0
+        while i < len(reply):
+            protocol.data_received(reply[i:i + 1])
+            
+            i = i + 1
+        
+        t = time.perf_counter() - t
+        
+        self.assertEqual(protocol.tunnel_protocol.data, b"")
+        
+        protocol.transport.close()
+        
+        return t
+    
+    def test_parsing_is_linear(self):
+        # a reply of 4 times the length takes about 4 times as long, a parser which copies or searches the whole reply for every byte takes more than 10 times as long
+        t1 = min(self.parse_reply(15000) for i in range(3))
+        t4 = min(self.parse_reply(60000) for i in range(3))
+        
+        self.assertLess(t4, t1 * 8)
+    
+    def test_reply_is_bounded(self):
+        protocol = self.create_protocol()
+        
+        protocol.data_received(b"HTTP/1.1 200 Connection established\r\n")
+        
+        i = 0
+        while i < 100 and protocol.transport.closed == False:
+            protocol.data_received(b"X-Header: " + b"x" * 1000 + b"\r\n")
+            
+            i = i + 1
+        
+        self.assertTrue(protocol.transport.closed)
+        self.assertLessEqual(len(protocol.data), twunnel3.proxy_server.maximum_head_length + 1012)
\ No newline at end of file
@@ -0,0 +1,91 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import unittest
+import twunnel3.configuration
+import twunnel3.proxy_server_group
+
+def create_group_configuration(weights, strategy="WEIGHTED_ROUND_ROBIN"):
+    proxy_servers = []
+    
+    i = 0
+    while i < len(weights):
+        proxy_servers.append({"TYPE": "SOCKS5", "ADDRESS": "127.0.0.1", "PORT": 1080 + i, "WEIGHT": weights[i]})
+        
+        i = i + 1
+    
+    return twunnel3.configuration.create_proxy_server_configuration({"TYPE": "GROUP", "STRATEGY": strategy, "PROXY_SERVERS": proxy_servers})
+
+def select_ports(proxy_server_group, length):
+    ports = []
+    
+    i = 0
+    while i < length:
+        ports.append(proxy_server_group.select_proxy_server_group_member("127.0.0.1", 80).configuration.port)
+        
+        i = i + 1
+    
+    return ports
+
+class WeightedRoundRobinStrategyTestCase(unittest.TestCase):
+    def test_selections_are_smooth(self):
+        proxy_server_group = twunnel3.proxy_server_group.ProxyServerGroup(create_group_configuration([5, 1, 1]))
+        
+        # a member of weight 5 is not selected 5 times in a row
+        self.assertEqual(select_ports(proxy_server_group, 14), [1080, 1081, 1080, 1080, 1082, 1080, 1080, 1081, 1080, 1080, 1080, 1082, 1080, 1080])
+        
+        ports = select_ports(proxy_server_group, 7000)
+        
+        self.assertEqual([ports.count(1080), ports.count(1081), ports.count(1082)], [5000, 1000, 1000])
+        
+        i = 0
+        while i < len(ports) - 3:
+            self.assertNotEqual(ports[i:i + 4], [1080] * 4)
+            
+            i = i + 1
+    
+    def test_selections_follow_the_members(self):
+        configuration = create_group_configuration([1, 2])
+        
+        proxy_server_group = twunnel3.proxy_server_group.ProxyServerGroup(configuration)
+        
+        proxy_server_group.remove_proxy_server(configuration.proxy_servers[1])
+        
+        self.assertEqual(select_ports(proxy_server_group, 3), [1080, 1080, 1080])
+        
+        proxy_server_group.add_proxy_server({"TYPE": "SOCKS5", "ADDRESS": "127.0.0.1", "PORT": 1090, "WEIGHT": 3})
+        
+        self.assertEqual(sorted(select_ports(proxy_server_group, 8)), [1080, 1080, 1090, 1090, 1090, 1090, 1090, 1090])
+
+class PowerOfTwoChoicesStrategyTestCase(unittest.TestCase):
+    def test_selections_without_latencies(self):
+        proxy_server_group = twunnel3.proxy_server_group.ProxyServerGroup(create_group_configuration([1, 1], "POWER_OF_TWO_CHOICES"))
+        proxy_server_group.members[0].active_connections = 3
+        
+        # the latencies are not known yet, so the member with fewer connections is selected
+        self.assertEqual(select_ports(proxy_server_group, 10), [1081] * 10)
+    
+    def test_selections_after_failed_handshakes(self):
+        proxy_server_group = twunnel3.proxy_server_group.ProxyServerGroup(create_group_configuration([1, 1], "POWER_OF_TWO_CHOICES"))
+        proxy_server_group.members[0].handshake_failed()
+        proxy_server_group.members[1].handshake_made(0.01)
+        proxy_server_group.members[1].active_connections = 10
+        
+        self.assertGreaterEqual(proxy_server_group.members[0].get_latency(), twunnel3.proxy_server_group.failed_handshake_latency)
+        self.assertEqual(select_ports(proxy_server_group, 10), [1081] * 10)
+        
+        # a new member starts with the latency of the group
+        proxy_server_group.add_proxy_server({"TYPE": "SOCKS5", "ADDRESS": "127.0.0.1", "PORT": 1090})
+        
+        self.assertEqual(proxy_server_group.members[2].get_latency(), 0.01)
+
+class ProxyServerGroupTestCase(unittest.TestCase):
+    def test_groups_are_kept_by_their_configuration(self):
+        configuration1 = create_group_configuration([1, 1])
+        configuration2 = create_group_configuration([1, 1])
+        
+        proxy_server_group1 = twunnel3.proxy_server_group.get_proxy_server_group(configuration1)
+        
+        self.assertIs(twunnel3.proxy_server_group.get_proxy_server_group(configuration1), proxy_server_group1)
+        self.assertIs(configuration1.proxy_server_group, proxy_server_group1)
+        self.assertIsNot(twunnel3.proxy_server_group.get_proxy_server_group(configuration2), proxy_server_group1)
\ No newline at end of file
@@ -0,0 +1,496 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import base64
+import socket
+import struct
+import unittest
+import twunnel3.local_proxy_server
+import twunnel3.logger
+import twunnel3.proxy_server
+
+# the parts of a fragmented reply are written one after the other with this interval, so they are read one by one
+fragment_interval = 0.002
+
+flood_data = b"f" * 65536
+
+class UpstreamFaults(object):
+    def __init__(self, fragment_length=0, delay=0.0, refuse_authentication=False, refuse_connection=False, reset_length=0, flood_length=0):
+        # the replies of the handshake are written in parts of fragment_length bytes, 0 is at once
+        self.fragment_length = fragment_length
+        # the replies of the handshake are written after delay seconds
+        self.delay = delay
+        # SOCKS5 replies 0x01 to the authentication and HTTPS replies 407
+        self.refuse_authentication = refuse_authentication
+        # SOCKS4 replies 0x5b, SOCKS5 replies 0x01 and HTTPS replies 502 to the request
+        self.refuse_connection = refuse_connection
+        # the connection is reset after it received reset_length bytes after the handshake, 0 is never
+        self.reset_length = reset_length
+        # flood_length bytes are sent after the handshake instead of echoing the data, with flow control
+        self.flood_length = flood_length
+
+class UpstreamProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.faults = server.faults
+        self.data = b""
+        self.data_state = 0
+        self.data_length = 0
+        self.replies = []
+        self.replies_handle = None
+        self.flood_length = 0
+        self.writing_paused = False
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        # every part of a fragmented reply is sent as its own segment
+        transport.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        self.server.protocols.append(self)
+    
+    def connection_lost(self, exception):
+        if self.replies_handle is not None:
+            self.replies_handle.cancel()
+            self.replies_handle = None
+        
+        self.transport = None
+    
+    def pause_writing(self):
+        self.writing_paused = True
+    
+    def resume_writing(self):
+        self.writing_paused = False
+        
+        self.write_flood()
+    
+    def data_received(self, data):
+        if self.data_state == 3:
+            self.relay_data(data)
+            
+            return
+        
+        self.data = self.data + data
+        
+        while self.transport is not None and self.data_state != 3:
+            if self.server.type == "HTTPS":
+                if self.process_https_request() == False:
+                    return
+            else:
+                if self.server.type == "SOCKS4":
+                    if self.process_socks4_request() == False:
+                        return
+                else:
+                    if self.process_socks5_request() == False:
+                        return
+        
+        # the data which was sent after the request is relayed after the reply
+        if self.data_state == 3 and len(self.data) > 0:
+            data = self.data
+            
+            self.data = b""
+            
+            self.relay_data(data)
+    
+    def process_https_request(self):
+        i = self.data.find(b"\r\n\r\n")
+        
+        if i == -1:
+            return False
+        
+        request = self.data[:i]
+        
+        self.data = self.data[i + 4:]
+        
+        request_lines = request.split(b"\r\n")
+        method, uri, version = request_lines[0].split(b" ", 2)
+        address, separator, port = uri.rpartition(b":")
+        
+        authorization = b""
+        for request_line in request_lines[1:]:
+            name, separator, value = request_line.partition(b":")
+            
+            if name.strip().lower() == b"proxy-authorization":
+                authorization = value.strip()
+        
+        self.server.requests.append((address.decode(), int(port), authorization))
+        
+        if self.faults.refuse_authentication == True or (self.server.name != "" and authorization != b"Basic " + base64.standard_b64encode((self.server.name + ":" + self.server.password).encode())):
+            self.write_reply(b"HTTP/1.1 407 Proxy Authentication Required\r\n\r\n", True)
+            
+            return False
+        
+        if self.faults.refuse_connection == True:
+            self.write_reply(b"HTTP/1.1 502 Bad Gateway\r\n\r\n", True)
+            
+            return False
+        
+        self.write_reply(b"HTTP/1.1 200 Connection established\r\n\r\n", False)
+        
+        self.data_state = 3
+        
+        return True
+    
+    def process_socks4_request(self):
+        if len(self.data) < 8:
+            return False
+        
+        version, command, port, address = struct.unpack("!BBH4s", self.data[:8])
+        
+        data = self.data[8:]
+        
+        if b"\x00" not in data:
+            return False
+        
+        name, data = data.split(b"\x00", 1)
+        
+        if address[:3] == b"\x00\x00\x00" and address[3] != 0:
+            if b"\x00" not in data:
+                return False
+            
+            address, data = data.split(b"\x00", 1)
+            address = address.decode()
+        else:
+            address = socket.inet_ntoa(address)
+        
+        self.data = data
+        
+        self.server.requests.append((address, port, name))
+        
+        if self.faults.refuse_connection == True:
+            self.write_reply(struct.pack("!BBHI", 0x00, 0x5b, 0, 0), True)
+            
+            return False
+        
+        self.write_reply(struct.pack("!BBHI", 0x00, 0x5a, 0, 0), False)
+        
+        self.data_state = 3
+        
+        return True
+    
+    def process_socks5_request(self):
+        if self.data_state == 0:
+            if len(self.data) < 2 or len(self.data) < 2 + self.data[1]:
+                return False
+            
+            methods = self.data[2:2 + self.data[1]]
+            
+            self.data = self.data[2 + self.data[1]:]
+            
+            if self.server.name != "":
+                if 0x02 not in methods:
+                    self.write_reply(b"\x05\xff", True)
+                    
+                    return False
+                
+                self.write_reply(b"\x05\x02", False)
+                
+                self.data_state = 1
+            else:
+                self.write_reply(b"\x05\x00", False)
+                
+                self.data_state = 2
+            
+            return True
+        
+        if self.data_state == 1:
+            if len(self.data) < 2 or len(self.data) < 3 + self.data[1] or len(self.data) < 3 + self.data[1] + self.data[2 + self.data[1]]:
+                return False
+            
+            name = self.data[2:2 + self.data[1]]
+            password = self.data[3 + self.data[1]:3 + self.data[1] + self.data[2 + self.data[1]]]
+            
+            self.data = self.data[3 + self.data[1] + self.data[2 + self.data[1]]:]
+            
+            if self.faults.refuse_authentication == True or name != self.server.name.encode() or password != self.server.password.encode():
+                self.write_reply(b"\x01\x01", True)
+                
+                return False
+            
+            self.write_reply(b"\x01\x00", False)
+            
+            self.data_state = 2
+            
+            return True
+        
+        if len(self.data) < 5:
+            return False
+        
+        if self.data[3] == 0x01:
+            request_length = 10
+        else:
+            if self.data[3] == 0x03:
+                request_length = 7 + self.data[4]
+            else:
+                request_length = 22
+        
+        if len(self.data) < request_length:
+            return False
+        
+        if self.data[3] == 0x01:
+            address = socket.inet_ntoa(self.data[4:8])
+        else:
+            if self.data[3] == 0x03:
+                address = self.data[5:5 + self.data[4]].decode()
+            else:
+                address = socket.inet_ntop(socket.AF_INET6, self.data[4:20])
+        
+        port, = struct.unpack("!H", self.data[request_length - 2:request_length])
+        
+        self.data = self.data[request_length:]
+        
+        self.server.requests.append((address, port, b""))
+        
+        if self.faults.refuse_connection == True:
+            self.write_reply(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00", True)
+            
+            return False
+        
+        self.write_reply(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00", False)
+        
+        self.data_state = 3
+        
+        return True
+    
+    def write_reply(self, reply, close):
+        # the replies keep their order, also when the client sends its requests without waiting for the replies
+        if self.faults.fragment_length > 0:
+            i = 0
+            while i < len(reply):
+                self.replies.append(reply[i:i + self.faults.fragment_length])
+                
+                i = i + self.faults.fragment_length
+        else:
+            self.replies.append(reply)
+        
+        if close == True:
+            self.replies.append(None)
+        
+        if self.replies_handle is None:
+            self.replies_handle = asyncio.get_event_loop().call_later(self.faults.delay, self.write_replies)
+    
+    def write_replies(self):
+        self.replies_handle = None
+        
+        if self.transport is None:
+            return
+        
+        reply = self.replies.pop(0)
+        
+        if reply is None:
+            self.transport.close()
+            
+            return
+        
+        self.transport.write(reply)
+        
+        if len(self.replies) > 0:
+            if self.faults.fragment_length > 0:
+                self.replies_handle = asyncio.get_event_loop().call_later(fragment_interval, self.write_replies)
+            else:
+                self.write_replies()
+            
+            return
+        
+        if self.data_state == 3 and self.faults.flood_length > 0:
+            self.write_flood()
+    
+    def relay_data(self, data):
+        self.data_length = self.data_length + len(data)
+        self.server.data_length = self.server.data_length + len(data)
+        
+        if self.faults.reset_length > 0 and self.data_length >= self.faults.reset_length:
+            self.transport.abort()
+            
+            return
+        
+        if self.faults.flood_length > 0:
+            return
+        
+        if len(self.replies) > 0:
+            self.replies.append(data)
+        else:
+            self.transport.write(data)
+    
+    def write_flood(self):
+        while self.transport is not None and self.writing_paused == False and self.flood_length < self.faults.flood_length:
+            data = flood_data[:self.faults.flood_length - self.flood_length]
+            
+            self.transport.write(data)
+            
+            self.flood_length = self.flood_length + len(data)
+            self.server.flood_length = self.server.flood_length + len(data)
+        
+        if self.transport is not None and self.flood_length == self.faults.flood_length:
+            self.transport.close()
+
+class UpstreamServer(object):
+    # an in-process HTTPS, SOCKS4 or SOCKS5 proxy server which acts as the remote server of its tunnels, with faults
+    def __init__(self, type, faults=None, name="", password=""):
+        self.type = type
+        self.faults = faults or UpstreamFaults()
+        self.name = name
+        self.password = password
+        self.requests = []
+        self.protocols = []
+        self.data_length = 0
+        self.flood_length = 0
+        self.server = None
+        self.port = 0
+    
+    def create_server(self):
+        future = asyncio.async(asyncio.get_event_loop().create_server(lambda: UpstreamProtocol(self), "127.0.0.1", 0))
+        
+        def create_server_done(future):
+            if future.cancelled() == False and future.exception() is None:
+                self.server = future.result()
+                self.port = self.server.sockets[0].getsockname()[1]
+        
+        future.add_done_callback(create_server_done)
+        
+        return future
+    
+    def get_configuration(self):
+        return {"TYPE": self.type, "ADDRESS": "127.0.0.1", "PORT": self.port, "ACCOUNT": {"NAME": self.name, "PASSWORD": self.password}}
+    
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        
+        for protocol in self.protocols:
+            if protocol.transport is not None:
+                protocol.transport.abort()
+
+class ClientProtocol(asyncio.Protocol):
+    # the protocol of a tunnel, it collects the data until length bytes are received
+    def __init__(self, data=b"", length=0):
+        self.data = data
+        self.length = length
+        self.received_data = []
+        self.received_length = 0
+        self.received_future = asyncio.Future()
+        self.lost_future = asyncio.Future()
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        if len(self.data) > 0:
+            self.transport.write(self.data)
+    
+    def connection_lost(self, exception):
+        self.transport = None
+        
+        if self.received_future.done() == False:
+            self.received_future.set_result(b"".join(self.received_data))
+        
+        self.lost_future.set_result(exception)
+    
+    def data_received(self, data):
+        self.received_data.append(data)
+        self.received_length = self.received_length + len(data)
+        
+        if self.received_future.done() == False and self.length > 0 and self.received_length >= self.length:
+            self.received_future.set_result(b"".join(self.received_data))
+
+class FakeTransport(object):
+    # a transport for protocols which are fed directly, its socket is never connected
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+        self.reading_paused = False
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    
+    def write(self, data):
+        self.data = self.data + bytes(data)
+    
+    def close(self):
+        self.closed = True
+        self.socket.close()
+    
+    def pause_reading(self):
+        self.reading_paused = True
+    
+    def resume_reading(self):
+        self.reading_paused = False
+    
+    def get_write_buffer_size(self):
+        return 0
+    
+    def get_extra_info(self, name, default=None):
+        if name == "socket":
+            return self.socket
+        
+        return default
+
+class TestCase(unittest.TestCase):
+    # every test gets its own event loop, the servers and the connections of the test are closed with it
+    timeout = 10.0
+    
+    def setUp(self):
+        twunnel3.logger.configure({"LOGGER": {"LEVEL": 0}})
+        
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        self.upstream_servers = []
+        self.local_proxy_servers = []
+    
+    def tearDown(self):
+        for upstream_server in self.upstream_servers:
+            upstream_server.close()
+        
+        for local_proxy_server in self.local_proxy_servers:
+            local_proxy_server.close()
+            
+            for input_protocol in list(local_proxy_server.input_protocol_factory.input_protocols):
+                if input_protocol.transport is not None:
+                    input_protocol.transport.abort()
+        
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        
+        asyncio.set_event_loop(None)
+    
+    def run_future(self, future, timeout=None):
+        return self.loop.run_until_complete(asyncio.wait_for(future, timeout or self.timeout))
+    
+    def create_upstream_server(self, type, faults=None):
+        # the SOCKS5 proxy servers authenticate, so their handshake has a state more
+        if type == "SOCKS5":
+            upstream_server = UpstreamServer(type, faults, "name", "password")
+        else:
+            upstream_server = UpstreamServer(type, faults)
+        
+        self.run_future(upstream_server.create_server())
+        
+        self.upstream_servers.append(upstream_server)
+        
+        return upstream_server
+    
+    def create_local_proxy_server(self, type, proxy_servers, accounts=None):
+        configuration = \
+        {
+            "PROXY_SERVERS": proxy_servers,
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": type,
+                "ADDRESS": "127.0.0.1",
+                "PORT": 0,
+                "ACCOUNTS": accounts or []
+            }
+        }
+        
+        local_proxy_server = self.run_future(twunnel3.local_proxy_server.create_server(configuration))
+        
+        self.local_proxy_servers.append(local_proxy_server)
+        
+        return local_proxy_server
+    
+    def create_tunnel_connection(self, proxy_servers, protocol, address="127.0.0.1", port=80):
+        tunnel = twunnel3.proxy_server.create_tunnel({"PROXY_SERVERS": proxy_servers})
+        
+        return asyncio.async(tunnel.create_connection(lambda: protocol, address, port))
\ No newline at end of file
@@ -0,0 +1,7 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import sys
+import twunnel3.cli
+
+sys.exit(twunnel3.cli.main())
\ No newline at end of file
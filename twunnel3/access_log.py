@@ -0,0 +1,278 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import collections
+import json
+import os
+import struct
+import threading
+import twunnel3.configuration
+import twunnel3.logger
+
+# the records which are not written yet are kept in a ring buffer of this length, the oldest are dropped when the writer falls behind
+maximum_records_length = 65536
+
+access_log_formats = ["JSON", "BINARY"]
+
+# the results of a connection: its tunnel was made, its requests were forwarded, its tunnel could not be made, its request was rejected, it was closed before, or its account was over its quota
+access_log_results = ["CONNECTED", "FORWARDED", "REFUSED", "REJECTED", "CLOSED", "QUOTA_EXCEEDED"]
+
+# a BINARY file starts with binary_header, then every record is its length, binary_record_struct and its strings, each with its length
+binary_header = b"TWUNNEL3 ACCESS LOG 1\n"
+binary_record_length_struct = struct.Struct("!H")
+binary_record_struct = struct.Struct("!ddQQHHB")
+binary_string_length_struct = struct.Struct("!B")
+
+class AccessLogRecord(object):
+    __slots__ = ("time", "duration", "type", "client_address", "client_port", "account", "remote_address", "remote_port", "proxy_servers", "input_length", "output_length", "result")
+    
+    def __init__(self, time, duration, type, client_address, client_port, account, remote_address, remote_port, proxy_servers, input_length, output_length, result):
+        self.time = time
+        self.duration = duration
+        self.type = type
+        self.client_address = client_address
+        self.client_port = client_port
+        self.account = account
+        self.remote_address = remote_address
+        self.remote_port = remote_port
+        self.proxy_servers = proxy_servers
+        self.input_length = input_length
+        self.output_length = output_length
+        self.result = result
+
+def encode_proxy_servers(proxy_servers):
+    encoded_proxy_servers = []
+    
+    for proxy_server in proxy_servers:
+        if proxy_server.path != "":
+            encoded_proxy_servers.append("%s %s" % (proxy_server.type, proxy_server.path))
+        else:
+            encoded_proxy_servers.append("%s %s:%d" % (proxy_server.type, proxy_server.address, proxy_server.port))
+    
+    return ",".join(encoded_proxy_servers)
+
+def encode_json_record(access_log_record):
+    record = \
+    {
+        "time": access_log_record.time,
+        "duration": access_log_record.duration,
+        "type": access_log_record.type,
+        "client_address": access_log_record.client_address,
+        "client_port": access_log_record.client_port,
+        "account": access_log_record.account,
+        "remote_address": access_log_record.remote_address,
+        "remote_port": access_log_record.remote_port,
+        "proxy_servers": encode_proxy_servers(access_log_record.proxy_servers),
+        "input_length": access_log_record.input_length,
+        "output_length": access_log_record.output_length,
+        "result": access_log_record.result
+    }
+    
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+def encode_binary_string(value):
+    value = value.encode()[:255]
+    
+    return binary_string_length_struct.pack(len(value)) + value
+
+def encode_binary_record(access_log_record):
+    record = binary_record_struct.pack(access_log_record.time, access_log_record.duration, access_log_record.input_length, access_log_record.output_length, access_log_record.remote_port, access_log_record.client_port, access_log_results.index(access_log_record.result))
+    
+    for value in (access_log_record.type, access_log_record.client_address, access_log_record.account, access_log_record.remote_address, encode_proxy_servers(access_log_record.proxy_servers)):
+        record = record + encode_binary_string(value)
+    
+    return binary_record_length_struct.pack(len(record)) + record
+
+def decode_binary_records(data):
+    # the records of a BINARY file, as the dictionaries of a JSON file
+    if data.startswith(binary_header) == False:
+        raise ValueError("data is not a binary access log")
+    
+    offset = len(binary_header)
+    
+    while offset + binary_record_length_struct.size <= len(data):
+        record_length, = binary_record_length_struct.unpack_from(data, offset)
+        
+        offset = offset + binary_record_length_struct.size
+        
+        if offset + record_length > len(data):
+            raise ValueError("data has an incomplete record")
+        
+        time, duration, input_length, output_length, remote_port, client_port, result = binary_record_struct.unpack_from(data, offset)
+        
+        string_offset = offset + binary_record_struct.size
+        
+        values = []
+        while len(values) < 5:
+            string_length = data[string_offset]
+            
+            values.append(data[string_offset + 1:string_offset + 1 + string_length].decode())
+            
+            string_offset = string_offset + 1 + string_length
+        
+        offset = offset + record_length
+        
+        yield {"time": time, "duration": duration, "type": values[0], "client_address": values[1], "client_port": client_port, "account": values[2], "remote_address": values[3], "remote_port": remote_port, "proxy_servers": values[4], "input_length": input_length, "output_length": output_length, "result": access_log_results[result]}
+
+class AccessLog(object):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: AccessLog.__init__")
+        
+        self.file = ""
+        self.format = "JSON"
+        self.maximum_file_size = 10485760
+        self.maximum_files = 5
+        self.batch_size = 1024
+        self.interval = 1.0
+        self.records = collections.deque(maxlen=maximum_records_length)
+        self.dropped_records = 0
+        self.failed_records = 0
+        self.written_records = 0
+        self.event = threading.Event()
+        self.thread = None
+    
+    def log(self, access_log_record):
+        twunnel3.logger.log(3, "trace: AccessLog.log")
+        
+        # the event loop only appends the record, the thread of the access log encodes and writes it
+        if len(self.records) == maximum_records_length:
+            self.dropped_records = self.dropped_records + 1
+        
+        self.records.append(access_log_record)
+        
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.write_records, args=(self.file, self.format, self.maximum_file_size, self.maximum_files), name="twunnel3 access log")
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            if len(self.records) == self.batch_size:
+                self.event.set()
+    
+    def write_records(self, file, format, maximum_file_size, maximum_files):
+        thread = self.thread
+        
+        access_log_file = None
+        error = False
+        
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            
+            records = []
+            while len(self.records) > 0:
+                records.append(self.records.popleft())
+            
+            if len(records) > 0:
+                if format == "JSON":
+                    data = b"".join(encode_json_record(record) for record in records)
+                else:
+                    data = b"".join(encode_binary_record(record) for record in records)
+                
+                # a full disk or a file which can not be written loses the records, but never blocks the event loop
+                try:
+                    access_log_file = self.write_data(access_log_file, file, format, maximum_file_size, maximum_files, data)
+                    
+                    self.written_records = self.written_records + len(records)
+                    
+                    error = False
+                except OSError as exception:
+                    self.failed_records = self.failed_records + len(records)
+                    
+                    if error == False:
+                        twunnel3.logger.log(1, "access log could not be written: %s" % str(exception))
+                    
+                    error = True
+                    
+                    if access_log_file is not None:
+                        try:
+                            access_log_file.close()
+                        except OSError:
+                            pass
+                        
+                        access_log_file = None
+            
+            if self.thread is not thread:
+                break
+        
+        if access_log_file is not None:
+            access_log_file.close()
+    
+    def write_data(self, access_log_file, file, format, maximum_file_size, maximum_files, data):
+        if access_log_file is None:
+            access_log_file = open(file, "ab")
+        
+        # the file is rotated like a RotatingFileHandler, file is renamed to file.1, file.1 to file.2 and so on
+        if maximum_file_size > 0 and access_log_file.tell() > 0 and access_log_file.tell() + len(data) > maximum_file_size:
+            access_log_file.close()
+            access_log_file = None
+            
+            i = maximum_files - 1
+            while i > 0:
+                if os.path.exists("%s.%d" % (file, i)) == True:
+                    os.replace("%s.%d" % (file, i), "%s.%d" % (file, i + 1))
+                
+                i = i - 1
+            
+            if maximum_files > 0:
+                os.replace(file, "%s.1" % file)
+            else:
+                os.remove(file)
+            
+            access_log_file = open(file, "ab")
+        
+        if format == "BINARY" and access_log_file.tell() == 0:
+            access_log_file.write(binary_header)
+        
+        access_log_file.write(data)
+        access_log_file.flush()
+        
+        return access_log_file
+    
+    def close(self):
+        twunnel3.logger.log(3, "trace: AccessLog.close")
+        
+        # the records which are left are written before the thread stops
+        thread = self.thread
+        
+        if thread is None:
+            return
+        
+        self.thread = None
+        self.event.set()
+        
+        thread.join(self.interval + 10)
+
+access_log = AccessLog()
+
+def configure(configuration):
+    access_log_configuration = twunnel3.configuration.get_dictionary(configuration, "ACCESS_LOG", "")
+    
+    # FILE is the file of the access log, "" is no access log
+    file = twunnel3.configuration.get_value(access_log_configuration, "FILE", "", "ACCESS_LOG.")
+    format = twunnel3.configuration.get_choice(access_log_configuration, "FORMAT", "JSON", access_log_formats, "ACCESS_LOG.")
+    maximum_file_size = twunnel3.configuration.get_value(access_log_configuration, "MAXIMUM_FILE_SIZE", 10485760, "ACCESS_LOG.")
+    maximum_files = twunnel3.configuration.get_value(access_log_configuration, "MAXIMUM_FILES", 5, "ACCESS_LOG.")
+    batch_size = twunnel3.configuration.get_value(access_log_configuration, "BATCH_SIZE", 1024, "ACCESS_LOG.")
+    interval = twunnel3.configuration.get_value(access_log_configuration, "INTERVAL", 1.0, "ACCESS_LOG.")
+    
+    if maximum_file_size < 0:
+        raise ValueError("ACCESS_LOG.MAXIMUM_FILE_SIZE must be 0 or more")
+    
+    if maximum_files < 0:
+        raise ValueError("ACCESS_LOG.MAXIMUM_FILES must be 0 or more")
+    
+    if batch_size < 1:
+        raise ValueError("ACCESS_LOG.BATCH_SIZE must be 1 or more")
+    
+    if interval <= 0:
+        raise ValueError("ACCESS_LOG.INTERVAL must be more than 0")
+    
+    # a running thread keeps the file and the format it was started with
+    access_log.close()
+    
+    access_log.file = file
+    access_log.format = format
+    access_log.maximum_file_size = maximum_file_size
+    access_log.maximum_files = maximum_files
+    access_log.batch_size = batch_size
+    access_log.interval = interval
\ No newline at end of file
@@ -0,0 +1,332 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import json
+import os
+import time
+import twunnel3.configuration
+import twunnel3.logger
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+accounting_formats = ["JSON", "SQLITE"]
+
+# the usage of an account is counted per PERIOD, "" is one period since the FILE was created
+accounting_periods = ["", "DAY", "MONTH"]
+
+class AccountUsage(object):
+    __slots__ = ("name", "period", "input_size", "output_size", "connections", "concurrent_connections", "quota", "changed")
+    
+    def __init__(self, name, period):
+        twunnel3.logger.log(3, "trace: AccountUsage.__init__")
+        
+        self.name = name
+        self.period = period
+        self.input_size = 0
+        self.output_size = 0
+        self.connections = 0
+        self.concurrent_connections = 0
+        self.quota = None
+        self.changed = False
+    
+    def update(self, input_size, output_size):
+        twunnel3.logger.log(3, "trace: AccountUsage.update")
+        
+        # the relay only adds to the counters, they are written by the accounting every INTERVAL seconds
+        self.input_size = self.input_size + input_size
+        self.output_size = self.output_size + output_size
+        self.changed = True
+        
+        if self.quota is not None and self.quota.size > 0 and self.input_size + self.output_size > self.quota.size:
+            return False
+        
+        return True
+
+class Accounting(object):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: Accounting.__init__")
+        
+        self.file = ""
+        self.format = "JSON"
+        self.period = ""
+        self.interval = 60.0
+        self.account_usages = {}
+        # the rows of the FILE, an account and a period with its input size, output size and connections
+        self.rows = {}
+        self.changed_rows = set()
+        self.written_rows = 0
+        self.failed_writes = 0
+        self.write_handle = None
+        self.write_future = None
+    
+    def get_period(self):
+        twunnel3.logger.log(3, "trace: Accounting.get_period")
+        
+        if self.period == "DAY":
+            return time.strftime("%Y-%m-%d", time.gmtime())
+        else:
+            if self.period == "MONTH":
+                return time.strftime("%Y-%m", time.gmtime())
+            else:
+                return ""
+    
+    def get_account_usage(self, name):
+        twunnel3.logger.log(3, "trace: Accounting.get_account_usage")
+        
+        account_usage = self.account_usages.get(name)
+        
+        if account_usage is None:
+            account_usage = AccountUsage(name, self.get_period())
+            
+            row = self.rows.get((name, account_usage.period))
+            
+            if row is not None:
+                account_usage.input_size, account_usage.output_size, account_usage.connections = row
+            
+            self.account_usages[name] = account_usage
+        else:
+            self.update_period(account_usage, self.get_period())
+        
+        return account_usage
+    
+    def update_period(self, account_usage, period):
+        twunnel3.logger.log(3, "trace: Accounting.update_period")
+        
+        if account_usage.period == period:
+            return
+        
+        # the usage of the last period is kept as a row, the open connections are counted in the new period
+        self.update_row(account_usage)
+        
+        account_usage.period = period
+        account_usage.input_size = 0
+        account_usage.output_size = 0
+        account_usage.connections = 0
+        account_usage.changed = True
+    
+    def update_row(self, account_usage):
+        twunnel3.logger.log(3, "trace: Accounting.update_row")
+        
+        self.rows[(account_usage.name, account_usage.period)] = (account_usage.input_size, account_usage.output_size, account_usage.connections)
+        self.changed_rows.add((account_usage.name, account_usage.period))
+        
+        account_usage.changed = False
+    
+    def create_connection(self, account):
+        twunnel3.logger.log(3, "trace: Accounting.create_connection")
+        
+        account_usage = self.get_account_usage(account.name)
+        
+        # the quota of the last configuration is used, so a reload changes the quotas of the accounts
+        account_usage.quota = account.quota
+        
+        if account.quota.connections > 0 and account_usage.connections >= account.quota.connections:
+            return None
+        
+        if account.quota.concurrent_connections > 0 and account_usage.concurrent_connections >= account.quota.concurrent_connections:
+            return None
+        
+        if account.quota.size > 0 and account_usage.input_size + account_usage.output_size >= account.quota.size:
+            return None
+        
+        account_usage.connections = account_usage.connections + 1
+        account_usage.concurrent_connections = account_usage.concurrent_connections + 1
+        account_usage.changed = True
+        
+        if self.file != "" and self.write_handle is None and self.write_future is None:
+            self.write_handle = asyncio.get_event_loop().call_later(self.interval, self.write_rows)
+        
+        return account_usage
+    
+    def remove_connection(self, account_usage):
+        twunnel3.logger.log(3, "trace: Accounting.remove_connection")
+        
+        account_usage.concurrent_connections = account_usage.concurrent_connections - 1
+    
+    def get_changed_rows(self):
+        twunnel3.logger.log(3, "trace: Accounting.get_changed_rows")
+        
+        period = self.get_period()
+        
+        for account_usage in self.account_usages.values():
+            if account_usage.changed == True:
+                self.update_row(account_usage)
+            
+            self.update_period(account_usage, period)
+        
+        # a JSON file is replaced with all rows, a SQLITE file only gets the rows which changed
+        if self.format == "JSON":
+            keys = self.rows.keys()
+        else:
+            keys = self.changed_rows
+        
+        rows = [(key[0], key[1]) + self.rows[key] for key in keys]
+        
+        self.changed_rows = set()
+        
+        return rows
+    
+    def write_rows(self):
+        twunnel3.logger.log(3, "trace: Accounting.write_rows")
+        
+        self.write_handle = None
+        
+        # one batch is written at a time
+        if self.write_future is not None:
+            return
+        
+        rows = self.get_changed_rows()
+        
+        if len(rows) == 0:
+            return
+        
+        # the rows are written by a thread of the executor, so the connections do not wait for the file
+        self.write_future = asyncio.get_event_loop().run_in_executor(None, write_rows, rows, self.file, self.format)
+        
+        def write_rows_done(write_future):
+            self.write_future = None
+            
+            if write_future.cancelled() == False and write_future.exception() is not None:
+                # the rows which could not be written are written with the next batch
+                self.changed_rows.update((row[0], row[1]) for row in rows)
+                self.failed_writes = self.failed_writes + 1
+                
+                twunnel3.logger.log(1, "account usages could not be written: %s" % str(write_future.exception()))
+            else:
+                self.written_rows = self.written_rows + len(rows)
+            
+            # the accounts with open connections keep changing, so they are written again after INTERVAL seconds
+            changed = len(self.changed_rows) > 0
+            
+            for account_usage in self.account_usages.values():
+                if account_usage.concurrent_connections > 0 or account_usage.changed == True:
+                    changed = True
+                    
+                    break
+            
+            if changed == True and self.write_handle is None:
+                self.write_handle = asyncio.get_event_loop().call_later(self.interval, self.write_rows)
+        
+        self.write_future.add_done_callback(write_rows_done)
+    
+    def load_rows(self):
+        twunnel3.logger.log(3, "trace: Accounting.load_rows")
+        
+        self.account_usages = {}
+        self.rows = {}
+        self.changed_rows = set()
+        
+        if self.file == "" or os.path.exists(self.file) == False:
+            return
+        
+        for row in read_rows(self.file, self.format):
+            self.rows[(row[0], row[1])] = (row[2], row[3], row[4])
+    
+    def flush(self):
+        twunnel3.logger.log(3, "trace: Accounting.flush")
+        
+        # a batch which is still written by the executor is waited for, otherwise it could replace the FILE with older rows after the last rows are written
+        if self.write_future is not None:
+            asyncio.get_event_loop().run_until_complete(asyncio.wait([self.write_future]))
+        
+        # the rows which are left when the process stops are written by the caller
+        if self.write_handle is not None:
+            self.write_handle.cancel()
+            self.write_handle = None
+        
+        if self.file == "":
+            return
+        
+        rows = self.get_changed_rows()
+        
+        if len(rows) == 0:
+            return
+        
+        try:
+            write_rows(rows, self.file, self.format)
+            
+            self.written_rows = self.written_rows + len(rows)
+        except (OSError, ValueError) as exception:
+            self.failed_writes = self.failed_writes + 1
+            
+            twunnel3.logger.log(1, "account usages could not be written: %s" % str(exception))
+
+def read_rows(file, format):
+    if format == "JSON":
+        with open(file, "r") as accounting_file:
+            rows = json.load(accounting_file)
+        
+        return [(row["account"], row["period"], row["input_size"], row["output_size"], row["connections"]) for row in rows]
+    else:
+        connection = sqlite3.connect(file)
+        try:
+            create_table(connection)
+            
+            return connection.execute("SELECT account, period, input_size, output_size, connections FROM account_usage").fetchall()
+        except sqlite3.Error as exception:
+            raise ValueError(str(exception))
+        finally:
+            connection.close()
+
+def create_table(connection):
+    connection.execute("CREATE TABLE IF NOT EXISTS account_usage (account TEXT NOT NULL, period TEXT NOT NULL, input_size INTEGER NOT NULL, output_size INTEGER NOT NULL, connections INTEGER NOT NULL, PRIMARY KEY (account, period))")
+
+def write_rows(rows, file, format):
+    if format == "JSON":
+        data = json.dumps([{"account": row[0], "period": row[1], "input_size": row[2], "output_size": row[3], "connections": row[4]} for row in rows], indent=4)
+        
+        # the file is replaced at once, so a process which stops while it is written does not lose the usages
+        with open(file + ".tmp", "w") as accounting_file:
+            accounting_file.write(data)
+            accounting_file.flush()
+            os.fsync(accounting_file.fileno())
+        
+        os.replace(file + ".tmp", file)
+    else:
+        # all rows of a batch are written in one transaction
+        connection = sqlite3.connect(file, timeout=10)
+        try:
+            create_table(connection)
+            
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO account_usage (account, period, input_size, output_size, connections) VALUES (?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as exception:
+            raise OSError(str(exception))
+        finally:
+            connection.close()
+
+accounting = Accounting()
+
+def configure(configuration):
+    accounting_configuration = twunnel3.configuration.get_dictionary(configuration, "ACCOUNTING", "")
+    
+    # FILE keeps the usages of the accounts over restarts, "" is no file
+    file = twunnel3.configuration.get_value(accounting_configuration, "FILE", "", "ACCOUNTING.")
+    format = twunnel3.configuration.get_choice(accounting_configuration, "FORMAT", "JSON", accounting_formats, "ACCOUNTING.")
+    period = twunnel3.configuration.get_choice(accounting_configuration, "PERIOD", "", accounting_periods, "ACCOUNTING.")
+    interval = twunnel3.configuration.get_value(accounting_configuration, "INTERVAL", 60.0, "ACCOUNTING.")
+    
+    if format == "SQLITE" and sqlite3 is None:
+        raise ValueError("ACCOUNTING.FORMAT SQLITE needs the sqlite3 module")
+    
+    if interval <= 0:
+        raise ValueError("ACCOUNTING.INTERVAL must be more than 0")
+    
+    if accounting.write_handle is not None:
+        accounting.write_handle.cancel()
+        accounting.write_handle = None
+    
+    accounting.file = file
+    accounting.format = format
+    accounting.period = period
+    accounting.interval = interval
+    
+    # a FILE which can not be read is an error of the configuration, so the usages are not lost when it is written
+    try:
+        accounting.load_rows()
+    except (KeyError, TypeError, ValueError) as exception:
+        raise ValueError("ACCOUNTING.FILE %s could not be read: %s" % (file, str(exception)))
\ No newline at end of file
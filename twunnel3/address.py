@@ -0,0 +1,77 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import collections
+import socket
+import twunnel3.logger
+
+ADDRESS_TYPE_IPV4 = 0x01
+ADDRESS_TYPE_DOMAIN = 0x03
+ADDRESS_TYPE_IPV6 = 0x04
+
+class Address(object):
+    __slots__ = ("address", "address_type", "encoded_address", "http_address", "socks4_address", "socks4_address_suffix", "socks5_address")
+    
+    def __init__(self, address):
+        twunnel3.logger.log(3, "trace: Address.__init__")
+        
+        self.address = address
+        self.address_type = ADDRESS_TYPE_DOMAIN
+        self.encoded_address = address.encode()
+        
+        packed_address = None
+        
+        # only addresses which look like an ip address are parsed, so a domain never raises an exception
+        if ":" in address:
+            try:
+                packed_address = socket.inet_pton(socket.AF_INET6, address)
+                
+                self.address_type = ADDRESS_TYPE_IPV6
+            except socket.error:
+                pass
+        else:
+            if address.count(".") == 3 and address.replace(".", "").isdigit() == True:
+                try:
+                    packed_address = socket.inet_pton(socket.AF_INET, address)
+                    
+                    self.address_type = ADDRESS_TYPE_IPV4
+                except socket.error:
+                    pass
+        
+        if self.address_type == ADDRESS_TYPE_IPV4:
+            self.http_address = self.encoded_address
+            self.socks4_address = packed_address
+            self.socks4_address_suffix = b""
+            self.socks5_address = bytes((ADDRESS_TYPE_IPV4,)) + packed_address
+        else:
+            if self.address_type == ADDRESS_TYPE_IPV6:
+                self.http_address = b"[" + self.encoded_address + b"]"
+                self.socks4_address = b"\x00\x00\x00\x01"
+                self.socks4_address_suffix = self.encoded_address + b"\x00"
+                self.socks5_address = bytes((ADDRESS_TYPE_IPV6,)) + packed_address
+            else:
+                self.http_address = self.encoded_address
+                self.socks4_address = b"\x00\x00\x00\x01"
+                self.socks4_address_suffix = self.encoded_address + b"\x00"
+                self.socks5_address = None
+                if len(self.encoded_address) <= 255:
+                    self.socks5_address = bytes((ADDRESS_TYPE_DOMAIN, len(self.encoded_address))) + self.encoded_address
+
+maximum_addresses_length = 4096
+
+addresses = collections.OrderedDict()
+
+def get_address(address):
+    if isinstance(address, Address):
+        return address
+    
+    address_object = addresses.get(address)
+    if address_object is None:
+        address_object = Address(address)
+        
+        if len(addresses) >= maximum_addresses_length:
+            addresses.popitem(last=False)
+        
+        addresses[address] = address_object
+    
+    return address_object
\ No newline at end of file
@@ -0,0 +1,141 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import twunnel3.configuration
+import twunnel3.logger
+
+# a connection with at most minimum_data_size bytes of data is not paused for the budget of the pool
+minimum_data_size = 16384
+
+# a write buffer which empties below its low water mark is reported to the account, a write buffer which empties without reaching its high water mark is not, so the paused connections are also checked every update_interval seconds
+update_interval = 0.1
+
+class BufferAccount(object):
+    __slots__ = ("buffer_pool", "protocol", "data_size", "reading_paused")
+    
+    def __init__(self, buffer_pool, protocol):
+        twunnel3.logger.log(3, "trace: BufferAccount.__init__")
+        
+        self.buffer_pool = buffer_pool
+        self.protocol = protocol
+        self.data_size = 0
+        self.reading_paused = False
+    
+    def update(self):
+        twunnel3.logger.log(3, "trace: BufferAccount.update")
+        
+        if self.protocol is not None:
+            self.buffer_pool.update_buffer_account(self)
+
+class BufferPool(object):
+    def __init__(self, maximum_size, maximum_connection_size):
+        twunnel3.logger.log(3, "trace: BufferPool.__init__")
+        
+        self.maximum_size = maximum_size
+        self.maximum_connection_size = maximum_connection_size
+        self.size = 0
+        self.buffer_accounts = set()
+        self.paused_buffer_accounts = set()
+        self.pauses = 0
+        self.update_handle = None
+    
+    def create_buffer_account(self, protocol):
+        twunnel3.logger.log(3, "trace: BufferPool.create_buffer_account")
+        
+        buffer_account = BufferAccount(self, protocol)
+        
+        self.buffer_accounts.add(buffer_account)
+        
+        return buffer_account
+    
+    def remove_buffer_account(self, buffer_account):
+        twunnel3.logger.log(3, "trace: BufferPool.remove_buffer_account")
+        
+        self.size = self.size - buffer_account.data_size
+        
+        buffer_account.protocol = None
+        buffer_account.data_size = 0
+        buffer_account.reading_paused = False
+        
+        self.buffer_accounts.discard(buffer_account)
+        self.paused_buffer_accounts.discard(buffer_account)
+    
+    def update_data_size(self, buffer_account):
+        twunnel3.logger.log(3, "trace: BufferPool.update_data_size")
+        
+        data_size = buffer_account.protocol.buffer_account__get_data_size()
+        
+        self.size = self.size + data_size - buffer_account.data_size
+        
+        buffer_account.data_size = data_size
+    
+    def update_buffer_account(self, buffer_account):
+        twunnel3.logger.log(3, "trace: BufferPool.update_buffer_account")
+        
+        self.update_data_size(buffer_account)
+        
+        # a connection stops reading when it has more data than its budget, or when the pool has more than its budget and the connection has more than minimum_data_size bytes of data which it could not send yet
+        # a connection which sends its data keeps reading, so the connections which are slow do not stop the others
+        if buffer_account.reading_paused == False:
+            if (self.maximum_connection_size > 0 and buffer_account.data_size > self.maximum_connection_size) or (self.maximum_size > 0 and self.size > self.maximum_size and buffer_account.data_size > minimum_data_size):
+                self.pause_buffer_account(buffer_account)
+        else:
+            if (self.maximum_connection_size == 0 or buffer_account.data_size <= self.maximum_connection_size // 2) and (self.maximum_size == 0 or self.size <= self.maximum_size * 3 // 4 or buffer_account.data_size <= minimum_data_size):
+                self.resume_buffer_account(buffer_account)
+    
+    def update_buffer_accounts(self):
+        twunnel3.logger.log(3, "trace: BufferPool.update_buffer_accounts")
+        
+        self.update_handle = None
+        
+        # the data of the connections which do not read is not updated by their reads
+        for buffer_account in self.buffer_accounts:
+            self.update_data_size(buffer_account)
+        
+        for buffer_account in list(self.paused_buffer_accounts):
+            self.update_buffer_account(buffer_account)
+        
+        if len(self.paused_buffer_accounts) > 0:
+            self.update_handle = asyncio.get_event_loop().call_later(update_interval, self.update_buffer_accounts)
+    
+    def pause_buffer_account(self, buffer_account):
+        twunnel3.logger.log(3, "trace: BufferPool.pause_buffer_account")
+        
+        buffer_account.reading_paused = True
+        
+        self.paused_buffer_accounts.add(buffer_account)
+        
+        self.pauses = self.pauses + 1
+        
+        buffer_account.protocol.buffer_account__pause_reading()
+        
+        if self.update_handle is None:
+            self.update_handle = asyncio.get_event_loop().call_later(update_interval, self.update_buffer_accounts)
+    
+    def resume_buffer_account(self, buffer_account):
+        twunnel3.logger.log(3, "trace: BufferPool.resume_buffer_account")
+        
+        buffer_account.reading_paused = False
+        
+        self.paused_buffer_accounts.discard(buffer_account)
+        
+        buffer_account.protocol.buffer_account__resume_reading()
+
+buffer_pool = BufferPool(0, 1048576)
+
+def configure(configuration):
+    buffer_pool_configuration = twunnel3.configuration.get_dictionary(configuration, "BUFFER_POOL", "")
+    
+    # SIZE is the budget of the process and CONNECTION_SIZE the budget of a connection, 0 is no budget
+    maximum_size = twunnel3.configuration.get_value(buffer_pool_configuration, "SIZE", 0, "BUFFER_POOL.")
+    maximum_connection_size = twunnel3.configuration.get_value(buffer_pool_configuration, "CONNECTION_SIZE", 1048576, "BUFFER_POOL.")
+    
+    if maximum_size < 0:
+        raise ValueError("BUFFER_POOL.SIZE must be 0 or more")
+    
+    if maximum_connection_size < 0:
+        raise ValueError("BUFFER_POOL.CONNECTION_SIZE must be 0 or more")
+    
+    buffer_pool.maximum_size = maximum_size
+    buffer_pool.maximum_connection_size = maximum_connection_size
\ No newline at end of file
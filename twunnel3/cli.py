@@ -0,0 +1,138 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import argparse
+import asyncio
+import signal
+import twunnel3.access_log
+import twunnel3.accounting
+import twunnel3.buffer_pool
+import twunnel3.configuration
+import twunnel3.diagnostics
+import twunnel3.local_proxy_server
+import twunnel3.logger
+import twunnel3.tracing
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(prog="twunnel3", description="A HTTPS/SOCKS4/SOCKS5 tunnel for AsyncIO.")
+    parser.add_argument("configuration_files", nargs="+", metavar="CONFIGURATION_FILE", help="a JSON or YAML configuration file with a LOCAL_PROXY_SERVER or LOCAL_PROXY_SERVERS")
+    parser.add_argument("--log-level", type=int, default=None, help="the log level, overrides LOGGER.LEVEL")
+    parser.add_argument("--metrics-interval", type=float, default=0, help="log the number of connections of every local proxy server, the use of the buffer pool, the exported spans, the written access log records and the usage of the accounts every METRICS_INTERVAL seconds")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="the number of seconds open connections are given to finish on SIGTERM, SIGINT or a handoff")
+    parser.add_argument("--handoff", metavar="PATH", default=None, help="take over the listening sockets of the process listening on PATH and listen on PATH for the process which replaces this process")
+    parser.add_argument("--check", action="store_true", help="check the configuration files and exit")
+    return parser
+
+def load_configurations(file_names):
+    configurations = []
+    
+    for file_name in file_names:
+        configurations.extend(twunnel3.configuration.create_configurations(twunnel3.configuration.load_configuration(file_name)))
+    
+    return configurations
+
+def main(arguments=None):
+    parser = create_argument_parser()
+    arguments = parser.parse_args(arguments)
+    
+    try:
+        configuration = twunnel3.configuration.load_configuration(arguments.configuration_files[0])
+        
+        logger_configuration = configuration
+        if arguments.log_level is not None:
+            logger_configuration = {"LOGGER": {"LEVEL": arguments.log_level}}
+        
+        twunnel3.logger.configure(logger_configuration)
+        
+        # the buffer pool, the tracer, the diagnostics, the access log and the accounting are shared by all local proxy servers, so they are configured by the first configuration file
+        twunnel3.buffer_pool.configure(configuration)
+        twunnel3.tracing.configure(configuration)
+        twunnel3.diagnostics.configure(configuration)
+        twunnel3.access_log.configure(configuration)
+        twunnel3.accounting.configure(configuration)
+        
+        configurations = load_configurations(arguments.configuration_files)
+    except (OSError, ValueError) as exception:
+        parser.exit(1, "twunnel3: %s\n" % exception)
+    
+    if arguments.check == True:
+        return 0
+    
+    loop = asyncio.get_event_loop()
+    
+    try:
+        manager = loop.run_until_complete(twunnel3.local_proxy_server.create_server_manager(configurations, arguments.handoff))
+    except (OSError, ValueError) as exception:
+        parser.exit(1, "twunnel3: %s\n" % exception)
+    
+    for server_key, server in manager.servers.items():
+        for server_socket in server.sockets:
+            twunnel3.logger.log(1, "listening: " + server_key[0] + " " + str(server_socket.getsockname()))
+    
+    manager.add_signal_handler(lambda: load_configurations(arguments.configuration_files))
+    
+    diagnostics_server = None
+    
+    if twunnel3.diagnostics.diagnostics_port > 0:
+        # a process which takes over from another one can find the port of the diagnostics still in use, then it runs without them
+        try:
+            diagnostics_server = loop.run_until_complete(twunnel3.diagnostics.create_server(manager))
+            
+            twunnel3.logger.log(1, "listening: DIAGNOSTICS " + str(diagnostics_server.sockets[0].getsockname()))
+        except OSError as exception:
+            twunnel3.logger.log(1, "diagnostics: " + str(exception))
+    
+    def drain_done(future):
+        twunnel3.logger.log(1, "stopped: " + str(future.result()) + " connections were closed")
+        
+        loop.stop()
+    
+    def signal_received():
+        twunnel3.logger.log(1, "stopping")
+        
+        if diagnostics_server is not None:
+            diagnostics_server.close()
+        
+        manager.drain(arguments.drain_timeout).add_done_callback(drain_done)
+    
+    loop.add_signal_handler(signal.SIGTERM, signal_received)
+    loop.add_signal_handler(signal.SIGINT, signal_received)
+    
+    if arguments.handoff is not None:
+        manager.start_handoff(arguments.handoff, arguments.drain_timeout).add_done_callback(drain_done)
+    
+    def log_metrics():
+        for server_key, server in manager.servers.items():
+            twunnel3.logger.log(1, "connections: " + server_key[0] + " " + str(server.sockets[0].getsockname()) + " " + str(server.get_connections_length()))
+        
+        buffer_pool = twunnel3.buffer_pool.buffer_pool
+        
+        twunnel3.logger.log(1, "buffers: size " + str(buffer_pool.size) + " of " + str(buffer_pool.maximum_size) + ", paused connections " + str(len(buffer_pool.paused_buffer_accounts)) + " of " + str(len(buffer_pool.buffer_accounts)) + ", pauses " + str(buffer_pool.pauses))
+        
+        tracer = twunnel3.tracing.tracer
+        
+        if tracer.sample_rate > 0:
+            twunnel3.logger.log(1, "spans: exported " + str(tracer.exported_spans) + ", dropped " + str(tracer.dropped_spans) + ", pending " + str(len(tracer.spans)))
+        
+        access_log = twunnel3.access_log.access_log
+        
+        if access_log.file != "":
+            twunnel3.logger.log(1, "access log: written " + str(access_log.written_records) + ", failed " + str(access_log.failed_records) + ", dropped " + str(access_log.dropped_records) + ", pending " + str(len(access_log.records)))
+        
+        for account_usage in twunnel3.accounting.accounting.account_usages.values():
+            twunnel3.logger.log(1, "account: " + account_usage.name + " " + account_usage.period + " input " + str(account_usage.input_size) + ", output " + str(account_usage.output_size) + ", connections " + str(account_usage.connections) + ", concurrent connections " + str(account_usage.concurrent_connections))
+        
+        loop.call_later(arguments.metrics_interval, log_metrics)
+    
+    if arguments.metrics_interval > 0:
+        loop.call_later(arguments.metrics_interval, log_metrics)
+    
+    loop.run_forever()
+    
+    twunnel3.tracing.tracer.flush()
+    twunnel3.access_log.access_log.close()
+    twunnel3.accounting.accounting.flush()
+    
+    loop.close()
+    
+    return 0
\ No newline at end of file
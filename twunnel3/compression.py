@@ -0,0 +1,115 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import concurrent.futures
+import zlib
+import twunnel3.logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_NONE = 0x00
+COMPRESSION_ZLIB = 0x01
+COMPRESSION_ZSTD = 0x02
+
+class ZLIBCompressor(object):
+    def __init__(self, level):
+        twunnel3.logger.log(3, "trace: ZLIBCompressor.__init__")
+        
+        self.compressor = zlib.compressobj(level)
+    
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class ZLIBDecompressor(object):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: ZLIBDecompressor.__init__")
+        
+        self.decompressor = zlib.decompressobj()
+    
+    def decompress(self, data, maximum_length):
+        try:
+            data = self.decompressor.decompress(data, maximum_length + 1)
+        except zlib.error:
+            return None
+        
+        if len(data) > maximum_length:
+            return None
+        
+        return data
+
+class ZSTDCompressor(object):
+    def __init__(self, level):
+        twunnel3.logger.log(3, "trace: ZSTDCompressor.__init__")
+        
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+class ZSTDDecompressor(object):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: ZSTDDecompressor.__init__")
+        
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+    
+    def decompress(self, data, maximum_length):
+        # the decompressor of zstandard has no bound on its output, the data is decompressed in parts so that it stops soon after maximum_length
+        decompressed_data = []
+        decompressed_data_length = 0
+        
+        i = 0
+        while i < len(data):
+            try:
+                decompressed_data_part = self.decompressor.decompress(data[i:i + 256])
+            except zstandard.ZstdError:
+                return None
+            
+            decompressed_data.append(decompressed_data_part)
+            decompressed_data_length = decompressed_data_length + len(decompressed_data_part)
+            
+            if decompressed_data_length > maximum_length:
+                return None
+            
+            i = i + 256
+        
+        return b"".join(decompressed_data)
+
+def get_compression_type(type):
+    if type == "ZLIB":
+        return COMPRESSION_ZLIB
+    else:
+        if type == "ZSTD" and zstandard is not None:
+            return COMPRESSION_ZSTD
+        else:
+            return COMPRESSION_NONE
+
+def get_compressor_class(compression_type):
+    if compression_type == COMPRESSION_ZLIB:
+        return ZLIBCompressor
+    else:
+        if compression_type == COMPRESSION_ZSTD and zstandard is not None:
+            return ZSTDCompressor
+        else:
+            return None
+
+def get_decompressor_class(compression_type):
+    if compression_type == COMPRESSION_ZLIB:
+        return ZLIBDecompressor
+    else:
+        if compression_type == COMPRESSION_ZSTD and zstandard is not None:
+            return ZSTDDecompressor
+        else:
+            return None
+
+executor = None
+
+def get_executor(workers):
+    global executor
+    
+    if executor is None:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    
+    return executor
\ No newline at end of file
@@ -0,0 +1,451 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import collections
+import copy
+import json
+import twunnel3.compression
+import twunnel3.logger
+
+proxy_server_types = ["HTTPS", "SOCKS4", "SOCKS5", "GROUP", "MUX"]
+proxy_server_group_strategies = ["WEIGHTED_ROUND_ROBIN", "LEAST_CONNECTIONS", "POWER_OF_TWO_CHOICES", "CONSISTENT_HASHING"]
+local_proxy_server_types = ["HTTPS", "SOCKS4", "SOCKS5", "MUX"]
+compression_types = ["", "ZLIB", "ZSTD"]
+
+# the socket profiles tune the sockets of the local proxy servers and of the connections to the proxy servers
+socket_profiles = \
+{
+    "INTERACTIVE":
+    {
+        "NO_DELAY": True,
+        "KEEP_ALIVE": True,
+        "KEEP_ALIVE_IDLE": 300,
+        "KEEP_ALIVE_INTERVAL": 30,
+        "KEEP_ALIVE_COUNT": 4,
+        "SEND_BUFFER_SIZE": 0,
+        "RECEIVE_BUFFER_SIZE": 0,
+        "NOT_SENT_LOW_WATER_MARK": 16384,
+        "FAST_OPEN": True
+    },
+    "BULK":
+    {
+        "NO_DELAY": False,
+        "KEEP_ALIVE": True,
+        "KEEP_ALIVE_IDLE": 300,
+        "KEEP_ALIVE_INTERVAL": 30,
+        "KEEP_ALIVE_COUNT": 4,
+        "SEND_BUFFER_SIZE": 4194304,
+        "RECEIVE_BUFFER_SIZE": 4194304,
+        "NOT_SENT_LOW_WATER_MARK": 0,
+        "FAST_OPEN": True
+    },
+    "LONG_IDLE":
+    {
+        "NO_DELAY": True,
+        "KEEP_ALIVE": True,
+        "KEEP_ALIVE_IDLE": 60,
+        "KEEP_ALIVE_INTERVAL": 15,
+        "KEEP_ALIVE_COUNT": 4,
+        "SEND_BUFFER_SIZE": 0,
+        "RECEIVE_BUFFER_SIZE": 0,
+        "NOT_SENT_LOW_WATER_MARK": 16384,
+        "FAST_OPEN": False
+    }
+}
+
+class ConfigurationObject(object):
+    __slots__ = ()
+    
+    def __setattr__(self, name, value):
+        # a configuration is compiled once and shared by all connections, so a field can only be set once
+        if hasattr(self, name) == True:
+            raise AttributeError("configuration field %s is read-only" % name)
+        
+        object.__setattr__(self, name, value)
+
+class AccountConfiguration(ConfigurationObject):
+    __slots__ = ("name", "password", "encoded_name", "encoded_password", "quota")
+    
+    def __init__(self, name, password):
+        twunnel3.logger.log(3, "trace: AccountConfiguration.__init__")
+        
+        self.name = name
+        self.password = password
+        self.encoded_name = name.encode()
+        self.encoded_password = password.encode()
+
+class QuotaConfiguration(ConfigurationObject):
+    __slots__ = ("size", "connections", "concurrent_connections")
+    
+    def __init__(self, size, connections, concurrent_connections):
+        twunnel3.logger.log(3, "trace: QuotaConfiguration.__init__")
+        
+        self.size = size
+        self.connections = connections
+        self.concurrent_connections = concurrent_connections
+
+class CompressionConfiguration(ConfigurationObject):
+    __slots__ = ("type", "types", "level", "ratio", "threshold", "workers")
+    
+    def __init__(self, type, types, level, ratio, threshold, workers):
+        twunnel3.logger.log(3, "trace: CompressionConfiguration.__init__")
+        
+        self.type = type
+        self.types = types
+        self.level = level
+        self.ratio = ratio
+        self.threshold = threshold
+        self.workers = workers
+
+class ConnectionPoolConfiguration(ConfigurationObject):
+    __slots__ = ("size", "timeout")
+    
+    def __init__(self, size, timeout):
+        twunnel3.logger.log(3, "trace: ConnectionPoolConfiguration.__init__")
+        
+        self.size = size
+        self.timeout = timeout
+
+class CacheConfiguration(ConfigurationObject):
+    __slots__ = ("size", "maximum_entry_size", "directory", "directory_size")
+    
+    def __init__(self, size, maximum_entry_size, directory, directory_size):
+        twunnel3.logger.log(3, "trace: CacheConfiguration.__init__")
+        
+        self.size = size
+        self.maximum_entry_size = maximum_entry_size
+        self.directory = directory
+        self.directory_size = directory_size
+
+class TLSConfiguration(ConfigurationObject):
+    __slots__ = ("certificate_file", "key_file", "alpn_protocols", "ciphers", "session_tickets")
+    
+    def __init__(self, certificate_file, key_file, alpn_protocols, ciphers, session_tickets):
+        twunnel3.logger.log(3, "trace: TLSConfiguration.__init__")
+        
+        self.certificate_file = certificate_file
+        self.key_file = key_file
+        self.alpn_protocols = alpn_protocols
+        self.ciphers = ciphers
+        self.session_tickets = session_tickets
+
+class SocketProfileConfiguration(ConfigurationObject):
+    __slots__ = ("name", "no_delay", "keep_alive", "keep_alive_idle", "keep_alive_interval", "keep_alive_count", "send_buffer_size", "receive_buffer_size", "not_sent_low_water_mark", "fast_open")
+    
+    def __init__(self, name, no_delay, keep_alive, keep_alive_idle, keep_alive_interval, keep_alive_count, send_buffer_size, receive_buffer_size, not_sent_low_water_mark, fast_open):
+        twunnel3.logger.log(3, "trace: SocketProfileConfiguration.__init__")
+        
+        self.name = name
+        self.no_delay = no_delay
+        self.keep_alive = keep_alive
+        self.keep_alive_idle = keep_alive_idle
+        self.keep_alive_interval = keep_alive_interval
+        self.keep_alive_count = keep_alive_count
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        self.not_sent_low_water_mark = not_sent_low_water_mark
+        self.fast_open = fast_open
+
+class ProxyServerConfiguration(ConfigurationObject):
+    __slots__ = ("type", "address", "port", "path", "account", "weight", "strategy", "latency_factor", "virtual_nodes", "proxy_servers", "connections", "window", "priority", "compression", "socket_profile", "optimistic", "proxy_server_group", "tunnel_output_protocol_factory")
+    
+    def __init__(self, type, address, port, account, weight):
+        twunnel3.logger.log(3, "trace: ProxyServerConfiguration.__init__")
+        
+        self.type = type
+        self.address = address
+        self.port = port
+        self.account = account
+        self.weight = weight
+
+class LocalProxyServerConfiguration(ConfigurationObject):
+    __slots__ = ("type", "address", "port", "path", "file_descriptor", "socket_name", "accounts", "connection_pool", "cache", "window", "compression", "tls", "socket_profile")
+    
+    def __init__(self, type, address, port, accounts):
+        twunnel3.logger.log(3, "trace: LocalProxyServerConfiguration.__init__")
+        
+        self.type = type
+        self.address = address
+        self.port = port
+        self.accounts = accounts
+
+class Configuration(ConfigurationObject):
+    __slots__ = ("proxy_servers", "local_proxy_server")
+    
+    def __init__(self, proxy_servers, local_proxy_server):
+        twunnel3.logger.log(3, "trace: Configuration.__init__")
+        
+        self.proxy_servers = proxy_servers
+        self.local_proxy_server = local_proxy_server
+
+def get_value(configuration, key, default_value, path):
+    value = configuration.get(key, default_value)
+    
+    value_type = type(default_value)
+    if value_type == float:
+        value_type = (int, float)
+    
+    if isinstance(value, value_type) == False or (isinstance(value, bool) == True and value_type != bool):
+        raise ValueError("%s%s must be of type %s" % (path, key, type(default_value).__name__))
+    
+    return value
+
+def get_dictionary(configuration, key, path):
+    value = configuration.get(key, {})
+    
+    if isinstance(value, dict) == False:
+        raise ValueError("%s%s must be a dictionary" % (path, key))
+    
+    return value
+
+def get_choice(configuration, key, default_value, choices, path):
+    value = get_value(configuration, key, default_value, path)
+    
+    if value not in choices:
+        raise ValueError("%s%s must be one of %s, not \"%s\"" % (path, key, ", ".join(choice for choice in choices if choice != ""), value))
+    
+    return value
+
+def get_port(configuration, path):
+    port = get_value(configuration, "PORT", 0, path)
+    
+    if port < 0 or port > 65535:
+        raise ValueError("%sPORT must be between 0 and 65535" % path)
+    
+    return port
+
+def create_quota_configuration(configuration, path):
+    # SIZE is the number of bytes in both directions, CONNECTIONS the number of connections and CONCURRENT_CONNECTIONS the number of open connections of an account, 0 is no quota
+    size = get_value(configuration, "SIZE", 0, path)
+    connections = get_value(configuration, "CONNECTIONS", 0, path)
+    concurrent_connections = get_value(configuration, "CONCURRENT_CONNECTIONS", 0, path)
+    
+    if size < 0:
+        raise ValueError("%sSIZE must be 0 or more" % path)
+    
+    if connections < 0:
+        raise ValueError("%sCONNECTIONS must be 0 or more" % path)
+    
+    if concurrent_connections < 0:
+        raise ValueError("%sCONCURRENT_CONNECTIONS must be 0 or more" % path)
+    
+    return QuotaConfiguration(size, connections, concurrent_connections)
+
+def create_account_configuration(configuration, path):
+    account = AccountConfiguration(get_value(configuration, "NAME", "", path), get_value(configuration, "PASSWORD", "", path))
+    account.quota = create_quota_configuration(get_dictionary(configuration, "QUOTA", path), path + "QUOTA.")
+    
+    return account
+
+def create_compression_configuration(configuration, path):
+    type = twunnel3.compression.get_compression_type(get_choice(configuration, "TYPE", "", compression_types, path))
+    
+    types = []
+    
+    i = 0
+    for type_name in get_value(configuration, "TYPES", ["ZLIB", "ZSTD"], path):
+        if type_name not in compression_types or type_name == "":
+            raise ValueError("%sTYPES[%d] must be one of ZLIB, ZSTD, not \"%s\"" % (path, i, type_name))
+        
+        types.append(twunnel3.compression.get_compression_type(type_name))
+        
+        i = i + 1
+    
+    return CompressionConfiguration(type, tuple(types), get_value(configuration, "LEVEL", 3, path), get_value(configuration, "RATIO", 0.9, path), get_value(configuration, "THRESHOLD", 16384, path), get_value(configuration, "WORKERS", 2, path))
+
+def create_tls_configuration(configuration, path):
+    certificate_file = get_value(configuration, "CERTIFICATE_FILE", "", path)
+    
+    if certificate_file == "":
+        return None
+    
+    alpn_protocols = get_value(configuration, "ALPN_PROTOCOLS", [], path)
+    
+    i = 0
+    while i < len(alpn_protocols):
+        if isinstance(alpn_protocols[i], str) == False:
+            raise ValueError("%sALPN_PROTOCOLS[%d] must be of type str" % (path, i))
+        
+        i = i + 1
+    
+    return TLSConfiguration(certificate_file, get_value(configuration, "KEY_FILE", "", path), tuple(alpn_protocols), get_value(configuration, "CIPHERS", "", path), get_value(configuration, "SESSION_TICKETS", True, path))
+
+def create_socket_profile_configuration(configuration, default_name, path):
+    name = get_choice(configuration, "NAME", default_name, [""] + sorted(socket_profiles), path)
+    
+    if name == "":
+        if len(configuration) > 0:
+            raise ValueError("%sNAME must be one of %s" % (path, ", ".join(sorted(socket_profiles))))
+        
+        return None
+    
+    # the values of a named socket profile can be changed one by one
+    socket_profile = socket_profiles[name]
+    
+    return SocketProfileConfiguration(name, get_value(configuration, "NO_DELAY", socket_profile["NO_DELAY"], path), get_value(configuration, "KEEP_ALIVE", socket_profile["KEEP_ALIVE"], path), get_value(configuration, "KEEP_ALIVE_IDLE", socket_profile["KEEP_ALIVE_IDLE"], path), get_value(configuration, "KEEP_ALIVE_INTERVAL", socket_profile["KEEP_ALIVE_INTERVAL"], path), get_value(configuration, "KEEP_ALIVE_COUNT", socket_profile["KEEP_ALIVE_COUNT"], path), get_value(configuration, "SEND_BUFFER_SIZE", socket_profile["SEND_BUFFER_SIZE"], path), get_value(configuration, "RECEIVE_BUFFER_SIZE", socket_profile["RECEIVE_BUFFER_SIZE"], path), get_value(configuration, "NOT_SENT_LOW_WATER_MARK", socket_profile["NOT_SENT_LOW_WATER_MARK"], path), get_value(configuration, "FAST_OPEN", socket_profile["FAST_OPEN"], path))
+
+def create_proxy_server_configuration(configuration, path="PROXY_SERVER.", socket_profile=None):
+    if isinstance(configuration, ProxyServerConfiguration):
+        return configuration
+    
+    if isinstance(configuration, dict) == False:
+        raise ValueError("%s must be a dictionary" % path[:-1])
+    
+    type = get_choice(configuration, "TYPE", "", proxy_server_types, path)
+    
+    # a proxy server without a SOCKET_PROFILE uses the one of its group, or else the one of the local proxy server
+    if "SOCKET_PROFILE" in configuration:
+        socket_profile = create_socket_profile_configuration(get_dictionary(configuration, "SOCKET_PROFILE", path), "", path + "SOCKET_PROFILE.")
+    
+    if type == "GROUP":
+        proxy_server = ProxyServerConfiguration(type, "", 0, None, get_value(configuration, "WEIGHT", 1, path))
+        proxy_server.path = ""
+        proxy_server.strategy = get_choice(configuration, "STRATEGY", "WEIGHTED_ROUND_ROBIN", proxy_server_group_strategies, path)
+        proxy_server.latency_factor = get_value(configuration, "LATENCY_FACTOR", 0.2, path)
+        proxy_server.virtual_nodes = get_value(configuration, "VIRTUAL_NODES", 100, path)
+        proxy_server.proxy_servers = create_proxy_server_configurations(configuration, path, socket_profile)
+        proxy_server.optimistic = False
+        # the proxy_server_group of a GROUP is set once, when it is first used by a tunnel
+    else:
+        account = create_account_configuration(get_dictionary(configuration, "ACCOUNT", path), path + "ACCOUNT.")
+        
+        proxy_server = ProxyServerConfiguration(type, get_value(configuration, "ADDRESS", "", path), get_port(configuration, path), account, get_value(configuration, "WEIGHT", 1, path))
+        # a first proxy server on the same host can be connected to over a UNIX socket instead of ADDRESS and PORT
+        proxy_server.path = get_value(configuration, "PATH", "", path)
+        proxy_server.strategy = None
+        proxy_server.latency_factor = None
+        proxy_server.virtual_nodes = None
+        proxy_server.proxy_servers = None
+        # an optimistic proxy server gets the data after its request without waiting for its reply, which saves a round trip
+        proxy_server.optimistic = get_value(configuration, "OPTIMISTIC", False, path)
+    
+    if type == "MUX":
+        proxy_server.connections = get_value(configuration, "CONNECTIONS", 1, path)
+        proxy_server.window = get_value(configuration, "WINDOW", 262144, path)
+        proxy_server.priority = get_value(configuration, "PRIORITY", 4, path)
+        proxy_server.compression = create_compression_configuration(get_dictionary(configuration, "COMPRESSION", path), path + "COMPRESSION.")
+    else:
+        proxy_server.connections = None
+        proxy_server.window = None
+        proxy_server.priority = None
+        proxy_server.compression = None
+    
+    proxy_server.socket_profile = socket_profile
+    
+    return proxy_server
+
+def create_proxy_server_configurations(configuration, path="", socket_profile=None):
+    proxy_servers = []
+    
+    i = 0
+    for proxy_server in get_value(configuration, "PROXY_SERVERS", [], path):
+        proxy_servers.append(create_proxy_server_configuration(proxy_server, "%sPROXY_SERVERS[%d]." % (path, i), socket_profile))
+        
+        i = i + 1
+    
+    return tuple(proxy_servers)
+
+def create_local_proxy_server_configuration(configuration, path="LOCAL_PROXY_SERVER."):
+    type = get_choice(configuration, "TYPE", "", local_proxy_server_types, path)
+    
+    accounts = []
+    
+    i = 0
+    for account in get_value(configuration, "ACCOUNTS", [], path):
+        if isinstance(account, dict) == False:
+            raise ValueError("%sACCOUNTS[%d] must be a dictionary" % (path, i))
+        
+        accounts.append(create_account_configuration(account, "%sACCOUNTS[%d]." % (path, i)))
+        
+        i = i + 1
+    
+    local_proxy_server = LocalProxyServerConfiguration(type, get_value(configuration, "ADDRESS", "", path), get_port(configuration, path), tuple(accounts))
+    
+    # a local proxy server listens on an inherited socket (FILE_DESCRIPTOR or a systemd SOCKET_NAME), a UNIX socket (PATH) or ADDRESS and PORT
+    local_proxy_server.path = get_value(configuration, "PATH", "", path)
+    local_proxy_server.file_descriptor = get_value(configuration, "FILE_DESCRIPTOR", -1, path)
+    local_proxy_server.socket_name = get_value(configuration, "SOCKET_NAME", "", path)
+    
+    connection_pool = get_dictionary(configuration, "CONNECTION_POOL", path)
+    local_proxy_server.connection_pool = ConnectionPoolConfiguration(get_value(connection_pool, "SIZE", 8, path + "CONNECTION_POOL."), get_value(connection_pool, "TIMEOUT", 60, path + "CONNECTION_POOL."))
+    
+    cache = get_dictionary(configuration, "CACHE", path)
+    local_proxy_server.cache = CacheConfiguration(get_value(cache, "SIZE", 0, path + "CACHE."), get_value(cache, "MAXIMUM_ENTRY_SIZE", 16777216, path + "CACHE."), get_value(cache, "DIRECTORY", "", path + "CACHE."), get_value(cache, "DIRECTORY_SIZE", 0, path + "CACHE."))
+    
+    local_proxy_server.window = get_value(configuration, "WINDOW", 262144, path)
+    local_proxy_server.compression = create_compression_configuration(get_dictionary(configuration, "COMPRESSION", path), path + "COMPRESSION.")
+    local_proxy_server.tls = create_tls_configuration(get_dictionary(configuration, "TLS", path), path + "TLS.")
+    local_proxy_server.socket_profile = create_socket_profile_configuration(get_dictionary(configuration, "SOCKET_PROFILE", path), "INTERACTIVE", path + "SOCKET_PROFILE.")
+    
+    return local_proxy_server
+
+def create_configuration(configuration):
+    if isinstance(configuration, dict) == False:
+        raise ValueError("configuration must be a dictionary")
+    
+    proxy_servers = create_proxy_server_configurations(configuration)
+    
+    local_proxy_server = None
+    if "LOCAL_PROXY_SERVER" in configuration:
+        local_proxy_server = create_local_proxy_server_configuration(get_dictionary(configuration, "LOCAL_PROXY_SERVER", ""))
+    
+    return Configuration(proxy_servers, local_proxy_server)
+
+maximum_configurations_length = 256
+
+configurations = collections.OrderedDict()
+
+def get_configuration(configuration):
+    if isinstance(configuration, Configuration):
+        return configuration
+    
+    # a dictionary is compiled again when it was changed since it was compiled, the cache keeps a copy of it and not the dictionary
+    entry = configurations.get(id(configuration))
+    
+    if entry is None or entry[0] != configuration:
+        entry = (copy.deepcopy(configuration), create_configuration(configuration))
+        
+        if len(configurations) >= maximum_configurations_length:
+            configurations.popitem(last=False)
+        
+        configurations[id(configuration)] = entry
+    
+    return entry[1]
+
+def create_configurations(configuration):
+    if isinstance(configuration, dict) == False:
+        raise ValueError("configuration must be a dictionary")
+    
+    if "LOCAL_PROXY_SERVERS" not in configuration:
+        return [get_configuration(configuration)]
+    
+    # every local proxy server gets its own configuration, they share the proxy servers
+    proxy_servers = create_proxy_server_configurations(configuration)
+    
+    configurations = []
+    
+    i = 0
+    for local_proxy_server in get_value(configuration, "LOCAL_PROXY_SERVERS", [], ""):
+        if isinstance(local_proxy_server, dict) == False:
+            raise ValueError("LOCAL_PROXY_SERVERS[%d] must be a dictionary" % i)
+        
+        configurations.append(Configuration(proxy_servers, create_local_proxy_server_configuration(local_proxy_server, "LOCAL_PROXY_SERVERS[%d]." % i)))
+        
+        i = i + 1
+    
+    return configurations
+
+def load_configuration(file_name):
+    with open(file_name) as file:
+        if file_name.endswith(".yaml") or file_name.endswith(".yml"):
+            # PyYAML is slow to import, so it is only imported when a YAML configuration is loaded
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required to load %s" % file_name)
+            
+            configuration = yaml.safe_load(file)
+        else:
+            configuration = json.load(file)
+    
+    return configuration
\ No newline at end of file
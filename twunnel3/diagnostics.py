@@ -0,0 +1,401 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import collections
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+import twunnel3.buffer_pool
+import twunnel3.configuration
+import twunnel3.logger
+import twunnel3.tracing
+
+maximum_request_length = 8192
+
+# the last slow callbacks are kept
+maximum_slow_callbacks_length = 32
+maximum_stack_length = 16
+
+# a profile takes samples for up to maximum_profile_duration seconds
+maximum_profile_duration = 60
+minimum_profile_interval = 0.001
+
+class LoopMonitor(object):
+    def __init__(self, interval, slow_callback_duration):
+        twunnel3.logger.log(3, "trace: LoopMonitor.__init__")
+        
+        self.interval = interval
+        self.slow_callback_duration = slow_callback_duration
+        self.thread_id = 0
+        self.heartbeat_time = 0
+        self.lag = 0
+        self.average_lag = 0
+        self.maximum_lag = 0
+        self.slow_callback = None
+        self.slow_callbacks = collections.deque(maxlen=maximum_slow_callbacks_length)
+        self.slow_callbacks_length = 0
+        self.profile_future = None
+        self.handle = None
+        self.thread = None
+    
+    def start(self):
+        twunnel3.logger.log(3, "trace: LoopMonitor.start")
+        
+        if self.handle is not None:
+            return
+        
+        self.thread_id = threading.get_ident()
+        self.heartbeat_time = time.monotonic()
+        self.handle = asyncio.get_event_loop().call_later(self.interval, self.beat, self.heartbeat_time + self.interval)
+        
+        # the watchdog is a thread, so it sees a callback which blocks the event loop while it blocks it
+        self.thread = threading.Thread(target=self.watch, name="twunnel3 diagnostics")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        twunnel3.logger.log(3, "trace: LoopMonitor.stop")
+        
+        if self.handle is None:
+            return
+        
+        self.handle.cancel()
+        self.handle = None
+        self.thread = None
+    
+    def beat(self, heartbeat_time):
+        twunnel3.logger.log(3, "trace: LoopMonitor.beat")
+        
+        current_time = time.monotonic()
+        
+        # the lag is the time the event loop ran the heartbeat after it was due
+        self.lag = max(current_time - heartbeat_time, 0)
+        self.average_lag = self.average_lag * 0.9 + self.lag * 0.1
+        self.maximum_lag = max(self.maximum_lag, self.lag)
+        
+        slow_callback = self.slow_callback
+        if slow_callback is not None:
+            self.slow_callback = None
+            
+            slow_callback["duration"] = self.lag
+            
+            twunnel3.logger.log(1, "slow callback: %.3f seconds in %s %s" % (self.lag, slow_callback["protocol"], slow_callback["state"]))
+        
+        self.heartbeat_time = current_time
+        self.handle = asyncio.get_event_loop().call_later(self.interval, self.beat, current_time + self.interval)
+    
+    def watch(self):
+        thread = self.thread
+        
+        stalled_heartbeat_time = 0
+        
+        while self.thread is thread:
+            time.sleep(self.slow_callback_duration / 2)
+            
+            heartbeat_time = self.heartbeat_time
+            
+            # the heartbeat is late, then the stack of the event loop shows what blocks it, once per heartbeat
+            if time.monotonic() - heartbeat_time - self.interval > self.slow_callback_duration and heartbeat_time != stalled_heartbeat_time:
+                stalled_heartbeat_time = heartbeat_time
+                
+                frame = sys._current_frames().get(self.thread_id)
+                
+                if frame is not None:
+                    slow_callback = describe_frame(frame)
+                    slow_callback["time"] = time.time()
+                    slow_callback["duration"] = time.monotonic() - heartbeat_time - self.interval
+                    
+                    self.slow_callbacks.append(slow_callback)
+                    self.slow_callbacks_length = self.slow_callbacks_length + 1
+                    self.slow_callback = slow_callback
+    
+    def profile(self, duration, interval):
+        twunnel3.logger.log(3, "trace: LoopMonitor.profile")
+        
+        if self.profile_future is not None:
+            future = asyncio.Future()
+            future.set_exception(ValueError("a profile is already running"))
+            return future
+        
+        self.profile_future = asyncio.get_event_loop().run_in_executor(None, profile, self.thread_id, duration, interval)
+        
+        def profile_done(future):
+            self.profile_future = None
+        
+        self.profile_future.add_done_callback(profile_done)
+        
+        return self.profile_future
+
+def describe_frame(frame):
+    # the innermost frame of a protocol with a state shows which connection blocks the event loop
+    protocol = ""
+    state = ""
+    
+    protocol_frame = frame
+    while protocol_frame is not None:
+        instance = protocol_frame.f_locals.get("self")
+        
+        if instance is not None and (hasattr(instance, "data_state") == True or hasattr(instance, "connection_state") == True):
+            protocol = instance.__class__.__name__
+            state = " ".join("%s %s" % (name, getattr(instance, name)) for name in ("connection_state", "data_state") if hasattr(instance, name) == True)
+            break
+        
+        protocol_frame = protocol_frame.f_back
+    
+    stack = ["%s:%d %s" % (os.path.basename(filename), line_number, name) for filename, line_number, name, line in traceback.extract_stack(frame, maximum_stack_length)]
+    
+    return {"protocol": protocol, "state": state, "stack": stack}
+
+def profile(thread_id, duration, interval):
+    # a statistical profile of the event loop in the folded format of flame graphs, a line per stack with its number of samples
+    stacks = collections.Counter()
+    
+    end_time = time.monotonic() + duration
+    
+    while time.monotonic() < end_time:
+        frame = sys._current_frames().get(thread_id)
+        
+        names = []
+        while frame is not None:
+            names.append("%s:%s" % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+            
+            frame = frame.f_back
+        
+        if len(names) > 0:
+            names.reverse()
+            
+            stacks[";".join(names)] += 1
+        
+        time.sleep(interval)
+    
+    return "".join("%s %d\n" % (stack, samples) for stack, samples in stacks.most_common())
+
+def get_connection_states(manager):
+    connection_states = {}
+    
+    def add_connection_state(protocol):
+        protocol_states = connection_states.setdefault(protocol.__class__.__name__, {})
+        
+        # the state of an HTTPS connection which waits for the headers of its request is data_state 0
+        state = "connected"
+        if hasattr(protocol, "data_state") == True:
+            state = "data_state %d" % protocol.data_state
+        
+        protocol_states[state] = protocol_states.get(state, 0) + 1
+    
+    # the states are counted when they are asked for, so the connections do not count them
+    input_protocol_factories = set()
+    
+    for server in manager.servers.values():
+        input_protocol_factory = server.input_protocol_factory
+        
+        if input_protocol_factory in input_protocol_factories:
+            continue
+        
+        input_protocol_factories.add(input_protocol_factory)
+        
+        for input_protocol in list(input_protocol_factory.input_protocols):
+            add_connection_state(input_protocol)
+            
+            streams = getattr(input_protocol, "streams", None)
+            
+            if streams is not None:
+                for stream in list(streams.values()):
+                    add_connection_state(stream)
+    
+    return connection_states
+
+def get_diagnostics(manager):
+    buffer_pool = twunnel3.buffer_pool.buffer_pool
+    tracer = twunnel3.tracing.tracer
+    
+    diagnostics = \
+    {
+        "loop":
+        {
+            "lag": loop_monitor.lag,
+            "average_lag": loop_monitor.average_lag,
+            "maximum_lag": loop_monitor.maximum_lag,
+            "slow_callback_duration": loop_monitor.slow_callback_duration,
+            "slow_callbacks_length": loop_monitor.slow_callbacks_length,
+            "slow_callbacks": list(loop_monitor.slow_callbacks),
+            "tasks": len(asyncio.Task.all_tasks()) if hasattr(asyncio.Task, "all_tasks") == True else len(asyncio.all_tasks())
+        },
+        "connections": get_connection_states(manager),
+        "buffer_pool":
+        {
+            "size": buffer_pool.size,
+            "maximum_size": buffer_pool.maximum_size,
+            "buffer_accounts": len(buffer_pool.buffer_accounts),
+            "paused_buffer_accounts": len(buffer_pool.paused_buffer_accounts),
+            "pauses": buffer_pool.pauses
+        },
+        "tracing":
+        {
+            "sample_rate": tracer.sample_rate,
+            "exported_spans": tracer.exported_spans,
+            "dropped_spans": tracer.dropped_spans,
+            "pending_spans": len(tracer.spans)
+        }
+    }
+    
+    return diagnostics
+
+class DiagnosticsProtocol(asyncio.Protocol):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocol.__init__")
+        
+        self.factory = None
+        self.data = b""
+        self.data_state = 0
+        self.transport = None
+    
+    def connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocol.connection_made")
+        
+        self.transport = transport
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocol.connection_lost")
+        
+        self.transport = None
+    
+    def data_received(self, data):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocol.data_received")
+        
+        if self.data_state != 0:
+            return
+        
+        self.data = self.data + data
+        
+        i = self.data.find(b"\r\n\r\n")
+        
+        if i == -1:
+            if len(self.data) > maximum_request_length:
+                self.write_response(b"431 Request Header Fields Too Large", b"text/plain", b"")
+            
+            return
+        
+        self.data_state = 1
+        
+        request_line = self.data[:self.data.find(b"\r\n")].split(b" ")
+        
+        self.data = b""
+        
+        if len(request_line) != 3 or request_line[0] != b"GET":
+            self.write_response(b"405 Method Not Allowed", b"text/plain", b"")
+            
+            return
+        
+        request_uri = urllib.parse.urlsplit(request_line[1].decode("latin-1"))
+        request_parameters = urllib.parse.parse_qs(request_uri.query)
+        
+        if request_uri.path == "/debug":
+            self.write_response(b"200 OK", b"application/json", json.dumps(get_diagnostics(self.factory.manager), indent=4, sort_keys=True).encode())
+        else:
+            if request_uri.path == "/debug/profile":
+                try:
+                    duration = min(float(request_parameters.get("seconds", ["5"])[0]), maximum_profile_duration)
+                    interval = max(float(request_parameters.get("interval", ["0.005"])[0]), minimum_profile_interval)
+                except ValueError:
+                    self.write_response(b"400 Bad Request", b"text/plain", b"seconds and interval must be numbers\n")
+                    
+                    return
+                
+                future = loop_monitor.profile(duration, interval)
+                
+                def profile_done(future):
+                    if self.transport is None:
+                        return
+                    
+                    if future.cancelled() == True:
+                        self.write_response(b"503 Service Unavailable", b"text/plain", b"")
+                    else:
+                        if future.exception() is not None:
+                            self.write_response(b"409 Conflict", b"text/plain", str(future.exception()).encode() + b"\n")
+                        else:
+                            self.write_response(b"200 OK", b"text/plain", future.result().encode())
+                
+                future.add_done_callback(profile_done)
+            else:
+                self.write_response(b"404 Not Found", b"text/plain", b"")
+    
+    def write_response(self, status, content_type, content):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocol.write_response")
+        
+        response = b"HTTP/1.1 " + status + b"\r\n"
+        response = response + b"Content-Type: " + content_type + b"\r\n"
+        response = response + b"Content-Length: " + str(len(content)).encode() + b"\r\n"
+        response = response + b"Connection: close\r\n"
+        response = response + b"\r\n"
+        response = response + content
+        
+        self.transport.write(response)
+        self.transport.close()
+
+class DiagnosticsProtocolFactory(object):
+    def __init__(self, manager):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocolFactory.__init__")
+        
+        self.manager = manager
+    
+    def __call__(self):
+        twunnel3.logger.log(3, "trace: DiagnosticsProtocolFactory.__call__")
+        
+        protocol = DiagnosticsProtocol()
+        protocol.factory = self
+        return protocol
+
+loop_monitor = LoopMonitor(0.1, 0.1)
+
+diagnostics_address = "127.0.0.1"
+diagnostics_port = 0
+
+def configure(configuration):
+    global diagnostics_address
+    global diagnostics_port
+    
+    diagnostics_configuration = twunnel3.configuration.get_dictionary(configuration, "DIAGNOSTICS", "")
+    
+    # PORT is the port of the HTTP server of the diagnostics, 0 is no diagnostics
+    address = twunnel3.configuration.get_value(diagnostics_configuration, "ADDRESS", "127.0.0.1", "DIAGNOSTICS.")
+    port = twunnel3.configuration.get_value(diagnostics_configuration, "PORT", 0, "DIAGNOSTICS.")
+    interval = twunnel3.configuration.get_value(diagnostics_configuration, "LAG_INTERVAL", 0.1, "DIAGNOSTICS.")
+    slow_callback_duration = twunnel3.configuration.get_value(diagnostics_configuration, "SLOW_CALLBACK_DURATION", 0.1, "DIAGNOSTICS.")
+    
+    # the diagnostics show the addresses of the connections, so they are only served to the local host
+    try:
+        loopback = ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        loopback = False
+    
+    if loopback == False:
+        raise ValueError("DIAGNOSTICS.ADDRESS must be a loopback address")
+    
+    if port < 0 or port > 65535:
+        raise ValueError("DIAGNOSTICS.PORT must be from 0 to 65535")
+    
+    if interval <= 0:
+        raise ValueError("DIAGNOSTICS.LAG_INTERVAL must be more than 0")
+    
+    if slow_callback_duration <= 0:
+        raise ValueError("DIAGNOSTICS.SLOW_CALLBACK_DURATION must be more than 0")
+    
+    diagnostics_address = address
+    diagnostics_port = port
+    
+    loop_monitor.interval = interval
+    loop_monitor.slow_callback_duration = slow_callback_duration
+
+def create_server(manager):
+    twunnel3.logger.log(3, "trace: create_server")
+    
+    loop_monitor.start()
+    
+    return asyncio.get_event_loop().create_server(DiagnosticsProtocolFactory(manager), host=diagnostics_address, port=diagnostics_port)
\ No newline at end of file
@@ -0,0 +1,183 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import array
+import json
+import os
+import socket
+import struct
+import twunnel3.logger
+
+# the listening sockets of a process are passed to the process which replaces it over a UNIX socket (SCM_RIGHTS)
+# the new process acknowledges with one byte when it is accepting, until then both processes accept connections
+
+maximum_sockets_length = 250
+
+SD_LISTEN_FDS_START = 3
+
+length_struct = struct.Struct("!I")
+
+HANDOFF_ACKNOWLEDGEMENT = b"\x00"
+
+def send_sockets(connection, servers):
+    twunnel3.logger.log(3, "trace: send_sockets")
+    
+    keys = []
+    file_descriptors = array.array("i")
+    
+    for server_key, sockets in servers:
+        families = []
+        
+        for server_socket in sockets:
+            families.append(server_socket.family)
+            file_descriptors.append(server_socket.fileno())
+        
+        keys.append(list(server_key) + [families])
+    
+    if len(file_descriptors) > maximum_sockets_length:
+        raise ValueError("a handoff supports at most %d sockets" % maximum_sockets_length)
+    
+    data = json.dumps(keys).encode()
+    
+    connection.sendmsg([length_struct.pack(len(data)) + data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, file_descriptors.tobytes())])
+
+def receive_sockets(path, timeout=5):
+    twunnel3.logger.log(3, "trace: receive_sockets")
+    
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    
+    file_descriptors = array.array("i")
+    
+    try:
+        connection.connect(path)
+        
+        data, ancillary_data, flags, address = connection.recvmsg(65536, socket.CMSG_SPACE(maximum_sockets_length * file_descriptors.itemsize))
+        
+        for level, type, file_descriptors_data in ancillary_data:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                file_descriptors.frombytes(file_descriptors_data[:len(file_descriptors_data) - len(file_descriptors_data) % file_descriptors.itemsize])
+        
+        while len(data) < length_struct.size or len(data) < length_struct.size + length_struct.unpack_from(data)[0]:
+            received_data = connection.recv(65536)
+            
+            if len(received_data) == 0:
+                raise ConnectionResetError("handoff connection was lost")
+            
+            data = data + received_data
+        
+        keys = json.loads(data[length_struct.size:].decode())
+    except (OSError, ValueError):
+        for file_descriptor in file_descriptors:
+            os.close(file_descriptor)
+        
+        connection.close()
+        
+        raise
+    
+    sockets = {}
+    
+    i = 0
+    for key in keys:
+        server_sockets = []
+        
+        for family in key[-1]:
+            if i < len(file_descriptors):
+                server_sockets.append(socket.socket(family, socket.SOCK_STREAM, 0, file_descriptors[i]))
+                
+                i = i + 1
+        
+        sockets[tuple(key[:-1])] = server_sockets
+    
+    while i < len(file_descriptors):
+        os.close(file_descriptors[i])
+        
+        i = i + 1
+    
+    return (sockets, connection)
+
+def acknowledge(connection):
+    twunnel3.logger.log(3, "trace: acknowledge")
+    
+    try:
+        connection.sendall(HANDOFF_ACKNOWLEDGEMENT)
+    except OSError as exception:
+        twunnel3.logger.log(1, "handoff acknowledgement failed: " + str(exception))
+    
+    connection.close()
+
+systemd_file_descriptors = None
+
+def get_systemd_file_descriptors():
+    global systemd_file_descriptors
+    
+    # the sockets of systemd socket activation are read once, they only belong to this process if LISTEN_PID is its pid
+    if systemd_file_descriptors is None:
+        systemd_file_descriptors = {}
+        
+        if os.environ.get("LISTEN_PID", "") == str(os.getpid()):
+            names = os.environ.get("LISTEN_FDNAMES", "").split(":")
+            
+            i = 0
+            while i < int(os.environ.get("LISTEN_FDS", "0")):
+                name = "unknown"
+                if i < len(names) and names[i] != "":
+                    name = names[i]
+                
+                systemd_file_descriptors.setdefault(name, []).append(SD_LISTEN_FDS_START + i)
+                
+                i = i + 1
+    
+    return systemd_file_descriptors
+
+inherited_file_descriptors = set()
+
+def get_inherited_socket(file_descriptor):
+    twunnel3.logger.log(3, "trace: get_inherited_socket")
+    
+    # an inherited file descriptor is only used once, after it was closed the number can belong to another file
+    if file_descriptor in inherited_file_descriptors:
+        raise ValueError("file descriptor %d was already used" % file_descriptor)
+    
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0, file_descriptor)
+    
+    # the family of an inherited socket is not known, but its address has the format of its family
+    address = server_socket.getsockname()
+    
+    family = socket.AF_INET
+    if isinstance(address, tuple) == False:
+        family = socket.AF_UNIX
+    else:
+        if len(address) == 4:
+            family = socket.AF_INET6
+    
+    if family != socket.AF_INET:
+        server_socket.detach()
+        server_socket = socket.socket(family, socket.SOCK_STREAM, 0, file_descriptor)
+    
+    inherited_file_descriptors.add(file_descriptor)
+    
+    return server_socket
+
+def get_inherited_sockets(configuration):
+    twunnel3.logger.log(3, "trace: get_inherited_sockets")
+    
+    file_descriptors = []
+    
+    if configuration.local_proxy_server.file_descriptor >= 0:
+        file_descriptors.append(configuration.local_proxy_server.file_descriptor)
+    
+    if configuration.local_proxy_server.socket_name != "":
+        systemd_file_descriptors = get_systemd_file_descriptors()
+        
+        if configuration.local_proxy_server.socket_name not in systemd_file_descriptors:
+            raise ValueError("systemd did not pass a socket named %s" % configuration.local_proxy_server.socket_name)
+        
+        file_descriptors.extend(systemd_file_descriptors[configuration.local_proxy_server.socket_name])
+    
+    sockets = []
+    
+    for file_descriptor in file_descriptors:
+        sockets.append(get_inherited_socket(file_descriptor))
+    
+    return sockets
\ No newline at end of file
@@ -0,0 +1,905 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import collections
+import email.utils
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+import twunnel3.http_parser
+import twunnel3.logger
+
+def get_cache_control(message):
+    cache_control = {}
+    
+    for token in message.get_header_tokens(b"cache-control"):
+        i = token.find(b"=")
+        
+        if i == -1:
+            cache_control[token] = b""
+        else:
+            cache_control[token[:i].strip()] = token[i + 1:].strip().strip(b"\"")
+    
+    return cache_control
+
+def get_date(value):
+    if value is None:
+        return None
+    
+    try:
+        date = email.utils.parsedate_tz(value.decode("latin-1"))
+    except (TypeError, ValueError):
+        return None
+    
+    if date is None:
+        return None
+    
+    return email.utils.mktime_tz(date)
+
+def get_integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def copy_message(message):
+    copy = twunnel3.http_parser.HTTPMessage()
+    copy.version = message.version
+    copy.status = message.status
+    copy.reason = message.reason
+    copy.headers = list(message.headers)
+    return copy
+
+class HTTPCacheEntry(object):
+    def __init__(self, cache, key):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.__init__")
+        
+        self.cache = cache
+        self.key = key
+        self.message = None
+        self.data = []
+        self.data_length = 0
+        self.data_file = None
+        self.data_state = 0
+        self.readers = []
+        self.storable = True
+        self.time = 0
+        self.age = 0
+        self.lifetime = 0
+    
+    def is_fresh(self):
+        return self.get_age() < self.lifetime
+    
+    def get_age(self):
+        return self.age + time.time() - self.time
+    
+    def get_data(self):
+        if self.data_file is not None:
+            return self.data_file.get_data()
+        
+        future = asyncio.Future()
+        future.set_result(self.data)
+        
+        return future
+    
+    def update(self, message):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.update")
+        
+        cache_control = get_cache_control(message)
+        
+        if self.message is not message:
+            for header_name in [b"cache-control", b"date", b"etag", b"expires", b"last-modified"]:
+                header_value = message.get_header(header_name)
+                
+                if header_value is not None:
+                    self.message.set_header(header_name.title(), header_value)
+        
+        self.time = time.time()
+        self.age = get_integer(message.get_header(b"age") or b"0") or 0
+        self.lifetime = 0
+        
+        if b"no-cache" not in cache_control:
+            if b"s-maxage" in cache_control:
+                self.lifetime = get_integer(cache_control[b"s-maxage"]) or 0
+            else:
+                if b"max-age" in cache_control:
+                    self.lifetime = get_integer(cache_control[b"max-age"]) or 0
+                else:
+                    expires = get_date(message.get_header(b"expires"))
+                    
+                    if expires is not None:
+                        date = get_date(message.get_header(b"date"))
+                        
+                        if date is None:
+                            date = self.time
+                        
+                        self.lifetime = expires - date
+        
+        self.message.remove_header(b"age")
+    
+    def add_reader(self, reader):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.add_reader")
+        
+        if self.data_state == 1:
+            reader.entry__message_received(self.message)
+            
+            return
+        
+        if self.data_state == 2:
+            reader.entry__message_error()
+            
+            return
+        
+        self.readers.append(reader)
+        
+        if self.message is not None:
+            reader.entry__message_received(self.message)
+            
+            for data in self.data:
+                reader.entry__data_received(data)
+    
+    def remove_reader(self, reader):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.remove_reader")
+        
+        if reader in self.readers:
+            self.readers.remove(reader)
+    
+    def message_received(self, message):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.message_received")
+        
+        self.message = message
+        
+        self.update(message)
+        
+        for reader in list(self.readers):
+            reader.entry__message_received(message)
+    
+    def data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.data_received")
+        
+        self.data_length = self.data_length + len(data)
+        
+        if self.storable == True:
+            if self.data_length > self.cache.maximum_entry_size:
+                # readers that are attached keep receiving the response, the entry is not stored
+                self.storable = False
+                self.data = []
+                
+                self.cache.remove_pending_entry(self)
+            else:
+                self.data.append(data)
+        
+        for reader in list(self.readers):
+            reader.entry__data_received(data)
+    
+    def message_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.message_completed")
+        
+        self.data_state = 1
+        
+        readers = self.readers
+        
+        self.readers = []
+        
+        for reader in readers:
+            reader.entry__message_completed()
+        
+        if self.storable == True:
+            self.data = [b"".join(self.data)]
+            
+            self.cache.add_entry(self)
+    
+    def message_replaced(self, entry):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.message_replaced")
+        
+        self.data_state = 2
+        self.data = []
+        
+        self.cache.remove_pending_entry(self)
+        
+        readers = self.readers
+        
+        self.readers = []
+        
+        for reader in readers:
+            reader.entry = entry
+            
+            entry.add_reader(reader)
+    
+    def message_error(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheEntry.message_error")
+        
+        self.data_state = 2
+        self.data = []
+        
+        self.cache.remove_pending_entry(self)
+        
+        readers = self.readers
+        
+        self.readers = []
+        
+        for reader in readers:
+            reader.entry__message_error()
+
+class HTTPCacheFile(object):
+    def __init__(self, path, data_length):
+        twunnel3.logger.log(3, "trace: HTTPCacheFile.__init__")
+        
+        self.path = path
+        self.data_length = data_length
+    
+    def get_data(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheFile.get_data")
+        
+        # the file is opened off the event loop
+        return asyncio.get_event_loop().run_in_executor(None, read_file, self.path, self.data_length)
+    
+    def remove(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheFile.remove")
+        
+        remove_file(self.path)
+
+def read_file(path, data_length):
+    if data_length == 0:
+        return []
+    
+    with open(path, "rb") as file:
+        data_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    data = []
+    data_view = memoryview(data_map)
+    
+    i = 0
+    while i < data_length:
+        data.append(data_view[i:i + 65536])
+        i = i + 65536
+    
+    return data
+
+def write_file(directory, data):
+    # the data is written to a temporary file, a file which is mapped by readers is never truncated
+    file_descriptor, path = tempfile.mkstemp(".tmp", "", directory)
+    
+    try:
+        with open(file_descriptor, "wb") as file:
+            file.write(data)
+    except OSError:
+        remove_file(path)
+        raise
+    
+    return path
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class HTTPCacheReader(object):
+    def __init__(self, entry, request_message, connection_pool, address, port):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.__init__")
+        
+        self.entry = entry
+        self.request_message = request_message
+        self.connection_pool = connection_pool
+        self.address = address
+        self.port = port
+        self.input_protocol = None
+        self.data = collections.deque()
+        self.data_state = 0
+        self.reading_paused = False
+        self.requests = 0
+        self.connection_state = 0
+    
+    def create_connection(self, input_protocol):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.create_connection")
+        
+        self.input_protocol = input_protocol
+        
+        self.connection_state = 1
+        
+        asyncio.get_event_loop().call_soon(self.entry.add_reader, self)
+    
+    def entry__message_received(self, message):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.entry__message_received")
+        
+        if self.connection_state != 1:
+            return
+        
+        self.input_protocol.output_protocol = self
+        self.input_protocol.output_protocol__connection_made(None)
+        
+        if self.connection_state != 1:
+            return
+        
+        message = copy_message(message)
+        
+        etag = message.get_header(b"etag")
+        
+        if self.entry.data_state == 1 and etag is not None and etag in self.request_message.get_header_tokens(b"if-none-match"):
+            message.status = 304
+            message.reason = b"Not Modified"
+            message.remove_header(b"content-length")
+            message.remove_header(b"transfer-encoding")
+            
+            self.data_state = 1
+        else:
+            if self.entry.data_state == 1:
+                future = self.entry.get_data()
+                future.add_done_callback(self.entry__get_data_done)
+        
+        message.set_header(b"Age", str(int(self.entry.get_age())).encode())
+        
+        self.input_protocol.output_protocol__response_received(message, True)
+        
+        self.write_data()
+    
+    def entry__get_data_done(self, future):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.entry__get_data_done")
+        
+        if self.connection_state != 1:
+            return
+        
+        if future.cancelled() or future.exception() is not None:
+            self.connection_state = 2
+            
+            self.input_protocol.output_protocol__connection_lost(None)
+            
+            return
+        
+        for data in future.result():
+            self.data.append(data)
+        
+        self.data_state = 1
+        
+        self.write_data()
+    
+    def entry__data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.entry__data_received")
+        
+        if self.connection_state != 1 or self.data_state == 1:
+            return
+        
+        self.data.append(data)
+        
+        self.write_data()
+    
+    def entry__message_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.entry__message_completed")
+        
+        if self.connection_state != 1:
+            return
+        
+        self.data_state = 1
+        
+        self.write_data()
+    
+    def entry__message_error(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.entry__message_error")
+        
+        if self.connection_state != 1:
+            return
+        
+        self.connection_state = 2
+        
+        if self.input_protocol.output_protocol is self:
+            self.input_protocol.output_protocol__connection_lost(None)
+        else:
+            # the response was not cacheable, the request is forwarded on its own
+            self.connection_pool.create_connection(self.input_protocol, self.address, self.port)
+    
+    def write_data(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.write_data")
+        
+        while len(self.data) > 0 and self.reading_paused == False and self.connection_state == 1:
+            self.input_protocol.output_protocol__data_received(self.data.popleft())
+        
+        if len(self.data) == 0 and self.data_state == 1 and self.connection_state == 1:
+            self.connection_state = 2
+            
+            self.input_protocol.output_protocol__response_completed()
+    
+    def input_protocol__connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.input_protocol__connection_made")
+    
+    def input_protocol__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.input_protocol__connection_lost")
+        
+        self.connection_state = 2
+        self.data.clear()
+        
+        self.entry.remove_reader(self)
+    
+    def input_protocol__data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.input_protocol__data_received")
+    
+    def input_protocol__request_sent(self, request_method):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.input_protocol__request_sent")
+    
+    def input_protocol__response_completed(self, keep_alive):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.input_protocol__response_completed")
+    
+    def pause_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.pause_reading")
+        
+        self.reading_paused = True
+    
+    def resume_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheReader.resume_reading")
+        
+        if self.reading_paused == True:
+            self.reading_paused = False
+            
+            asyncio.get_event_loop().call_soon(self.write_data)
+
+class HTTPCacheWriter(object):
+    def __init__(self, entry, stale_entry, stale_data, connection_pool, address, port):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.__init__")
+        
+        self.entry = entry
+        self.stale_entry = stale_entry
+        self.stale_data = stale_data
+        self.connection_pool = connection_pool
+        self.address = address
+        self.port = port
+        self.input_protocol = None
+        self.output_protocol = None
+        self.response_state = 0
+    
+    @property
+    def requests(self):
+        if self.output_protocol is None:
+            return 0
+        
+        return self.output_protocol.requests
+    
+    def create_connection(self, input_protocol):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.create_connection")
+        
+        self.input_protocol = input_protocol
+        
+        self.connection_pool.create_connection(self, self.address, self.port)
+    
+    def output_protocol__connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__connection_made")
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol = self
+            self.input_protocol.output_protocol__connection_made(transport)
+        else:
+            self.output_protocol.input_protocol__connection_lost(None)
+    
+    def output_protocol__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__connection_lost")
+        
+        if self.entry is not None and self.entry.data_state == 0:
+            self.entry.message_error()
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__connection_lost(exception)
+    
+    def output_protocol__response_received(self, message, delimited):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__response_received")
+        
+        if message.status < 200:
+            if self.input_protocol is not None:
+                self.input_protocol.output_protocol__response_received(message, delimited)
+            
+            return
+        
+        if message.status == 304 and self.stale_entry is not None:
+            # the stale entry was revalidated, it is served instead of the empty response
+            self.stale_entry.update(message)
+            
+            self.response_state = 1
+            
+            self.stale_entry.cache.add_entry(self.stale_entry)
+            
+            if self.entry is not None:
+                self.entry.message_replaced(self.stale_entry)
+                self.entry = None
+            
+            if self.input_protocol is not None:
+                message = copy_message(self.stale_entry.message)
+                
+                self.input_protocol.output_protocol__response_received(message, True)
+                
+                self.stale_data.add_done_callback(self.stale_entry__get_data_done)
+            
+            return
+        
+        if self.entry is not None:
+            if delimited == True and self.entry.cache.is_storable(message):
+                stored_message = copy_message(message)
+                stored_message.remove_hop_by_hop_headers()
+                
+                self.entry.message_received(stored_message)
+                
+                if self.entry.lifetime <= 0 and stored_message.get_header(b"etag") is None and stored_message.get_header(b"last-modified") is None:
+                    self.entry.storable = False
+                    
+                    self.entry.cache.remove_pending_entry(self.entry)
+            else:
+                self.entry.message_error()
+                self.entry = None
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__response_received(message, delimited)
+    
+    def output_protocol__data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__data_received")
+        
+        if self.response_state != 0:
+            return
+        
+        if self.entry is not None:
+            self.entry.data_received(data)
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__data_received(data)
+    
+    def output_protocol__response_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__response_completed")
+        
+        if self.input_protocol is not None and self.response_state == 1:
+            # the response is completed once the data of the stale entry is sent
+            self.response_state = 2
+            
+            return
+        
+        if self.entry is not None:
+            self.entry.message_completed()
+            self.entry = None
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__response_completed()
+        else:
+            self.output_protocol.input_protocol__response_completed(True)
+    
+    def stale_entry__get_data_done(self, future):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.stale_entry__get_data_done")
+        
+        if self.input_protocol is None:
+            return
+        
+        if future.cancelled() or future.exception() is not None:
+            self.input_protocol.output_protocol__connection_lost(None)
+            
+            return
+        
+        for data in future.result():
+            self.input_protocol.output_protocol__data_received(data)
+        
+        if self.response_state == 2:
+            self.response_state = 3
+            
+            self.output_protocol__response_completed()
+        else:
+            self.response_state = 3
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__pause_writing")
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__pause_writing()
+    
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.output_protocol__resume_writing")
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__resume_writing()
+    
+    def input_protocol__connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.input_protocol__connection_made")
+    
+    def input_protocol__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.input_protocol__connection_lost")
+        
+        self.input_protocol = None
+        
+        # the response keeps filling the entry as long as other clients are waiting for it
+        if self.entry is not None and self.entry.message is not None and len(self.entry.readers) > 0:
+            return
+        
+        if self.entry is not None:
+            self.entry.message_error()
+            self.entry = None
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__connection_lost(exception)
+    
+    def input_protocol__data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.input_protocol__data_received")
+        
+        self.output_protocol.input_protocol__data_received(data)
+    
+    def input_protocol__request_sent(self, request_method):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.input_protocol__request_sent")
+        
+        self.output_protocol.input_protocol__request_sent(request_method)
+    
+    def input_protocol__response_completed(self, keep_alive):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.input_protocol__response_completed")
+        
+        self.output_protocol.input_protocol__response_completed(keep_alive)
+    
+    def pause_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.pause_reading")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.pause_reading()
+    
+    def resume_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPCacheWriter.resume_reading")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.resume_reading()
+
+class HTTPCacheRequest(object):
+    def __init__(self, cache, key, message, address, port):
+        twunnel3.logger.log(3, "trace: HTTPCacheRequest.__init__")
+        
+        self.cache = cache
+        self.key = key
+        self.message = message
+        self.address = address
+        self.port = port
+        self.entry = None
+        self.stale_entry = None
+        self.stale_data = None
+    
+    def create_connection(self, input_protocol):
+        twunnel3.logger.log(3, "trace: HTTPCacheRequest.create_connection")
+        
+        if self.entry is not None:
+            reader = HTTPCacheReader(self.entry, self.message, self.cache.connection_pool, self.address, self.port)
+            reader.create_connection(input_protocol)
+        else:
+            entry = HTTPCacheEntry(self.cache, self.key)
+            
+            self.cache.add_pending_entry(entry)
+            
+            writer = HTTPCacheWriter(entry, self.stale_entry, self.stale_data, self.cache.connection_pool, self.address, self.port)
+            writer.create_connection(input_protocol)
+
+class HTTPCache(object):
+    def __init__(self, configuration, connection_pool):
+        twunnel3.logger.log(3, "trace: HTTPCache.__init__")
+        
+        self.configuration = configuration
+        self.connection_pool = connection_pool
+        self.size = configuration.local_proxy_server.cache.size
+        self.maximum_entry_size = configuration.local_proxy_server.cache.maximum_entry_size
+        self.directory = configuration.local_proxy_server.cache.directory
+        self.directory_size = configuration.local_proxy_server.cache.directory_size
+        self.entries = collections.OrderedDict()
+        self.entries_size = 0
+        self.file_entries = collections.OrderedDict()
+        self.file_entries_size = 0
+        self.file_writes = {}
+        self.pending_entries = {}
+        
+        if self.directory != "":
+            os.makedirs(self.directory, exist_ok=True)
+            
+            # the files of an earlier run are not entries, they would never be removed
+            for name in os.listdir(self.directory):
+                if name.endswith(".cache") or name.endswith(".tmp"):
+                    remove_file(os.path.join(self.directory, name))
+    
+    def create_request(self, message, address, port):
+        twunnel3.logger.log(3, "trace: HTTPCache.create_request")
+        
+        key = (address, port, message.uri)
+        
+        if message.method != b"GET":
+            if message.method != b"HEAD" and message.method != b"OPTIONS" and message.method != b"TRACE":
+                self.remove_entry(key)
+            
+            return None
+        
+        if message.get_header(b"authorization") is not None:
+            return None
+        
+        cache_control = get_cache_control(message)
+        
+        if b"no-store" in cache_control:
+            return None
+        
+        request = HTTPCacheRequest(self, key, message, address, port)
+        
+        entry = self.pending_entries.get(key)
+        
+        if entry is not None:
+            twunnel3.logger.log(2, "cache: waiting")
+            
+            request.entry = entry
+            
+            return request
+        
+        entry = self.get_entry(key)
+        
+        if entry is None:
+            twunnel3.logger.log(2, "cache: miss")
+            
+            return request
+        
+        revalidate = b"no-cache" in cache_control or b"no-cache" in message.get_header_tokens(b"pragma") or cache_control.get(b"max-age") == b"0"
+        
+        if revalidate == False and entry.is_fresh() == True:
+            twunnel3.logger.log(2, "cache: hit")
+            
+            request.entry = entry
+            
+            return request
+        
+        twunnel3.logger.log(2, "cache: revalidate")
+        
+        etag = entry.message.get_header(b"etag")
+        last_modified = entry.message.get_header(b"last-modified")
+        
+        if message.get_header(b"if-none-match") is None and message.get_header(b"if-modified-since") is None:
+            if etag is not None:
+                message.headers.append((b"If-None-Match", etag))
+            
+            if last_modified is not None:
+                message.headers.append((b"If-Modified-Since", last_modified))
+            
+            # the data is taken now, the entry can be evicted while it is revalidated
+            request.stale_entry = entry
+            request.stale_data = entry.get_data()
+        
+        return request
+    
+    def is_storable(self, message):
+        twunnel3.logger.log(3, "trace: HTTPCache.is_storable")
+        
+        if message.status != 200:
+            return False
+        
+        cache_control = get_cache_control(message)
+        
+        if b"no-store" in cache_control or b"private" in cache_control:
+            return False
+        
+        if message.get_header(b"vary") is not None or message.get_header(b"set-cookie") is not None:
+            return False
+        
+        content_length = message.get_header(b"content-length")
+        
+        if content_length is not None and (get_integer(content_length) or 0) > self.maximum_entry_size:
+            return False
+        
+        return True
+    
+    def add_pending_entry(self, entry):
+        twunnel3.logger.log(3, "trace: HTTPCache.add_pending_entry")
+        
+        self.pending_entries[entry.key] = entry
+    
+    def remove_pending_entry(self, entry):
+        twunnel3.logger.log(3, "trace: HTTPCache.remove_pending_entry")
+        
+        if self.pending_entries.get(entry.key) is entry:
+            del self.pending_entries[entry.key]
+    
+    def get_entry(self, key):
+        twunnel3.logger.log(3, "trace: HTTPCache.get_entry")
+        
+        entry = self.entries.get(key)
+        
+        if entry is not None:
+            self.entries.move_to_end(key)
+            
+            return entry
+        
+        entry = self.file_entries.get(key)
+        
+        if entry is not None:
+            self.file_entries.move_to_end(key)
+            
+            return entry
+        
+        return None
+    
+    def add_entry(self, entry):
+        twunnel3.logger.log(3, "trace: HTTPCache.add_entry")
+        
+        self.remove_pending_entry(entry)
+        
+        if self.entries.get(entry.key) is entry or self.file_entries.get(entry.key) is entry:
+            return
+        
+        self.remove_entry(entry.key)
+        
+        if entry.data_file is not None:
+            # the entry was evicted, its file is removed
+            return
+        
+        if entry.data_length > self.size:
+            self.add_file_entry(entry)
+            
+            return
+        
+        self.entries[entry.key] = entry
+        self.entries_size = self.entries_size + entry.data_length
+        
+        while self.entries_size > self.size:
+            key, evicted_entry = self.entries.popitem(last=False)
+            
+            self.entries_size = self.entries_size - evicted_entry.data_length
+            
+            self.add_file_entry(evicted_entry)
+    
+    def add_file_entry(self, entry):
+        twunnel3.logger.log(3, "trace: HTTPCache.add_file_entry")
+        
+        if self.directory == "" or entry.data_length > self.directory_size:
+            return
+        
+        path = os.path.join(self.directory, hashlib.sha1(repr(entry.key).encode()).hexdigest() + ".cache")
+        data = b"".join(entry.data)
+        
+        self.file_writes[entry.key] = entry
+        
+        # the file is written off the event loop, the entry becomes available once it is complete
+        future = asyncio.get_event_loop().run_in_executor(None, write_file, self.directory, data)
+        
+        def write_file_done(future):
+            if future.cancelled() or future.exception() is not None:
+                if self.file_writes.get(entry.key) is entry:
+                    del self.file_writes[entry.key]
+                
+                return
+            
+            temporary_path = future.result()
+            
+            if self.file_writes.get(entry.key) is not entry:
+                # the entry was removed or replaced while it was written
+                remove_file(temporary_path)
+                
+                return
+            
+            del self.file_writes[entry.key]
+            
+            try:
+                os.replace(temporary_path, path)
+            except OSError:
+                remove_file(temporary_path)
+                
+                return
+            
+            entry.data = []
+            entry.data_file = HTTPCacheFile(path, entry.data_length)
+            
+            self.file_entries[entry.key] = entry
+            self.file_entries_size = self.file_entries_size + entry.data_length
+            
+            while self.file_entries_size > self.directory_size:
+                key, evicted_entry = self.file_entries.popitem(last=False)
+                
+                self.file_entries_size = self.file_entries_size - evicted_entry.data_length
+                
+                evicted_entry.data_file.remove()
+        
+        future.add_done_callback(write_file_done)
+    
+    def remove_entry(self, key):
+        twunnel3.logger.log(3, "trace: HTTPCache.remove_entry")
+        
+        self.file_writes.pop(key, None)
+        
+        entry = self.entries.pop(key, None)
+        
+        if entry is not None:
+            self.entries_size = self.entries_size - entry.data_length
+        
+        entry = self.file_entries.pop(key, None)
+        
+        if entry is not None:
+            self.file_entries_size = self.file_entries_size - entry.data_length
+            
+            entry.data_file.remove()
\ No newline at end of file
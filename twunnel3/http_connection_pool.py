@@ -0,0 +1,254 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import twunnel3.http_parser
+import twunnel3.logger
+import twunnel3.proxy_server
+
+class HTTPOutputProtocol(asyncio.Protocol):
+    __slots__ = ("connection_pool", "connection_pool_key", "connection_pool_handle", "input_protocol", "response_parser", "response_keep_alive", "requests", "reading_paused", "connection_state", "transport")
+    
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.__init__")
+        
+        self.connection_pool = None
+        self.connection_pool_key = None
+        self.connection_pool_handle = None
+        self.input_protocol = None
+        self.response_parser = twunnel3.http_parser.HTTPParser(self, False)
+        self.response_keep_alive = False
+        self.requests = 0
+        self.reading_paused = False
+        self.connection_state = 0
+        self.transport = None
+    
+    def connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.connection_made")
+        
+        self.transport = transport
+        
+        self.connection_state = 1
+        
+        self.input_protocol.output_protocol__connection_made(self.transport)
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.connection_lost")
+        
+        self.connection_state = 2
+        
+        self.connection_pool.remove_connection(self)
+        
+        if self.input_protocol is not None:
+            self.response_parser.connection_lost()
+            
+            if self.input_protocol is not None:
+                self.input_protocol.output_protocol__connection_lost(exception)
+        
+        self.transport = None
+    
+    def data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.data_received")
+        
+        if self.input_protocol is not None:
+            self.response_parser.data_received(data)
+        else:
+            self.transport.close()
+    
+    def http_parser__message_received(self, message):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.http_parser__message_received")
+        
+        self.response_keep_alive = message.is_keep_alive() and self.response_parser.data_state != 5
+        
+        self.input_protocol.output_protocol__response_received(message, self.response_parser.data_state != 5)
+    
+    def http_parser__message_data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.http_parser__message_data_received")
+        
+        self.input_protocol.output_protocol__data_received(data)
+    
+    def http_parser__message_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.http_parser__message_completed")
+        
+        input_protocol = self.input_protocol
+        
+        self.input_protocol = None
+        
+        input_protocol.output_protocol__response_completed()
+    
+    def http_parser__message_error(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.http_parser__message_error")
+        
+        self.transport.close()
+    
+    def input_protocol__connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.input_protocol__connection_made")
+    
+    def input_protocol__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.input_protocol__connection_lost")
+        
+        self.input_protocol = None
+        
+        if self.connection_state == 1:
+            self.transport.close()
+    
+    def input_protocol__data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.input_protocol__data_received")
+        
+        if self.connection_state == 1:
+            self.transport.write(data)
+    
+    def input_protocol__request_sent(self, request_method):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.input_protocol__request_sent")
+        
+        self.response_parser.request_method = request_method
+        self.requests = self.requests + 1
+    
+    def input_protocol__response_completed(self, keep_alive):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.input_protocol__response_completed")
+        
+        if self.connection_state == 1:
+            if keep_alive == True and self.response_keep_alive == True:
+                self.connection_pool.release_connection(self)
+            else:
+                self.transport.close()
+    
+    def pause_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.pause_reading")
+        
+        if self.connection_state == 1 and self.reading_paused == False:
+            self.reading_paused = True
+            
+            self.transport.pause_reading()
+    
+    def resume_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.resume_reading")
+        
+        if self.connection_state == 1 and self.reading_paused == True:
+            self.reading_paused = False
+            
+            self.transport.resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.pause_writing")
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocol.resume_writing")
+        
+        if self.input_protocol is not None:
+            self.input_protocol.output_protocol__resume_writing()
+
+class HTTPOutputProtocolFactory(object):
+    __slots__ = ("connection_pool", "connection_pool_key", "input_protocol")
+    
+    def __init__(self, connection_pool, connection_pool_key, input_protocol):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocolFactory.__init__")
+        
+        self.connection_pool = connection_pool
+        self.connection_pool_key = connection_pool_key
+        self.input_protocol = input_protocol
+    
+    def __call__(self):
+        twunnel3.logger.log(3, "trace: HTTPOutputProtocolFactory.__call__")
+        
+        output_protocol = HTTPOutputProtocol()
+        output_protocol.connection_pool = self.connection_pool
+        output_protocol.connection_pool_key = self.connection_pool_key
+        output_protocol.input_protocol = self.input_protocol
+        output_protocol.input_protocol.output_protocol = output_protocol
+        return output_protocol
+
+class HTTPConnectionPool(object):
+    def __init__(self, configuration):
+        twunnel3.logger.log(3, "trace: HTTPConnectionPool.__init__")
+        
+        self.configuration = configuration
+        self.connections = {}
+    
+    def create_connection(self, input_protocol, address, port):
+        twunnel3.logger.log(3, "trace: HTTPConnectionPool.create_connection")
+        
+        connection_pool_key = (address, port)
+        
+        connections = self.connections.get(connection_pool_key)
+        
+        while connections:
+            output_protocol = connections.pop()
+            
+            if len(connections) == 0:
+                del self.connections[connection_pool_key]
+            
+            output_protocol.connection_pool_handle.cancel()
+            output_protocol.connection_pool_handle = None
+            
+            if output_protocol.connection_state == 1:
+                twunnel3.logger.log(2, "reusing connection: " + address + ":" + str(port))
+                
+                output_protocol.input_protocol = input_protocol
+                output_protocol.input_protocol.output_protocol = output_protocol
+                output_protocol.input_protocol.output_protocol__connection_made(output_protocol.transport)
+                
+                return
+        
+        output_protocol_factory = HTTPOutputProtocolFactory(self, connection_pool_key, input_protocol)
+        
+        tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
+        future = asyncio.async(tunnel.create_connection(output_protocol_factory, address, port, socket_profile=self.configuration.local_proxy_server.socket_profile))
+        
+        def create_connection_done(future):
+            if future.cancelled():
+                input_protocol.output_protocol__connection_lost(None)
+            else:
+                if future.exception() is not None:
+                    input_protocol.output_protocol__connection_lost(future.exception())
+        
+        future.add_done_callback(create_connection_done)
+    
+    def release_connection(self, output_protocol):
+        twunnel3.logger.log(3, "trace: HTTPConnectionPool.release_connection")
+        
+        connections = self.connections.get(output_protocol.connection_pool_key)
+        
+        # the list of a key is only made when a connection is kept, so a full pool or a pool of SIZE 0 does not keep empty lists
+        if connections is None:
+            connections = []
+        
+        if len(connections) >= self.configuration.local_proxy_server.connection_pool.size:
+            output_protocol.transport.close()
+            
+            return
+        
+        # idle connections keep reading so that they notice when the server closes them
+        output_protocol.resume_reading()
+        output_protocol.connection_pool_handle = asyncio.get_event_loop().call_later(self.configuration.local_proxy_server.connection_pool.timeout, output_protocol.transport.close)
+        
+        connections.append(output_protocol)
+        
+        self.connections[output_protocol.connection_pool_key] = connections
+    
+    def remove_connection(self, output_protocol):
+        twunnel3.logger.log(3, "trace: HTTPConnectionPool.remove_connection")
+        
+        if output_protocol.connection_pool_handle is None:
+            return
+        
+        output_protocol.connection_pool_handle.cancel()
+        output_protocol.connection_pool_handle = None
+        
+        connections = self.connections.get(output_protocol.connection_pool_key)
+        
+        if connections is not None and output_protocol in connections:
+            connections.remove(output_protocol)
+            
+            if len(connections) == 0:
+                del self.connections[output_protocol.connection_pool_key]
+    
+    def close(self):
+        twunnel3.logger.log(3, "trace: HTTPConnectionPool.close")
+        
+        for connections in list(self.connections.values()):
+            for output_protocol in list(connections):
+                output_protocol.transport.close()
\ No newline at end of file
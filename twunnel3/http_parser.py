@@ -0,0 +1,478 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import twunnel3.logger
+
+hop_by_hop_header_names = [b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization", b"proxy-connection", b"te", b"upgrade"]
+
+# a chunk size is only hexadecimal digits, int also accepts a sign, a 0x prefix and underscores
+hexadecimal_digits = b"0123456789abcdefABCDEF"
+
+def parse_absolute_uri(uri):
+    i = uri.find(b"://")
+    
+    if i == -1 or uri[:i].lower() != b"http":
+        return None
+    
+    uri = uri[i + 3:]
+    
+    i = uri.find(b"/")
+    
+    if i == -1:
+        authority = uri
+        path = b"/"
+    else:
+        authority = uri[:i]
+        path = uri[i:]
+    
+    i = authority.rfind(b"@")
+    
+    if i != -1:
+        authority = authority[i + 1:]
+    
+    i1 = authority.find(b"[")
+    i2 = authority.find(b"]")
+    i3 = authority.rfind(b":")
+    
+    if i3 > i2:
+        address = authority[:i3]
+        try:
+            port = int(authority[i3 + 1:])
+        except ValueError:
+            return None
+    else:
+        address = authority
+        port = 80
+    
+    if i2 > i1:
+        address = address[i1 + 1:i2]
+    
+    if address == b"":
+        return None
+    
+    return (address.decode(), port, path)
+
+class HTTPMessage(object):
+    __slots__ = ("method", "uri", "version", "status", "reason", "headers")
+    
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: HTTPMessage.__init__")
+        
+        self.method = b""
+        self.uri = b""
+        self.version = b""
+        self.status = 0
+        self.reason = b""
+        self.headers = []
+    
+    def get_header(self, name):
+        for header_name, header_value in self.headers:
+            if header_name.lower() == name:
+                return header_value
+        
+        return None
+    
+    def get_header_tokens(self, name):
+        tokens = []
+        
+        for header_name, header_value in self.headers:
+            if header_name.lower() == name:
+                for token in header_value.split(b","):
+                    token = token.strip().lower()
+                    if token != b"":
+                        tokens.append(token)
+        
+        return tokens
+    
+    def set_header(self, name, value):
+        self.remove_header(name.lower())
+        self.headers.append((name, value))
+    
+    def remove_header(self, name):
+        self.headers = [(header_name, header_value) for header_name, header_value in self.headers if header_name.lower() != name]
+    
+    def remove_hop_by_hop_headers(self):
+        names = hop_by_hop_header_names + self.get_header_tokens(b"connection")
+        
+        self.headers = [(header_name, header_value) for header_name, header_value in self.headers if header_name.lower() not in names]
+    
+    def is_keep_alive(self):
+        tokens = self.get_header_tokens(b"connection") + self.get_header_tokens(b"proxy-connection")
+        
+        if self.version == b"HTTP/1.1":
+            return b"close" not in tokens
+        else:
+            return b"keep-alive" in tokens
+    
+    def encode(self):
+        lines = []
+        
+        if self.status == 0:
+            lines.append(self.method + b" " + self.uri + b" " + self.version)
+        else:
+            lines.append(self.version + b" " + str(self.status).encode() + b" " + self.reason)
+        
+        for header_name, header_value in self.headers:
+            lines.append(header_name + b": " + header_value)
+        
+        lines.append(b"")
+        lines.append(b"")
+        
+        return b"\r\n".join(lines)
+
+class HTTPParser(object):
+    __slots__ = ("handler", "request", "request_method", "message", "data", "data_offset", "data_state", "length", "paused", "maximum_head_length")
+    
+    def __init__(self, handler, request):
+        twunnel3.logger.log(3, "trace: HTTPParser.__init__")
+        
+        self.handler = handler
+        self.request = request
+        self.request_method = b""
+        self.message = None
+        # the data is kept as it is received, a head or a line which is received in several parts grows in place and is searched from data_offset, so it is not copied and searched again for every part
+        self.data = b""
+        self.data_offset = 0
+        self.data_state = 0
+        self.length = 0
+        self.paused = False
+        self.maximum_head_length = 65536
+    
+    def data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPParser.data_received")
+        
+        if len(self.data) == 0 and isinstance(data, bytes) == True:
+            self.data = data
+        else:
+            if isinstance(self.data, bytearray) == False:
+                self.data = bytearray(self.data)
+            
+            self.data += data
+        
+        self.process_data()
+    
+    def process_data(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data")
+        
+        while self.paused == False:
+            if self.data_state == 0:
+                if self.process_data_state0():
+                    return
+            else:
+                if self.data_state == 1:
+                    if self.process_data_state1():
+                        return
+                else:
+                    if self.data_state == 2:
+                        if self.process_data_state2():
+                            return
+                    else:
+                        if self.data_state == 3:
+                            if self.process_data_state3():
+                                return
+                        else:
+                            if self.data_state == 4:
+                                if self.process_data_state4():
+                                    return
+                            else:
+                                if self.data_state == 5:
+                                    if self.process_data_state5():
+                                        return
+                                else:
+                                    return
+    
+    def pause(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.pause")
+        
+        self.paused = True
+    
+    def resume(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.resume")
+        
+        self.paused = False
+        
+        self.process_data()
+    
+    def connection_lost(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.connection_lost")
+        
+        if self.data_state == 5:
+            self.message_completed()
+    
+    def process_data_state0(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data_state0")
+        
+        data = self.data
+        
+        i = data.find(b"\r\n\r\n", self.data_offset)
+        
+        if i == -1:
+            if len(data) > self.maximum_head_length:
+                self.message_error()
+                
+                return True
+            
+            # the end of the head can be split over two parts
+            self.data_offset = max(len(data) - 3, 0)
+            
+            return True
+        
+        i = i + 4
+        
+        head = bytes(data[:i - 4])
+        
+        self.data = data[i:]
+        self.data_offset = 0
+        
+        head_lines = head.split(b"\r\n")
+        head_line = head_lines[0].split(b" ", 2)
+        
+        if len(head_line) != 3:
+            self.message_error()
+            
+            return True
+        
+        message = HTTPMessage()
+        
+        if self.request == True:
+            message.method = head_line[0].upper()
+            message.uri = head_line[1]
+            message.version = head_line[2].upper()
+        else:
+            message.version = head_line[0].upper()
+            try:
+                message.status = int(head_line[1])
+            except ValueError:
+                self.message_error()
+                
+                return True
+            message.reason = head_line[2]
+        
+        for head_line in head_lines[1:]:
+            i = head_line.find(b":")
+            
+            if i == -1:
+                self.message_error()
+                
+                return True
+            
+            message.headers.append((head_line[:i].strip(), head_line[i + 1:].strip()))
+        
+        self.message = message
+        
+        transfer_encodings = message.get_header_tokens(b"transfer-encoding")
+        content_lengths = message.get_header_tokens(b"content-length")
+        
+        # a message whose length can be read in more than one way lets a request be smuggled past the proxy to the server, so the length of a request is only read in one way
+        if message.get_header(b"content-length") is not None:
+            if len(content_lengths) != 1 or content_lengths[0].isdigit() == False:
+                self.message_error()
+                
+                return True
+            
+            if len(transfer_encodings) > 0:
+                if self.request == True:
+                    self.message_error()
+                    
+                    return True
+                
+                # the Transfer-Encoding of a response overrides its Content-Length, which is not passed on
+                message.remove_header(b"content-length")
+                
+                content_lengths = []
+        
+        if len(transfer_encodings) > 0 and transfer_encodings[-1] != b"chunked" and self.request == True:
+            self.message_error()
+            
+            return True
+        
+        if self.request == False and (self.request_method == b"HEAD" or message.status < 200 or message.status == 204 or message.status == 304):
+            self.data_state = 6
+        else:
+            if len(transfer_encodings) > 0:
+                # a response which is not chunked last ends when the connection is closed
+                if transfer_encodings[-1] == b"chunked":
+                    self.data_state = 2
+                else:
+                    self.data_state = 5
+            else:
+                if len(content_lengths) > 0:
+                    self.length = int(content_lengths[0])
+                    
+                    if self.length > 0:
+                        self.data_state = 1
+                    else:
+                        self.data_state = 6
+                else:
+                    if self.request == True:
+                        self.data_state = 6
+                    else:
+                        self.data_state = 5
+        
+        self.handler.http_parser__message_received(message)
+        
+        if self.data_state == 6:
+            self.message_completed()
+        
+        return False
+    
+    def process_data_state1(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data_state1")
+        
+        data = self.data
+        
+        if len(data) == 0:
+            return True
+        
+        if len(data) > self.length:
+            self.data = data[self.length:]
+            data = bytes(data[:self.length])
+        else:
+            self.data = b""
+            data = bytes(data)
+        
+        self.length = self.length - len(data)
+        
+        self.handler.http_parser__message_data_received(data)
+        
+        if self.length == 0:
+            self.message_completed()
+        
+        return False
+    
+    def process_data_state2(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data_state2")
+        
+        data = self.data
+        
+        i = data.find(b"\r\n", self.data_offset)
+        
+        if i == -1:
+            if len(data) > 4096:
+                self.message_error()
+                
+                return True
+            
+            self.data_offset = max(len(data) - 1, 0)
+            
+            return True
+        
+        i = i + 2
+        
+        chunk_line = bytes(data[:i])
+        
+        self.data = data[i:]
+        self.data_offset = 0
+        
+        chunk_size = chunk_line[:-2].split(b";", 1)[0].strip()
+        
+        if len(chunk_size) == 0 or len(chunk_size.translate(None, hexadecimal_digits)) > 0:
+            self.message_error()
+            
+            return True
+        
+        self.length = int(chunk_size, 16)
+        
+        self.handler.http_parser__message_data_received(chunk_line)
+        
+        if self.length == 0:
+            self.data_state = 4
+        else:
+            self.length = self.length + 2
+            self.data_state = 3
+        
+        return False
+    
+    def process_data_state3(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data_state3")
+        
+        data = self.data
+        
+        if len(data) == 0:
+            return True
+        
+        if len(data) > self.length:
+            self.data = data[self.length:]
+            data = bytes(data[:self.length])
+        else:
+            self.data = b""
+            data = bytes(data)
+        
+        self.length = self.length - len(data)
+        
+        self.handler.http_parser__message_data_received(data)
+        
+        if self.length == 0:
+            self.data_state = 2
+        
+        return False
+    
+    def process_data_state4(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data_state4")
+        
+        data = self.data
+        
+        i = data.find(b"\r\n", self.data_offset)
+        
+        if i == -1:
+            if len(data) > self.maximum_head_length:
+                self.message_error()
+                
+                return True
+            
+            self.data_offset = max(len(data) - 1, 0)
+            
+            return True
+        
+        i = i + 2
+        
+        trailer_line = bytes(data[:i])
+        
+        self.data = data[i:]
+        self.data_offset = 0
+        
+        self.handler.http_parser__message_data_received(trailer_line)
+        
+        if i == 2:
+            self.message_completed()
+        
+        return False
+    
+    def process_data_state5(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.process_data_state5")
+        
+        data = self.data
+        
+        if len(data) == 0:
+            return True
+        
+        self.data = b""
+        
+        self.handler.http_parser__message_data_received(bytes(data))
+        
+        return True
+    
+    def message_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.message_completed")
+        
+        message = self.message
+        
+        self.message = None
+        self.data_state = 0
+        self.length = 0
+        
+        # a 1xx response is followed by the final response to the same request
+        if self.request == False and message.status < 200:
+            return
+        
+        self.handler.http_parser__message_completed()
+    
+    def message_error(self):
+        twunnel3.logger.log(3, "trace: HTTPParser.message_error")
+        
+        self.paused = True
+        self.data = b""
+        self.data_offset = 0
+        self.data_state = 7
+        
+        self.handler.http_parser__message_error()
\ No newline at end of file
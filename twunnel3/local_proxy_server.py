@@ -3,43 +3,81 @@
 
 import asyncio
 import base64
+import collections
 import json
+import os
+import signal
 import socket
+import stat
 import struct
+import time
+import twunnel3.access_log
+import twunnel3.accounting
+import twunnel3.address
+import twunnel3.buffer_pool
+import twunnel3.compression
+import twunnel3.configuration
+import twunnel3.handoff
 import twunnel3.logger
+import twunnel3.mux
 import twunnel3.proxy_server
+import twunnel3.socket_profile
+import twunnel3.socks
+import twunnel3.tls
+import twunnel3.tracing
 
-def set_default_configuration(configuration, keys):
-    twunnel3.proxy_server.set_default_configuration(configuration, keys)
-    
-    if "LOCAL_PROXY_SERVER" in keys:
-        configuration.setdefault("LOCAL_PROXY_SERVER", {})
-        configuration["LOCAL_PROXY_SERVER"].setdefault("TYPE", "")
-        if configuration["LOCAL_PROXY_SERVER"]["TYPE"] == "HTTPS":
-            configuration["LOCAL_PROXY_SERVER"].setdefault("ADDRESS", "")
-            configuration["LOCAL_PROXY_SERVER"].setdefault("PORT", 0)
-        else:
-            if configuration["LOCAL_PROXY_SERVER"]["TYPE"] == "SOCKS4":
-                configuration["LOCAL_PROXY_SERVER"].setdefault("ADDRESS", "")
-                configuration["LOCAL_PROXY_SERVER"].setdefault("PORT", 0)
-            else:
-                if configuration["LOCAL_PROXY_SERVER"]["TYPE"] == "SOCKS5":
-                    configuration["LOCAL_PROXY_SERVER"].setdefault("ADDRESS", "")
-                    configuration["LOCAL_PROXY_SERVER"].setdefault("PORT", 0)
-                    configuration["LOCAL_PROXY_SERVER"].setdefault("ACCOUNTS", [])
-                    i = 0
-                    while i < len(configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"]):
-                        configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i].setdefault("NAME", "")
-                        configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i].setdefault("PASSWORD", "")
-                        i = i + 1
+# a client of an optimistic tunnel sends data before the reply, which is kept until the connection is made
+maximum_early_data_length = 262144
+
+# the head of a HTTPS request or the name and the address of a SOCKS4 request are at most this length, a longer request is rejected
+maximum_request_length = 65536
+
+def create_span(name, transport):
+    span = twunnel3.tracing.tracer.create_span(name)
+    
+    if span is not None:
+        peername = transport.get_extra_info("peername")
+        
+        if isinstance(peername, tuple) == True:
+            span.set_attribute("client.address", peername[0])
+            span.set_attribute("client.port", peername[1])
+    
+    return span
+
+def create_access_log_record(input_protocol, type):
+    client_address = ""
+    client_port = 0
+    
+    peername = input_protocol.transport.get_extra_info("peername")
+    
+    if isinstance(peername, tuple) == True:
+        client_address = peername[0]
+        client_port = peername[1]
+    
+    # the lengths are counted by the output protocol, which is not made when the tunnel is not made
+    input_length = 0
+    output_length = 0
+    
+    if isinstance(input_protocol.output_protocol, OutputProtocol) == True:
+        input_length = input_protocol.output_protocol.input_length
+        output_length = input_protocol.output_protocol.output_length
+    
+    return twunnel3.access_log.AccessLogRecord(input_protocol.time, time.time() - input_protocol.time, type, client_address, client_port, input_protocol.account, input_protocol.remote_address, input_protocol.remote_port, input_protocol.proxy_servers, input_length, output_length, input_protocol.result)
 
 class OutputProtocol(asyncio.Protocol):
+    __slots__ = ("input_protocol", "connection_state", "transport", "buffer_account", "reading_paused", "input_length", "output_length", "account_usage")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: OutputProtocol.__init__")
         
         self.input_protocol = None
         self.connection_state = 0
         self.transport = None
+        self.buffer_account = None
+        self.reading_paused = False
+        self.input_length = 0
+        self.output_length = 0
+        self.account_usage = None
         
     def connection_made(self, transport):
         twunnel3.logger.log(3, "trace: OutputProtocol.connection_made")
@@ -62,8 +100,34 @@ class OutputProtocol(asyncio.Protocol):
     def data_received(self, data):
         twunnel3.logger.log(3, "trace: OutputProtocol.data_received")
         
+        self.output_length = self.output_length + len(data)
+        
         self.input_protocol.output_protocol__data_received(data)
         
+        if self.account_usage is not None:
+            self.update_account_usage(0, len(data))
+        
+        if self.buffer_account is not None:
+            self.buffer_account.update()
+    
+    def update_account_usage(self, input_length, output_length):
+        twunnel3.logger.log(3, "trace: OutputProtocol.update_account_usage")
+        
+        # the connection which takes its account over its quota is closed
+        if self.account_usage.update(input_length, output_length) == False:
+            self.input_protocol.result = "QUOTA_EXCEEDED"
+            
+            if self.connection_state == 1:
+                self.transport.close()
+    
+    def input_protocol__get_write_buffer_size(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.input_protocol__get_write_buffer_size")
+        
+        if self.connection_state == 1:
+            return self.transport.get_write_buffer_size()
+        
+        return 0
+        
     def input_protocol__connection_made(self, transport):
         twunnel3.logger.log(3, "trace: OutputProtocol.input_protocol__connection_made")
         
@@ -77,21 +141,58 @@ class OutputProtocol(asyncio.Protocol):
         twunnel3.logger.log(3, "trace: OutputProtocol.input_protocol__data_received")
         
         if self.connection_state == 1:
+            self.input_length = self.input_length + len(data)
+            
             self.transport.write(data)
+            
+            if self.account_usage is not None:
+                self.update_account_usage(len(data), 0)
     
-    def pause_writing(self):
-        twunnel3.logger.log(3, "trace: OutputProtocol.pause_reading")
+    def input_protocol__pause_writing(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.input_protocol__pause_writing")
+        
+        self.reading_paused = True
         
         if self.connection_state == 1:
             self.transport.pause_reading()
     
-    def resume_writing(self):
-        twunnel3.logger.log(3, "trace: OutputProtocol.resume_writing")
+    def input_protocol__resume_writing(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.input_protocol__resume_writing")
+        
+        self.reading_paused = False
+        
+        if self.buffer_account is not None:
+            self.buffer_account.update()
+        
+        if self.connection_state == 1 and (self.buffer_account is None or self.buffer_account.reading_paused == False):
+            self.transport.resume_reading()
+    
+    def buffer_account__pause_reading(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.buffer_account__pause_reading")
         
         if self.connection_state == 1:
+            self.transport.pause_reading()
+    
+    def buffer_account__resume_reading(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.buffer_account__resume_reading")
+        
+        if self.connection_state == 1 and self.reading_paused == False:
             self.transport.resume_reading()
+    
+    # the protocol which writes to the transport that is full stops reading, which is the protocol on the other side
+    def pause_writing(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.pause_writing")
+        
+        self.input_protocol.output_protocol__pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.log(3, "trace: OutputProtocol.resume_writing")
+        
+        self.input_protocol.output_protocol__resume_writing()
 
 class OutputProtocolFactory(object):
+    __slots__ = ("input_protocol",)
+    
     def __init__(self, input_protocol):
         twunnel3.logger.log(3, "trace: OutputProtocolFactory.__init__")
         
@@ -103,64 +204,186 @@ class OutputProtocolFactory(object):
         output_protocol = OutputProtocol()
         output_protocol.input_protocol = self.input_protocol
         output_protocol.input_protocol.output_protocol = output_protocol
+        output_protocol.buffer_account = self.input_protocol.buffer_account
+        output_protocol.account_usage = self.input_protocol.account_usage
         return output_protocol
 
+class InputProtocolFactory(object):
+    def __init__(self, configuration):
+        twunnel3.logger.log(3, "trace: InputProtocolFactory.__init__")
+        
+        self.configuration = configuration
+        self.input_protocols = set()
+        self.input_protocols_future = None
+    
+    def set_configuration(self, configuration):
+        twunnel3.logger.log(3, "trace: InputProtocolFactory.set_configuration")
+        
+        self.configuration = configuration
+    
+    def add_input_protocol(self, input_protocol):
+        twunnel3.logger.log(3, "trace: InputProtocolFactory.add_input_protocol")
+        
+        self.input_protocols.add(input_protocol)
+        
+        # the options are set on every accepted socket
+        twunnel3.socket_profile.set_socket_options(input_protocol.transport.get_extra_info("socket"), self.configuration.local_proxy_server.socket_profile)
+    
+    def remove_input_protocol(self, input_protocol):
+        twunnel3.logger.log(3, "trace: InputProtocolFactory.remove_input_protocol")
+        
+        self.input_protocols.discard(input_protocol)
+        
+        if len(self.input_protocols) == 0:
+            if self.input_protocols_future is not None and self.input_protocols_future.done() == False:
+                self.input_protocols_future.set_result(None)
+    
+    def wait_input_protocols(self):
+        twunnel3.logger.log(3, "trace: InputProtocolFactory.wait_input_protocols")
+        
+        if self.input_protocols_future is None or self.input_protocols_future.done() == True:
+            self.input_protocols_future = asyncio.Future()
+            
+            if len(self.input_protocols) == 0:
+                self.input_protocols_future.set_result(None)
+        
+        return self.input_protocols_future
+
 class HTTPSInputProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "input_protocol_factory", "output_protocol", "remote_address", "remote_port", "connection_state", "data", "data_offset", "data_state", "transport", "buffer_account", "reading_paused", "span", "phase_span", "time", "account", "account_usage", "proxy_servers", "result", "http_connection_pool", "http_cache", "request_parser", "request_method", "request_head", "request_data", "request_data_length", "request_retry", "request_completed", "response_received", "keep_alive")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.__init__")
         
         self.configuration = None
+        self.input_protocol_factory = None
         self.output_protocol = None
         self.remote_address = ""
         self.remote_port = 0
         self.connection_state = 0
-        self.data = b""
+        # the head of the request grows in place and is searched from data_offset, so a head which is received in small parts is not copied and searched again for every part
+        self.data = bytearray()
+        self.data_offset = 0
         self.data_state = 0
         self.transport = None
+        self.buffer_account = None
+        self.reading_paused = False
+        self.span = None
+        self.phase_span = None
+        self.time = 0
+        self.account = ""
+        self.account_usage = None
+        self.proxy_servers = ()
+        self.result = "CLOSED"
+        self.http_connection_pool = None
+        self.http_cache = None
+        self.request_parser = None
+        self.request_method = b""
+        self.request_head = b""
+        self.request_data = None
+        self.request_data_length = 0
+        self.request_retry = False
+        self.request_completed = False
+        self.response_received = False
+        self.keep_alive = False
     
     def connection_made(self, transport):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.connection_made")
         
         self.transport = transport
         
+        self.time = time.time()
+        
         self.connection_state = 1
+        
+        self.buffer_account = twunnel3.buffer_pool.buffer_pool.create_buffer_account(self)
+        
+        # the span of the connection has a span for the handshake with the client, a span for the tunnel and a span for the relay
+        self.span = create_span("HTTPS connection", transport)
+        
+        if self.span is not None:
+            self.phase_span = self.span.create_span("handshake")
+        
+        self.input_protocol_factory.add_input_protocol(self)
     
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.connection_lost")
         
         self.connection_state = 2
         
+        self.input_protocol_factory.remove_input_protocol(self)
+        
         if self.output_protocol is not None:
             self.output_protocol.input_protocol__connection_lost(exception)
         
+        twunnel3.buffer_pool.buffer_pool.remove_buffer_account(self.buffer_account)
+        
+        if self.span is not None:
+            self.phase_span.end(exception)
+            self.span.end(exception)
+        
+        if self.account_usage is not None:
+            twunnel3.accounting.accounting.remove_connection(self.account_usage)
+        
+        if twunnel3.access_log.access_log.file != "":
+            twunnel3.access_log.access_log.log(create_access_log_record(self, "HTTPS"))
+        
         self.transport = None
     
     def data_received(self, data):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.data_received")
         
-        self.data = self.data + data
+        self.data += data
+        
+        self.process_data()
+        
+        self.buffer_account.update()
+    
+    def process_data(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.process_data")
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
         if self.data_state == 1:
             if self.process_data_state1():
                 return
+        if self.data_state == 2:
+            if self.process_data_state2():
+                return
+        if self.data_state == 3:
+            if self.process_data_state3():
+                return
     
     def process_data_state0(self):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.process_data_state0")
         
         data = self.data
         
-        i = data.find(b"\r\n\r\n")
+        i = data.find(b"\r\n\r\n", self.data_offset)
         
         if i == -1:
+            if len(data) > maximum_request_length:
+                self.result = "REJECTED"
+                
+                response = b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+                response = response + b"\r\n"
+                
+                self.transport.write(response)
+                self.transport.close()
+                
+                return True
+            
+            # the end of the head can be split over two parts
+            self.data_offset = max(len(data) - 3, 0)
+            
             return True
         
         i = i + 4
         
-        request = data[:i]
+        request = bytes(data[:i])
         
-        data = data[i:]
+        data = bytes(data[i:])
         
         self.data = data
         
@@ -168,6 +391,8 @@ class HTTPSInputProtocol(asyncio.Protocol):
         request_line = request_lines[0].split(b" ", 2)
         
         if len(request_line) != 3:
+            self.result = "REJECTED"
+            
             response = b"HTTP/1.1 400 Bad Request\r\n"
             response = response + b"\r\n"
             
@@ -176,6 +401,36 @@ class HTTPSInputProtocol(asyncio.Protocol):
             
             return True
         
+        # a local proxy server with accounts needs the Proxy-Authorization of the first request, the next requests of the connection are of the same account
+        if len(self.configuration.local_proxy_server.accounts) > 0:
+            account = self.authenticate(request_lines)
+            
+            if account is None:
+                self.result = "REJECTED"
+                
+                response = b"HTTP/1.1 407 Proxy Authentication Required\r\n"
+                response = response + b"Proxy-Authenticate: Basic realm=\"twunnel3\"\r\n"
+                response = response + b"\r\n"
+                
+                self.transport.write(response)
+                self.transport.close()
+                
+                return True
+            
+            self.account = account.name
+            self.account_usage = twunnel3.accounting.accounting.create_connection(account)
+            
+            if self.account_usage is None:
+                self.result = "QUOTA_EXCEEDED"
+                
+                response = b"HTTP/1.1 403 Forbidden\r\n"
+                response = response + b"\r\n"
+                
+                self.transport.write(response)
+                self.transport.close()
+                
+                return True
+        
         request_method = request_line[0].upper()
         request_uri = request_line[1]
         request_version = request_line[2].upper()
@@ -206,11 +461,47 @@ class HTTPSInputProtocol(asyncio.Protocol):
             
             output_protocol_factory = OutputProtocolFactory(self)
             
+            if self.span is not None:
+                self.phase_span.end()
+                self.span.set_attribute("server.address", self.remote_address)
+                self.span.set_attribute("server.port", self.remote_port)
+            
             tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
-            asyncio.async(tunnel.create_connection(output_protocol_factory, self.remote_address, self.remote_port))
+            future = asyncio.async(tunnel.create_connection(output_protocol_factory, self.remote_address, self.remote_port, socket_profile=self.configuration.local_proxy_server.socket_profile, span=self.span))
+            
+            self.proxy_servers = tunnel.proxy_servers
+            
+            # a client which sent data before the reply waits for the connection, so it also gets the reply when the connection is not made
+            def create_connection_done(future):
+                if self.connection_state == 1:
+                    if future.cancelled():
+                        self.output_protocol__connection_lost(None)
+                    else:
+                        if future.exception() is not None:
+                            self.output_protocol__connection_lost(future.exception())
+            
+            future.add_done_callback(create_connection_done)
+            
+            self.data_state = 3
             
             return True
         else:
+            if twunnel3.http_parser.parse_absolute_uri(request_uri) is not None:
+                self.data = request + self.data
+                self.data_state = 2
+                
+                self.result = "FORWARDED"
+                
+                # the requests which are forwarded are not traced, the span of the connection only gets their handshake
+                if self.span is not None:
+                    self.phase_span.end()
+                
+                self.request_parser = twunnel3.http_parser.HTTPParser(self, True)
+                
+                return False
+            
+            self.result = "REJECTED"
+            
             response = b"HTTP/1.1 405 Method Not Allowed\r\n"
             response = response + b"Allow: CONNECT\r\n"
             response = response + b"\r\n"
@@ -220,6 +511,39 @@ class HTTPSInputProtocol(asyncio.Protocol):
             
             return True
         
+    def authenticate(self, request_lines):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.authenticate")
+        
+        for request_line in request_lines[1:]:
+            name, separator, value = request_line.partition(b":")
+            
+            if name.strip().lower() == b"proxy-authorization":
+                scheme, separator, credentials = value.strip().partition(b" ")
+                
+                if scheme.lower() != b"basic":
+                    return None
+                
+                try:
+                    credentials = base64.standard_b64decode(credentials.strip())
+                except ValueError:
+                    return None
+                
+                name, separator, password = credentials.partition(b":")
+                
+                i = 0
+                while i < len(self.configuration.local_proxy_server.accounts):
+                    if self.configuration.local_proxy_server.accounts[i].encoded_name == name:
+                        if self.configuration.local_proxy_server.accounts[i].encoded_password == password:
+                            return self.configuration.local_proxy_server.accounts[i]
+                        
+                        return None
+                    
+                    i = i + 1
+                
+                return None
+        
+        return None
+    
     def process_data_state1(self):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.process_data_state1")
         
@@ -228,10 +552,221 @@ class HTTPSInputProtocol(asyncio.Protocol):
         self.data = b""
         
         return True
+    
+    def process_data_state2(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.process_data_state2")
+        
+        data = self.data
+        
+        self.data = b""
+        
+        self.request_parser.data_received(data)
+        
+        return True
+    
+    def process_data_state3(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.process_data_state3")
+        
+        # the data which is received before the connection is made is sent when it is made
+        if len(self.data) >= maximum_early_data_length:
+            self.reading_paused = True
+            
+            self.transport.pause_reading()
+        
+        return True
+    
+    def http_parser__message_received(self, message):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.http_parser__message_received")
+        
+        uri = twunnel3.http_parser.parse_absolute_uri(message.uri)
+        
+        if uri is None:
+            self.http_parser__message_error()
+            
+            return
+        
+        self.remote_address, self.remote_port, message.uri = uri
+        
+        twunnel3.logger.log(2, "remote_address: " + self.remote_address)
+        twunnel3.logger.log(2, "remote_port: " + str(self.remote_port))
+        
+        self.keep_alive = message.is_keep_alive()
+        
+        message.remove_hop_by_hop_headers()
+        
+        if message.get_header(b"host") is None:
+            host = twunnel3.address.get_address(self.remote_address).http_address
+            
+            if self.remote_port != 80:
+                host = host + b":" + str(self.remote_port).encode()
+            
+            message.headers.append((b"Host", host))
+        
+        message.headers.append((b"Connection", b"keep-alive"))
+        
+        http_cache_request = None
+        if self.http_cache is not None:
+            http_cache_request = self.http_cache.create_request(message, self.remote_address, self.remote_port)
+        
+        self.request_method = message.method
+        self.request_head = message.encode()
+        self.request_data = [self.request_head]
+        self.request_data_length = len(self.request_head)
+        self.request_retry = True
+        self.request_completed = False
+        self.response_received = False
+        
+        # the requests which are forwarded are counted by the input protocol, the tunnels by their output protocol
+        if self.account_usage is not None:
+            if self.update_account_usage(len(self.request_head), 0) == False:
+                return
+        
+        if http_cache_request is not None:
+            http_cache_request.create_connection(self)
+        else:
+            self.http_connection_pool.create_connection(self, self.remote_address, self.remote_port)
+    
+    def http_parser__message_data_received(self, data):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.http_parser__message_data_received")
+        
+        self.request_retry = False
+        
+        if self.request_data is not None:
+            self.request_data.append(data)
+            
+            # the body which is received before the connection is made is sent when it is made
+            self.request_data_length = self.request_data_length + len(data)
+            
+            if self.request_data_length >= maximum_early_data_length and self.reading_paused == False:
+                self.reading_paused = True
+                
+                self.transport.pause_reading()
+        else:
+            self.output_protocol.input_protocol__data_received(data)
+        
+        if self.account_usage is not None:
+            self.update_account_usage(len(data), 0)
+    
+    def http_parser__message_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.http_parser__message_completed")
+        
+        self.request_completed = True
+        
+        # requests are forwarded one at a time, pipelined requests wait until the response is completed
+        self.request_parser.pause()
+        
+        self.transport.pause_reading()
+    
+    def http_parser__message_error(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.http_parser__message_error")
+        
+        self.request_parser.pause()
+        
+        self.result = "REJECTED"
+        
+        response = b"HTTP/1.1 400 Bad Request\r\n"
+        response = response + b"Connection: close\r\n"
+        response = response + b"\r\n"
+        
+        self.transport.write(response)
+        self.transport.close()
+    
+    def output_protocol__response_received(self, message, delimited):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__response_received")
+        
+        if self.connection_state == 1:
+            if message.status >= 200:
+                self.response_received = True
+                
+                if delimited == False:
+                    self.keep_alive = False
+            
+            message.remove_hop_by_hop_headers()
+            
+            if self.keep_alive == True:
+                message.headers.append((b"Connection", b"keep-alive"))
+            else:
+                message.headers.append((b"Connection", b"close"))
+            
+            response = message.encode()
+            
+            self.transport.write(response)
+            
+            if self.account_usage is not None:
+                self.update_account_usage(0, len(response))
+        else:
+            if self.connection_state == 2:
+                self.output_protocol.input_protocol__connection_lost(None)
+    
+    def output_protocol__response_completed(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__response_completed")
+        
+        output_protocol = self.output_protocol
+        
+        self.output_protocol = None
+        
+        output_protocol.input_protocol__response_completed(self.request_completed)
+        
+        if self.connection_state == 1:
+            if self.keep_alive == True and self.request_completed == True:
+                self.request_data = None
+                self.request_data_length = 0
+                self.request_completed = False
+                self.response_received = False
+                self.reading_paused = False
+                
+                if self.buffer_account.reading_paused == False:
+                    self.transport.resume_reading()
+                
+                self.request_parser.resume()
+            else:
+                self.transport.close()
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__pause_writing")
+        
+        self.reading_paused = True
+        
+        if self.connection_state == 1:
+            self.transport.pause_reading()
+    
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__resume_writing")
+        
+        self.reading_paused = False
+        
+        self.buffer_account.update()
+        
+        if self.connection_state == 1 and self.request_completed == False and self.buffer_account.reading_paused == False:
+            self.transport.resume_reading()
         
     def output_protocol__connection_made(self, transport):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__connection_made")
         
+        if self.data_state == 2:
+            if self.connection_state == 1:
+                self.output_protocol.input_protocol__request_sent(self.request_method)
+                
+                request_data = self.request_data
+                request_data_length = self.request_data_length
+                
+                self.request_data = None
+                self.request_data_length = 0
+                
+                if request_data_length >= maximum_early_data_length:
+                    self.reading_paused = False
+                    
+                    if self.request_completed == False and self.buffer_account.reading_paused == False:
+                        self.transport.resume_reading()
+                
+                for data in request_data:
+                    self.output_protocol.input_protocol__data_received(data)
+            else:
+                if self.connection_state == 2:
+                    self.output_protocol.input_protocol__connection_lost(None)
+            
+            return
+        
         if self.connection_state == 1:
             response = b"HTTP/1.1 200 OK\r\n"
             response = response + b"\r\n"
@@ -242,6 +777,17 @@ class HTTPSInputProtocol(asyncio.Protocol):
             if len(self.data) > 0:
                 self.output_protocol.input_protocol__data_received(self.data)
             
+            self.result = "CONNECTED"
+            
+            if self.span is not None:
+                self.phase_span = self.span.create_span("relay")
+            
+            if len(self.data) >= maximum_early_data_length:
+                self.reading_paused = False
+                
+                if self.buffer_account.reading_paused == False:
+                    self.transport.resume_reading()
+            
             self.data = b""
             self.data_state = 1
         else:
@@ -251,10 +797,41 @@ class HTTPSInputProtocol(asyncio.Protocol):
     def output_protocol__connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__connection_lost")
         
+        if self.data_state == 2:
+            output_protocol = self.output_protocol
+            
+            self.output_protocol = None
+            
+            if self.connection_state == 1:
+                if self.response_received == False:
+                    # a reused connection can be closed by the server before it reads the request
+                    if self.request_retry == True and self.request_completed == True and output_protocol is not None and output_protocol.requests > 1:
+                        self.request_data = [self.request_head]
+                        self.request_data_length = len(self.request_head)
+                        
+                        self.http_connection_pool.create_connection(self, self.remote_address, self.remote_port)
+                        
+                        return
+                    
+                    self.result = "REFUSED"
+                    
+                    response = b"HTTP/1.1 502 Bad Gateway\r\n"
+                    response = response + b"Connection: close\r\n"
+                    response = response + b"\r\n"
+                    
+                    self.transport.write(response)
+                    self.transport.close()
+                else:
+                    self.transport.close()
+            
+            return
+        
         if self.connection_state == 1:
             if self.data_state == 1:
                 self.transport.close()
             else:
+                self.result = "REFUSED"
+                
                 response = b"HTTP/1.1 404 Not Found\r\n"
                 response = response + b"\r\n"
                 
@@ -269,42 +846,147 @@ class HTTPSInputProtocol(asyncio.Protocol):
         
         if self.connection_state == 1:
             self.transport.write(data)
+            
+            if self.data_state == 2 and self.account_usage is not None:
+                self.update_account_usage(0, len(data))
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
     
-    def pause_writing(self):
-        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.pause_reading")
+    def update_account_usage(self, input_length, output_length):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.update_account_usage")
+        
+        # the connection which takes its account over its quota is closed
+        if self.account_usage.update(input_length, output_length) == False:
+            self.result = "QUOTA_EXCEEDED"
+            
+            if self.connection_state == 1:
+                self.transport.close()
+            
+            return False
+        
+        return True
+    
+    def output_protocol__get_write_buffer_size(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.output_protocol__get_write_buffer_size")
+        
+        if self.connection_state == 1:
+            return self.transport.get_write_buffer_size()
+        
+        return 0
+    
+    def buffer_account__get_data_size(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.buffer_account__get_data_size")
+        
+        data_size = len(self.data) + self.request_data_length + self.output_protocol__get_write_buffer_size()
+        if self.data_state == 1:
+            data_size = data_size + self.output_protocol.input_protocol__get_write_buffer_size()
+        
+        return data_size
+    
+    def buffer_account__pause_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.buffer_account__pause_reading")
         
         if self.connection_state == 1:
             self.transport.pause_reading()
+        
+        if self.data_state == 1:
+            self.output_protocol.buffer_account__pause_reading()
+    
+    def buffer_account__resume_reading(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.buffer_account__resume_reading")
+        
+        if self.connection_state == 1 and self.reading_paused == False and self.request_completed == False:
+            self.transport.resume_reading()
+        
+        if self.data_state == 1:
+            self.output_protocol.buffer_account__resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocol.pause_writing")
+        
+        if self.data_state == 2:
+            if self.output_protocol is not None:
+                self.output_protocol.pause_reading()
+            
+            return
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__pause_writing()
     
     def resume_writing(self):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocol.resume_writing")
         
-        if self.connection_state == 1:
-            self.transport.resume_reading()
+        if self.data_state == 2:
+            if self.output_protocol is not None:
+                self.output_protocol.resume_reading()
+            
+            return
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__resume_writing()
 
-class HTTPSInputProtocolFactory(object):
+def import_http_modules():
+    # the modules which are only used by a HTTPS local proxy server are imported when one is created, so other local proxy servers start faster
+    import twunnel3.http_cache
+    import twunnel3.http_connection_pool
+    import twunnel3.http_parser
+
+class HTTPSInputProtocolFactory(InputProtocolFactory):
     protocol = HTTPSInputProtocol
     
     def __init__(self, configuration):
+        InputProtocolFactory.__init__(self, configuration)
+        
         twunnel3.logger.log(3, "trace: HTTPSInputProtocolFactory.__init__")
         
-        self.configuration = configuration
+        import_http_modules()
+        
+        self.http_connection_pool = twunnel3.http_connection_pool.HTTPConnectionPool(configuration)
+        self.http_cache = None
+        if configuration.local_proxy_server.cache.size > 0:
+            self.http_cache = twunnel3.http_cache.HTTPCache(configuration, self.http_connection_pool)
+    
+    def set_configuration(self, configuration):
+        twunnel3.logger.log(3, "trace: HTTPSInputProtocolFactory.set_configuration")
+        
+        # connections which are in use keep the old connection pool, idle connections of the old connection pool are closed
+        http_connection_pool = self.http_connection_pool
+        
+        self.http_connection_pool = twunnel3.http_connection_pool.HTTPConnectionPool(configuration)
+        
+        http_connection_pool.close()
+        
+        cache = configuration.local_proxy_server.cache
+        
+        if cache.size > 0:
+            if self.http_cache is not None and self.http_cache.size == cache.size and self.http_cache.maximum_entry_size == cache.maximum_entry_size and self.http_cache.directory == cache.directory and self.http_cache.directory_size == cache.directory_size:
+                self.http_cache.connection_pool = self.http_connection_pool
+            else:
+                self.http_cache = twunnel3.http_cache.HTTPCache(configuration, self.http_connection_pool)
+        else:
+            self.http_cache = None
+        
+        InputProtocolFactory.set_configuration(self, configuration)
     
     def __call__(self):
         twunnel3.logger.log(3, "trace: HTTPSInputProtocolFactory.__call__")
         
         input_protocol = HTTPSInputProtocol()
         input_protocol.configuration = self.configuration
+        input_protocol.input_protocol_factory = self
+        input_protocol.http_connection_pool = self.http_connection_pool
+        input_protocol.http_cache = self.http_cache
         return input_protocol
 
 class SOCKS4InputProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "input_protocol_factory", "output_protocol", "remote_address", "remote_port", "connection_state", "data", "data_state", "transport", "buffer_account", "reading_paused", "span", "phase_span", "time", "account", "account_usage", "proxy_servers", "result")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.__init__")
         
         self.configuration = None
+        self.input_protocol_factory = None
         self.output_protocol = None
         self.remote_address = ""
         self.remote_port = 0
@@ -312,67 +994,112 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         self.data = b""
         self.data_state = 0
         self.transport = None
+        self.buffer_account = None
+        self.reading_paused = False
+        self.span = None
+        self.phase_span = None
+        self.time = 0
+        self.account = ""
+        self.account_usage = None
+        self.proxy_servers = ()
+        self.result = "CLOSED"
     
     def connection_made(self, transport):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.connection_made")
         
         self.transport = transport
         
+        self.time = time.time()
+        
         self.connection_state = 1
+        
+        self.buffer_account = twunnel3.buffer_pool.buffer_pool.create_buffer_account(self)
+        
+        # the span of the connection has a span for the handshake with the client, a span for the tunnel and a span for the relay
+        self.span = create_span("SOCKS4 connection", transport)
+        
+        if self.span is not None:
+            self.phase_span = self.span.create_span("handshake")
+        
+        self.input_protocol_factory.add_input_protocol(self)
     
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.connection_lost")
         
         self.connection_state = 2
         
+        self.input_protocol_factory.remove_input_protocol(self)
+        
         if self.output_protocol is not None:
             self.output_protocol.input_protocol__connection_lost(exception)
         
+        twunnel3.buffer_pool.buffer_pool.remove_buffer_account(self.buffer_account)
+        
+        if self.span is not None:
+            self.phase_span.end(exception)
+            self.span.end(exception)
+        
+        if self.account_usage is not None:
+            twunnel3.accounting.accounting.remove_connection(self.account_usage)
+        
+        if twunnel3.access_log.access_log.file != "":
+            twunnel3.access_log.access_log.log(create_access_log_record(self, "SOCKS4"))
+        
         self.transport = None
     
     def data_received(self, data):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.data_received")
         
         self.data = self.data + data
+        
+        self.process_data()
+        
+        self.buffer_account.update()
+    
+    def process_data(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.process_data")
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
         if self.data_state == 1:
             if self.process_data_state1():
                 return
+        if self.data_state == 2:
+            if self.process_data_state2():
+                return
         
     def process_data_state0(self):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.process_data_state0")
         
         data = self.data
         
-        if len(data) < 8:
+        if len(data) < twunnel3.socks.socks4_request_struct.size:
             return True
         
-        version, method, port, address = struct.unpack("!BBHI", data[:8])
+        version, method, port, address = twunnel3.socks.socks4_request_struct.unpack_from(data)
         
-        data = data[8:]
+        data = data[twunnel3.socks.socks4_request_struct.size:]
         
         address_type = 0x01
-        if address >= 1 and address <= 255:
+        if address[:3] == b"\x00\x00\x00" and address[3] != 0x00:
             address_type = 0x03
         
         self.remote_port = port
         
         if address_type == 0x01:
-            address = struct.pack("!I", address)
             address = socket.inet_ntop(socket.AF_INET, address)
             
             self.remote_address = address
         
         if b"\x00" not in data:
-            return True
+            return self.process_incomplete_request()
         
         name, data = data.split(b"\x00", 1)
         
         if address_type == 0x03:
             if b"\x00" not in data:
-                return True
+                return self.process_incomplete_request()
             
             address, data = data.split(b"\x00", 1)
             
@@ -386,18 +1113,54 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         if method == 0x01:
             output_protocol_factory = OutputProtocolFactory(self)
             
+            if self.span is not None:
+                self.phase_span.end()
+                self.span.set_attribute("server.address", self.remote_address)
+                self.span.set_attribute("server.port", self.remote_port)
+            
             tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
-            asyncio.async(tunnel.create_connection(output_protocol_factory, self.remote_address, self.remote_port))
+            future = asyncio.async(tunnel.create_connection(output_protocol_factory, self.remote_address, self.remote_port, socket_profile=self.configuration.local_proxy_server.socket_profile, span=self.span))
+            
+            self.proxy_servers = tunnel.proxy_servers
+            
+            # a client which sent data before the reply waits for the connection, so it also gets the reply when the connection is not made
+            def create_connection_done(future):
+                if self.connection_state == 1:
+                    if future.cancelled():
+                        self.output_protocol__connection_lost(None)
+                    else:
+                        if future.exception() is not None:
+                            self.output_protocol__connection_lost(future.exception())
+            
+            future.add_done_callback(create_connection_done)
+            
+            self.data_state = 2
             
             return True
         else:
-            response = struct.pack("!BBHI", 0x00, 0x5b, 0, 0)
+            self.result = "REJECTED"
+            
+            response = twunnel3.socks.SOCKS4_REPLY_REJECTED
             
             self.transport.write(response)
             self.transport.close()
             
             return True
         
+    def process_incomplete_request(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.process_incomplete_request")
+        
+        # a client can not keep sending its name or its address
+        if len(self.data) > maximum_request_length:
+            self.result = "REJECTED"
+            
+            response = twunnel3.socks.SOCKS4_REPLY_REJECTED
+            
+            self.transport.write(response)
+            self.transport.close()
+        
+        return True
+    
     def process_data_state1(self):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.process_data_state1")
         
@@ -406,12 +1169,23 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         self.data = b""
         
         return True
+    
+    def process_data_state2(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.process_data_state2")
+        
+        # the data which is received before the connection is made is sent when it is made
+        if len(self.data) >= maximum_early_data_length:
+            self.reading_paused = True
+            
+            self.transport.pause_reading()
+        
+        return True
         
     def output_protocol__connection_made(self, transport):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.output_protocol__connection_made")
         
         if self.connection_state == 1:
-            response = struct.pack("!BBHI", 0x00, 0x5a, 0, 0)
+            response = twunnel3.socks.SOCKS4_REPLY_GRANTED
             
             self.transport.write(response)
             
@@ -419,6 +1193,17 @@ class SOCKS4InputProtocol(asyncio.Protocol):
             if len(self.data) > 0:
                 self.output_protocol.input_protocol__data_received(self.data)
             
+            self.result = "CONNECTED"
+            
+            if self.span is not None:
+                self.phase_span = self.span.create_span("relay")
+            
+            if len(self.data) >= maximum_early_data_length:
+                self.reading_paused = False
+                
+                if self.buffer_account.reading_paused == False:
+                    self.transport.resume_reading()
+            
             self.data = b""
             self.data_state = 1
         else:
@@ -430,7 +1215,9 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         
         if self.connection_state == 1:
             if self.data_state != 1:
-                response = struct.pack("!BBHI", 0x00, 0x5b, 0, 0)
+                self.result = "REFUSED"
+                
+                response = twunnel3.socks.SOCKS4_REPLY_REJECTED
                 
                 self.transport.write(response)
                 self.transport.close()
@@ -449,36 +1236,93 @@ class SOCKS4InputProtocol(asyncio.Protocol):
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
     
-    def pause_writing(self):
-        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.pause_reading")
+    def output_protocol__get_write_buffer_size(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.output_protocol__get_write_buffer_size")
+        
+        if self.connection_state == 1:
+            return self.transport.get_write_buffer_size()
+        
+        return 0
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.output_protocol__pause_writing")
+        
+        self.reading_paused = True
         
         if self.connection_state == 1:
             self.transport.pause_reading()
     
-    def resume_writing(self):
-        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.resume_writing")
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.output_protocol__resume_writing")
+        
+        self.reading_paused = False
+        
+        self.buffer_account.update()
+        
+        if self.connection_state == 1 and self.buffer_account.reading_paused == False:
+            self.transport.resume_reading()
+    
+    def buffer_account__get_data_size(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.buffer_account__get_data_size")
+        
+        data_size = len(self.data) + self.output_protocol__get_write_buffer_size()
+        if self.data_state == 1:
+            data_size = data_size + self.output_protocol.input_protocol__get_write_buffer_size()
+        
+        return data_size
+    
+    def buffer_account__pause_reading(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.buffer_account__pause_reading")
         
         if self.connection_state == 1:
+            self.transport.pause_reading()
+        
+        if self.data_state == 1:
+            self.output_protocol.buffer_account__pause_reading()
+    
+    def buffer_account__resume_reading(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.buffer_account__resume_reading")
+        
+        if self.connection_state == 1 and self.reading_paused == False:
             self.transport.resume_reading()
+        
+        if self.data_state == 1:
+            self.output_protocol.buffer_account__resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.pause_writing")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocol.resume_writing")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__resume_writing()
 
-class SOCKS4InputProtocolFactory(object):
+class SOCKS4InputProtocolFactory(InputProtocolFactory):
     def __init__(self, configuration):
-        twunnel3.logger.log(3, "trace: SOCKS4InputProtocolFactory.__init__")
+        InputProtocolFactory.__init__(self, configuration)
         
-        self.configuration = configuration
+        twunnel3.logger.log(3, "trace: SOCKS4InputProtocolFactory.__init__")
     
     def __call__(self):
         twunnel3.logger.log(3, "trace: SOCKS4InputProtocolFactory.__call__")
         
         input_protocol = SOCKS4InputProtocol()
         input_protocol.configuration = self.configuration
+        input_protocol.input_protocol_factory = self
         return input_protocol
 
 class SOCKS5InputProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "input_protocol_factory", "output_protocol", "remote_address", "remote_port", "connection_state", "data", "data_state", "transport", "buffer_account", "reading_paused", "span", "phase_span", "time", "account", "account_usage", "proxy_servers", "result")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.__init__")
         
         self.configuration = None
+        self.input_protocol_factory = None
         self.output_protocol = None
         self.remote_address = ""
         self.remote_port = 0
@@ -486,28 +1330,71 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         self.data = b""
         self.data_state = 0
         self.transport = None
+        self.buffer_account = None
+        self.reading_paused = False
+        self.span = None
+        self.phase_span = None
+        self.time = 0
+        self.account = ""
+        self.account_usage = None
+        self.proxy_servers = ()
+        self.result = "CLOSED"
     
     def connection_made(self, transport):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.connection_made")
         
         self.transport = transport
         
+        self.time = time.time()
+        
         self.connection_state = 1
+        
+        self.buffer_account = twunnel3.buffer_pool.buffer_pool.create_buffer_account(self)
+        
+        # the span of the connection has a span for the handshake with the client, a span for the tunnel and a span for the relay
+        self.span = create_span("SOCKS5 connection", transport)
+        
+        if self.span is not None:
+            self.phase_span = self.span.create_span("handshake")
+        
+        self.input_protocol_factory.add_input_protocol(self)
     
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.connection_lost")
         
         self.connection_state = 2
         
+        self.input_protocol_factory.remove_input_protocol(self)
+        
         if self.output_protocol is not None:
             self.output_protocol.input_protocol__connection_lost(exception)
         
+        twunnel3.buffer_pool.buffer_pool.remove_buffer_account(self.buffer_account)
+        
+        if self.span is not None:
+            self.phase_span.end(exception)
+            self.span.end(exception)
+        
+        if self.account_usage is not None:
+            twunnel3.accounting.accounting.remove_connection(self.account_usage)
+        
+        if twunnel3.access_log.access_log.file != "":
+            twunnel3.access_log.access_log.log(create_access_log_record(self, "SOCKS5"))
+        
         self.transport = None
     
     def data_received(self, data):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.data_received")
         
         self.data = self.data + data
+        
+        self.process_data()
+        
+        self.buffer_account.update()
+    
+    def process_data(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.process_data")
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
@@ -520,30 +1407,33 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         if self.data_state == 3:
             if self.process_data_state3():
                 return
+        if self.data_state == 4:
+            if self.process_data_state4():
+                return
     
     def process_data_state0(self):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.process_data_state0")
         
         data = self.data
         
-        if len(data) < 2:
+        if len(data) < twunnel3.socks.socks5_method_struct.size:
             return True
         
-        version, number_of_methods = struct.unpack("!BB", data[:2])
+        version, number_of_methods = twunnel3.socks.socks5_method_struct.unpack_from(data)
         
-        data = data[2:]
+        offset = twunnel3.socks.socks5_method_struct.size
         
-        if len(data) < number_of_methods:
+        if len(data) < offset + number_of_methods:
             return True
         
-        methods = struct.unpack("!%dB" % number_of_methods, data[:number_of_methods])
+        methods = data[offset:offset + number_of_methods]
         
-        data = data[number_of_methods:]
+        data = data[offset + number_of_methods:]
         
         self.data = data
         
         supported_methods = []
-        if len(self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"]) == 0:
+        if len(self.configuration.local_proxy_server.accounts) == 0:
             supported_methods.append(0x00)
         else:
             supported_methods.append(0x02)
@@ -551,7 +1441,7 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         for supported_method in supported_methods:
             if supported_method in methods:
                 if supported_method == 0x00:
-                    response = struct.pack("!BB", 0x05, 0x00)
+                    response = twunnel3.socks.SOCKS5_METHOD_REPLY_NO_AUTHENTICATION
                     
                     self.transport.write(response)
                     
@@ -560,15 +1450,17 @@ class SOCKS5InputProtocol(asyncio.Protocol):
                     return False
                 else:
                     if supported_method == 0x02:
-                        response = struct.pack("!BB", 0x05, 0x02)
+                        response = twunnel3.socks.SOCKS5_METHOD_REPLY_AUTHENTICATION
                         
                         self.transport.write(response)
                         
                         self.data_state = 1
                         
-                        return True
+                        return False
+        
+        self.result = "REJECTED"
         
-        response = struct.pack("!BB", 0x05, 0xFF)
+        response = twunnel3.socks.SOCKS5_METHOD_REPLY_NOT_ACCEPTABLE
         
         self.transport.write(response)
         self.transport.close()
@@ -580,49 +1472,52 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         
         data = self.data
         
-        if len(data) < 2:
+        if len(data) < twunnel3.socks.socks5_method_struct.size:
             return True
         
-        version, name_length = struct.unpack("!BB", data[:2])
+        version, name_length = twunnel3.socks.socks5_method_struct.unpack_from(data)
         
-        data = data[2:]
+        offset = twunnel3.socks.socks5_method_struct.size
         
-        if len(data) < name_length:
+        if len(data) < offset + name_length + 1:
             return True
         
-        name, = struct.unpack("!%ds" % name_length, data[:name_length])
+        name = data[offset:offset + name_length]
         
-        data = data[name_length:]
+        offset = offset + name_length
         
-        if len(data) < 1:
-            return True
-        
-        password_length, = struct.unpack("!B", data[:1])
+        password_length = data[offset]
         
-        data = data[1:]
+        offset = offset + 1
         
-        if len(data) < password_length:
+        if len(data) < offset + password_length:
             return True
         
-        password, = struct.unpack("!%ds" % password_length, data[:password_length])
+        password = data[offset:offset + password_length]
         
-        data = data[password_length:]
+        data = data[offset + password_length:]
         
         self.data = data
         
         i = 0
-        while i < len(self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"]):
-            if self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i]["NAME"].encode() == name:
-                if self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i]["PASSWORD"].encode() == password:
-                    response = struct.pack("!BB", 0x05, 0x00)
+        while i < len(self.configuration.local_proxy_server.accounts):
+            if self.configuration.local_proxy_server.accounts[i].encoded_name == name:
+                if self.configuration.local_proxy_server.accounts[i].encoded_password == password:
+                    self.account = self.configuration.local_proxy_server.accounts[i].name
+                    # the connection of an account which is over its quota is authenticated, but its request is not allowed
+                    self.account_usage = twunnel3.accounting.accounting.create_connection(self.configuration.local_proxy_server.accounts[i])
+                    
+                    response = twunnel3.socks.SOCKS5_AUTHENTICATION_REPLY_SUCCEEDED
                     
                     self.transport.write(response)
                     
                     self.data_state = 2
                     
-                    return True
+                    return False
                 
-                response = struct.pack("!BB", 0x05, 0x01)
+                self.result = "REJECTED"
+                
+                response = twunnel3.socks.SOCKS5_AUTHENTICATION_REPLY_FAILED
                 
                 self.transport.write(response)
                 self.transport.close()
@@ -631,7 +1526,9 @@ class SOCKS5InputProtocol(asyncio.Protocol):
             
             i = i + 1
         
-        response = struct.pack("!BB", 0x05, 0x01)
+        self.result = "REJECTED"
+        
+        response = twunnel3.socks.SOCKS5_AUTHENTICATION_REPLY_FAILED
         
         self.transport.write(response)
         self.transport.close()
@@ -643,77 +1540,65 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         
         data = self.data
         
-        if len(data) < 4:
+        if len(data) < twunnel3.socks.socks5_header_struct.size:
             return True
         
-        version, method, reserved, address_type = struct.unpack("!BBBB", data[:4])
-        
-        data = data[4:]
-        
-        if address_type == 0x01:
-            if len(data) < 4:
-                return True
-            
-            address, = struct.unpack("!I", data[:4])
-            address = struct.pack("!I", address)
-            address = socket.inet_ntop(socket.AF_INET, address)
-            
-            self.remote_address = address
-            
-            data = data[4:]
-        else:
-            if address_type == 0x03:
-                if len(data) < 1:
-                    return True
-                
-                address_length, = struct.unpack("!B", data[:1])
-                
-                data = data[1:]
-                
-                if len(data) < address_length:
-                    return True
-                
-                address, = struct.unpack("!%ds" % address_length, data[:address_length])
-                
-                self.remote_address = address.decode()
-                
-                data = data[address_length:]
-            else:
-                if address_type == 0x04:
-                    if len(data) < 16:
-                        return True
-                    
-                    address1, address2, address3, address4 = struct.unpack("!IIII", data[:16])
-                    address = struct.pack("!IIII", address1, address2, address3, address4)
-                    address = socket.inet_ntop(socket.AF_INET6, address)
-                    
-                    self.remote_address = address
-                    
-                    data = data[16:]
+        version, method, reserved = twunnel3.socks.socks5_header_struct.unpack_from(data)
         
-        if len(data) < 2:
+        address = twunnel3.socks.decode_socks5_address(data, twunnel3.socks.socks5_header_struct.size)
+        if address is None:
             return True
         
-        port, = struct.unpack("!H", data[:2])
-        
-        self.remote_port = port
+        self.remote_address, self.remote_port, offset = address
         
-        data = data[2:]
+        data = data[offset:]
         
         self.data = data
         
         twunnel3.logger.log(2, "remote_address: " + self.remote_address)
         twunnel3.logger.log(2, "remote_port: " + str(self.remote_port))
         
+        if self.account != "" and self.account_usage is None:
+            self.result = "QUOTA_EXCEEDED"
+            
+            response = twunnel3.socks.SOCKS5_REPLY_CONNECTION_NOT_ALLOWED
+            
+            self.transport.write(response)
+            self.transport.close()
+            
+            return True
+        
         if method == 0x01:
             output_protocol_factory = OutputProtocolFactory(self)
             
+            if self.span is not None:
+                self.phase_span.end()
+                self.span.set_attribute("server.address", self.remote_address)
+                self.span.set_attribute("server.port", self.remote_port)
+            
             tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
-            asyncio.async(tunnel.create_connection(output_protocol_factory, self.remote_address, self.remote_port))
+            future = asyncio.async(tunnel.create_connection(output_protocol_factory, self.remote_address, self.remote_port, socket_profile=self.configuration.local_proxy_server.socket_profile, span=self.span))
+            
+            self.proxy_servers = tunnel.proxy_servers
+            
+            # a client which sent data before the reply waits for the connection, so it also gets the reply when the connection is not made
+            def create_connection_done(future):
+                if self.connection_state == 1:
+                    if future.cancelled():
+                        self.output_protocol__connection_lost(None)
+                    else:
+                        if future.exception() is not None:
+                            self.output_protocol__connection_lost(future.exception())
+            
+            future.add_done_callback(create_connection_done)
+            
+            self.data_state = 4
             
             return True
         else:
-            response = struct.pack("!BBBBIH", 0x05, 0x07, 0x00, 0x01, 0, 0)
+            self.result = "REJECTED"
+            
+            response = twunnel3.socks.SOCKS5_REPLY_COMMAND_NOT_SUPPORTED
             
             self.transport.write(response)
             self.transport.close()
@@ -728,12 +1613,23 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         self.data = b""
         
         return True
+    
+    def process_data_state4(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.process_data_state4")
+        
+        # the data which is received before the connection is made is sent when it is made
+        if len(self.data) >= maximum_early_data_length:
+            self.reading_paused = True
+            
+            self.transport.pause_reading()
+        
+        return True
         
     def output_protocol__connection_made(self, transport):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.output_protocol__connection_made")
         
         if self.connection_state == 1:
-            response = struct.pack("!BBBBIH", 0x05, 0x00, 0x00, 0x01, 0, 0)
+            response = twunnel3.socks.SOCKS5_REPLY_SUCCEEDED
             
             self.transport.write(response)
             
@@ -741,6 +1637,17 @@ class SOCKS5InputProtocol(asyncio.Protocol):
             if len(self.data) > 0:
                 self.output_protocol.input_protocol__data_received(self.data)
             
+            self.result = "CONNECTED"
+            
+            if self.span is not None:
+                self.phase_span = self.span.create_span("relay")
+            
+            if len(self.data) >= maximum_early_data_length:
+                self.reading_paused = False
+                
+                if self.buffer_account.reading_paused == False:
+                    self.transport.resume_reading()
+            
             self.data = b""
             self.data_state = 3
         else:
@@ -752,7 +1659,9 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         
         if self.connection_state == 1:
             if self.data_state != 3:
-                response = struct.pack("!BBBBIH", 0x05, 0x05, 0x00, 0x01, 0, 0)
+                self.result = "REFUSED"
+                
+                response = twunnel3.socks.SOCKS5_REPLY_CONNECTION_REFUSED
                 
                 self.transport.write(response)
                 self.transport.close()
@@ -771,46 +1680,831 @@ class SOCKS5InputProtocol(asyncio.Protocol):
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
     
-    def pause_writing(self):
-        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.pause_reading")
+    def output_protocol__get_write_buffer_size(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.output_protocol__get_write_buffer_size")
+        
+        if self.connection_state == 1:
+            return self.transport.get_write_buffer_size()
+        
+        return 0
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.output_protocol__pause_writing")
+        
+        self.reading_paused = True
         
         if self.connection_state == 1:
             self.transport.pause_reading()
     
-    def resume_writing(self):
-        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.resume_writing")
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.output_protocol__resume_writing")
+        
+        self.reading_paused = False
+        
+        self.buffer_account.update()
+        
+        if self.connection_state == 1 and self.buffer_account.reading_paused == False:
+            self.transport.resume_reading()
+    
+    def buffer_account__get_data_size(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.buffer_account__get_data_size")
+        
+        data_size = len(self.data) + self.output_protocol__get_write_buffer_size()
+        if self.data_state == 3:
+            data_size = data_size + self.output_protocol.input_protocol__get_write_buffer_size()
+        
+        return data_size
+    
+    def buffer_account__pause_reading(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.buffer_account__pause_reading")
         
         if self.connection_state == 1:
+            self.transport.pause_reading()
+        
+        if self.data_state == 3:
+            self.output_protocol.buffer_account__pause_reading()
+    
+    def buffer_account__resume_reading(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.buffer_account__resume_reading")
+        
+        if self.connection_state == 1 and self.reading_paused == False:
             self.transport.resume_reading()
+        
+        if self.data_state == 3:
+            self.output_protocol.buffer_account__resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.pause_writing")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocol.resume_writing")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__resume_writing()
 
-class SOCKS5InputProtocolFactory(object):
+class SOCKS5InputProtocolFactory(InputProtocolFactory):
     def __init__(self, configuration):
-        twunnel3.logger.log(3, "trace: SOCKS5InputProtocolFactory.__init__")
+        InputProtocolFactory.__init__(self, configuration)
         
-        self.configuration = configuration
+        twunnel3.logger.log(3, "trace: SOCKS5InputProtocolFactory.__init__")
     
     def __call__(self):
         twunnel3.logger.log(3, "trace: SOCKS5InputProtocolFactory.buildProtocol")
         
         input_protocol = SOCKS5InputProtocol()
         input_protocol.configuration = self.configuration
+        input_protocol.input_protocol_factory = self
         return input_protocol
 
-def get_input_protocol_factory_class(type):
-    if type == "HTTPS":
-        return HTTPSInputProtocolFactory
-    else:
-        if type == "SOCKS4":
-            return SOCKS4InputProtocolFactory
-        else:
-            if type == "SOCKS5":
-                return SOCKS5InputProtocolFactory
-            else:
-                return None
+class MUXOutputProtocol(OutputProtocol):
+    __slots__ = ()
 
-def create_server(configuration):
-    set_default_configuration(configuration, ["PROXY_SERVERS", "LOCAL_PROXY_SERVER"])
+class MUXOutputProtocolFactory(object):
+    __slots__ = ("input_protocol",)
     
-    input_protocol_factory_class = get_input_protocol_factory_class(configuration["LOCAL_PROXY_SERVER"]["TYPE"])
-    input_protocol_factory = input_protocol_factory_class(configuration)
-    return asyncio.get_event_loop().create_server(input_protocol_factory, host=configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], port=configuration["LOCAL_PROXY_SERVER"]["PORT"])
\ No newline at end of file
+    def __init__(self, input_protocol):
+        twunnel3.logger.log(3, "trace: MUXOutputProtocolFactory.__init__")
+        
+        self.input_protocol = input_protocol
+        
+    def __call__(self):
+        twunnel3.logger.log(3, "trace: MUXOutputProtocolFactory.__call__")
+        
+        output_protocol = MUXOutputProtocol()
+        output_protocol.input_protocol = self.input_protocol
+        output_protocol.input_protocol.output_protocol = output_protocol
+        return output_protocol
+
+class MUXInputStream(twunnel3.mux.MUXStream):
+    __slots__ = ("output_protocol", "remote_address", "remote_port", "data_state")
+    
+    def __init__(self, session, stream_id, priority):
+        twunnel3.mux.MUXStream.__init__(self, session, stream_id, priority)
+        
+        twunnel3.logger.log(3, "trace: MUXInputStream.__init__")
+        
+        self.output_protocol = None
+        self.remote_address = ""
+        self.remote_port = 0
+        self.data_state = 0
+        
+        # data that arrives before the output protocol is connected stays in the receive window
+        self.reading_paused = True
+        self.connection_state = 1
+    
+    def stream__data_received(self, data):
+        twunnel3.logger.log(3, "trace: MUXInputStream.stream__data_received")
+        
+        self.output_protocol.input_protocol__data_received(data)
+    
+    def stream__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: MUXInputStream.stream__connection_lost")
+        
+        if self.output_protocol is not None:
+            self.output_protocol.input_protocol__connection_lost(exception)
+    
+    def stream__pause_writing(self):
+        twunnel3.logger.log(3, "trace: MUXInputStream.stream__pause_writing")
+        
+        if self.output_protocol is not None and self.output_protocol.connection_state == 1:
+            self.output_protocol.transport.pause_reading()
+    
+    def stream__resume_writing(self):
+        twunnel3.logger.log(3, "trace: MUXInputStream.stream__resume_writing")
+        
+        if self.output_protocol is not None and self.output_protocol.connection_state == 1:
+            self.output_protocol.transport.resume_reading()
+    
+    def output_protocol__connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: MUXInputStream.output_protocol__connection_made")
+        
+        if self.connection_state == 1:
+            self.session.write_frame(twunnel3.mux.FRAME_OPEN_REPLY, self.compression_type, self.stream_id, twunnel3.mux.open_reply_struct.pack(0x00, self.receive_window), self.priority)
+            
+            self.output_protocol.input_protocol__connection_made(transport)
+            
+            self.data_state = 1
+            
+            if self.writing_paused == True:
+                self.stream__pause_writing()
+            
+            self.resume_reading()
+        else:
+            if self.connection_state == 2:
+                self.output_protocol.input_protocol__connection_lost(None)
+    
+    def output_protocol__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: MUXInputStream.output_protocol__connection_lost")
+        
+        if self.connection_state == 1:
+            if self.data_state != 1:
+                self.session.write_frame(twunnel3.mux.FRAME_OPEN_REPLY, 0, self.stream_id, twunnel3.mux.open_reply_struct.pack(0x01, 0), self.priority)
+            
+            self.close()
+    
+    def output_protocol__data_received(self, data):
+        twunnel3.logger.log(3, "trace: MUXInputStream.output_protocol__data_received")
+        
+        if self.connection_state == 1:
+            self.write(data)
+        else:
+            if self.connection_state == 2:
+                self.output_protocol.input_protocol__connection_lost(None)
+    
+    def output_protocol__get_write_buffer_size(self):
+        twunnel3.logger.log(3, "trace: MUXInputStream.output_protocol__get_write_buffer_size")
+        
+        return self.data_length
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.log(3, "trace: MUXInputStream.output_protocol__pause_writing")
+        
+        self.pause_reading()
+    
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.log(3, "trace: MUXInputStream.output_protocol__resume_writing")
+        
+        self.resume_reading()
+
+class MUXInputProtocol(twunnel3.mux.MUXSession):
+    __slots__ = ("configuration", "input_protocol_factory")
+    
+    def __init__(self):
+        twunnel3.mux.MUXSession.__init__(self)
+        
+        twunnel3.logger.log(3, "trace: MUXInputProtocol.__init__")
+        
+        self.configuration = None
+        self.input_protocol_factory = None
+        self.data_state = 0
+    
+    def connection_made(self, transport):
+        twunnel3.mux.MUXSession.connection_made(self, transport)
+        
+        twunnel3.logger.log(3, "trace: MUXInputProtocol.connection_made")
+        
+        self.input_protocol_factory.add_input_protocol(self)
+    
+    def connection_lost(self, exception):
+        twunnel3.mux.MUXSession.connection_lost(self, exception)
+        
+        twunnel3.logger.log(3, "trace: MUXInputProtocol.connection_lost")
+        
+        self.input_protocol_factory.remove_input_protocol(self)
+    
+    def process_session_frame(self, frame_type, frame_flags, stream_id, payload):
+        twunnel3.logger.log(3, "trace: MUXInputProtocol.process_session_frame")
+        
+        if frame_type == twunnel3.mux.FRAME_HELLO:
+            if self.data_state != 0:
+                return False
+            
+            return self.process_hello_frame(payload)
+        else:
+            if frame_type == twunnel3.mux.FRAME_OPEN:
+                if self.data_state != 1:
+                    return False
+                
+                return self.process_open_frame(frame_flags, stream_id, payload)
+            else:
+                return False
+    
+    def process_hello_frame(self, payload):
+        twunnel3.logger.log(3, "trace: MUXInputProtocol.process_hello_frame")
+        
+        if len(payload) < 2:
+            return False
+        
+        version, name_length = struct.unpack("!BB", payload[:2])
+        
+        payload = payload[2:]
+        
+        if len(payload) < name_length + 1:
+            return False
+        
+        name, = struct.unpack("!%ds" % name_length, payload[:name_length])
+        
+        payload = payload[name_length:]
+        
+        password_length, = struct.unpack("!B", payload[:1])
+        
+        payload = payload[1:]
+        
+        if len(payload) < password_length:
+            return False
+        
+        password, = struct.unpack("!%ds" % password_length, payload[:password_length])
+        
+        authenticated = len(self.configuration.local_proxy_server.accounts) == 0
+        
+        i = 0
+        while i < len(self.configuration.local_proxy_server.accounts):
+            if self.configuration.local_proxy_server.accounts[i].encoded_name == name:
+                if self.configuration.local_proxy_server.accounts[i].encoded_password == password:
+                    authenticated = True
+                
+                break
+            
+            i = i + 1
+        
+        if authenticated == False:
+            self.write_frame(twunnel3.mux.FRAME_HELLO_REPLY, 0, 0, struct.pack("!B", 0x01), 0)
+            
+            return False
+        
+        self.write_frame(twunnel3.mux.FRAME_HELLO_REPLY, 0, 0, struct.pack("!B", 0x00), 0)
+        
+        self.data_state = 1
+        
+        return True
+    
+    def process_open_frame(self, frame_flags, stream_id, payload):
+        twunnel3.logger.log(3, "trace: MUXInputProtocol.process_open_frame")
+        
+        if len(payload) < twunnel3.mux.open_struct.size or stream_id in self.streams:
+            return False
+        
+        send_window, port, address_length = twunnel3.mux.open_struct.unpack(payload[:twunnel3.mux.open_struct.size])
+        
+        payload = payload[twunnel3.mux.open_struct.size:]
+        
+        if len(payload) < address_length:
+            return False
+        
+        if len(self.streams) >= twunnel3.mux.maximum_streams:
+            self.write_frame(twunnel3.mux.FRAME_OPEN_REPLY, 0, stream_id, twunnel3.mux.open_reply_struct.pack(0x01, 0), frame_flags & twunnel3.mux.maximum_priority)
+            
+            return True
+        
+        stream = MUXInputStream(self, stream_id, frame_flags & twunnel3.mux.maximum_priority)
+        stream.send_window = send_window
+        
+        compression_type = frame_flags >> 4
+        
+        if compression_type != twunnel3.compression.COMPRESSION_NONE:
+            if compression_type in self.compression_configuration.types:
+                stream.set_compression_type(compression_type)
+        
+        stream.remote_address = payload[:address_length].decode()
+        stream.remote_port = port
+        
+        self.add_stream(stream)
+        
+        twunnel3.logger.log(2, "remote_address: " + stream.remote_address)
+        twunnel3.logger.log(2, "remote_port: " + str(stream.remote_port))
+        
+        output_protocol_factory = MUXOutputProtocolFactory(stream)
+        
+        tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
+        future = asyncio.async(tunnel.create_connection(output_protocol_factory, stream.remote_address, stream.remote_port, socket_profile=self.configuration.local_proxy_server.socket_profile))
+        
+        def create_connection_done(future):
+            if future.cancelled():
+                stream.output_protocol__connection_lost(None)
+            else:
+                if future.exception() is not None:
+                    stream.output_protocol__connection_lost(future.exception())
+        
+        future.add_done_callback(create_connection_done)
+        
+        return True
+
+class MUXInputProtocolFactory(InputProtocolFactory):
+    def __init__(self, configuration):
+        InputProtocolFactory.__init__(self, configuration)
+        
+        twunnel3.logger.log(3, "trace: MUXInputProtocolFactory.__init__")
+    
+    def __call__(self):
+        twunnel3.logger.log(3, "trace: MUXInputProtocolFactory.__call__")
+        
+        input_protocol = MUXInputProtocol()
+        input_protocol.configuration = self.configuration
+        input_protocol.input_protocol_factory = self
+        input_protocol.window = self.configuration.local_proxy_server.window
+        input_protocol.compression_configuration = self.configuration.local_proxy_server.compression
+        return input_protocol
+
+def get_input_protocol_factory_class(type):
+    if type == "HTTPS":
+        return HTTPSInputProtocolFactory
+    else:
+        if type == "SOCKS4":
+            return SOCKS4InputProtocolFactory
+        else:
+            if type == "SOCKS5":
+                return SOCKS5InputProtocolFactory
+            else:
+                if type == "MUX":
+                    return MUXInputProtocolFactory
+                else:
+                    return None
+
+class LocalProxyServer(object):
+    def __init__(self, input_protocol_factory, servers, ssl_context=None):
+        twunnel3.logger.log(3, "trace: LocalProxyServer.__init__")
+        
+        self.input_protocol_factory = input_protocol_factory
+        self.servers = servers
+        self.ssl_context = ssl_context
+        self.sockets = []
+        
+        for server in servers:
+            self.sockets.extend(server.sockets)
+    
+    def set_configuration(self, configuration):
+        twunnel3.logger.log(3, "trace: LocalProxyServer.set_configuration")
+        
+        if self.ssl_context is not None:
+            twunnel3.tls.configure_ssl_context(self.ssl_context, configuration.local_proxy_server.tls)
+        
+        for server_socket in self.sockets:
+            twunnel3.socket_profile.set_listening_socket_options(server_socket, configuration.local_proxy_server.socket_profile)
+        
+        self.input_protocol_factory.set_configuration(configuration)
+    
+    def get_connections_length(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServer.get_connections_length")
+        
+        return len(self.input_protocol_factory.input_protocols)
+    
+    def close(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServer.close")
+        
+        for server in self.servers:
+            server.close()
+        
+        self.sockets = None
+    
+    def wait_closed(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServer.wait_closed")
+        
+        return asyncio.gather(*[server.wait_closed() for server in self.servers])
+    
+    def drain(self, timeout, interval=1):
+        twunnel3.logger.log(3, "trace: LocalProxyServer.drain")
+        
+        # no connections are accepted anymore, the connections which are still open when the timeout expires are closed
+        self.close()
+        
+        future = asyncio.Future()
+        
+        loop = asyncio.get_event_loop()
+        
+        drain_time = loop.time() + timeout
+        
+        def report_progress():
+            if future.done() == True:
+                return
+            
+            connections_length = self.get_connections_length()
+            
+            if loop.time() >= drain_time:
+                for input_protocol in list(self.input_protocol_factory.input_protocols):
+                    input_protocol.transport.close()
+                
+                future.set_result(connections_length)
+                
+                return
+            
+            if connections_length == 0:
+                return
+            
+            twunnel3.logger.log(1, "draining: " + str(connections_length) + " connections")
+            
+            loop.call_later(min(interval, drain_time - loop.time()), report_progress)
+        
+        def input_protocols_done(input_protocols_future):
+            if future.done() == False:
+                future.set_result(0)
+        
+        self.input_protocol_factory.wait_input_protocols().add_done_callback(input_protocols_done)
+        
+        report_progress()
+        
+        return future
+
+def create_server(configuration, sockets=None):
+    configuration = twunnel3.configuration.get_configuration(configuration)
+    
+    if configuration.local_proxy_server is None:
+        raise ValueError("LOCAL_PROXY_SERVER is missing")
+    
+    input_protocol_factory_class = get_input_protocol_factory_class(configuration.local_proxy_server.type)
+    input_protocol_factory = input_protocol_factory_class(configuration)
+    
+    future = asyncio.Future()
+    
+    server_futures = []
+    
+    ssl_context = None
+    
+    try:
+        if configuration.local_proxy_server.tls is not None:
+            ssl_context = twunnel3.tls.create_ssl_context(configuration.local_proxy_server.tls)
+        
+        # listening sockets which were handed off by another process or inherited are used instead of binding new ones
+        if not sockets:
+            sockets = twunnel3.handoff.get_inherited_sockets(configuration)
+    except (OSError, ValueError) as exception:
+        future.set_exception(exception)
+        
+        return future
+    
+    if sockets:
+        for server_socket in sockets:
+            server_futures.append(asyncio.async(asyncio.get_event_loop().create_server(input_protocol_factory, sock=server_socket, ssl=ssl_context)))
+    else:
+        if configuration.local_proxy_server.path != "":
+            # a UNIX socket which is left behind by a process which stopped is removed
+            try:
+                if stat.S_ISSOCK(os.stat(configuration.local_proxy_server.path).st_mode) == True:
+                    os.unlink(configuration.local_proxy_server.path)
+            except OSError:
+                pass
+            
+            server_futures.append(asyncio.async(asyncio.get_event_loop().create_unix_server(input_protocol_factory, path=configuration.local_proxy_server.path, ssl=ssl_context)))
+        else:
+            server_futures.append(asyncio.async(asyncio.get_event_loop().create_server(input_protocol_factory, host=configuration.local_proxy_server.address, port=configuration.local_proxy_server.port, ssl=ssl_context)))
+    
+    def create_servers_done(servers_future):
+        if servers_future.cancelled():
+            future.cancel()
+            
+            return
+        
+        servers = servers_future.result()
+        
+        exception = None
+        
+        i = 0
+        while i < len(servers):
+            if isinstance(servers[i], Exception):
+                if exception is None:
+                    exception = servers[i]
+            
+            i = i + 1
+        
+        if exception is not None:
+            i = 0
+            while i < len(servers):
+                if isinstance(servers[i], Exception) == False:
+                    servers[i].close()
+                
+                i = i + 1
+            
+            future.set_exception(exception)
+            
+            return
+        
+        local_proxy_server = LocalProxyServer(input_protocol_factory, servers, ssl_context)
+        
+        for server_socket in local_proxy_server.sockets:
+            twunnel3.socket_profile.set_listening_socket_options(server_socket, configuration.local_proxy_server.socket_profile)
+        
+        future.set_result(local_proxy_server)
+    
+    servers_future = asyncio.gather(*server_futures, return_exceptions=True)
+    servers_future.add_done_callback(create_servers_done)
+    
+    return future
+
+def get_server_key(configuration):
+    return (configuration.local_proxy_server.type, configuration.local_proxy_server.address, configuration.local_proxy_server.port, configuration.local_proxy_server.path, configuration.local_proxy_server.file_descriptor, configuration.local_proxy_server.socket_name, configuration.local_proxy_server.tls is not None)
+
+class LocalProxyServerManager(object):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.__init__")
+        
+        self.servers = {}
+        self.future = None
+        self.handoff_sockets = {}
+        self.handoff_socket = None
+    
+    def reload(self, configurations):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.reload")
+        
+        future = asyncio.Future()
+        
+        # reloads are applied one after the other, in the order in which they were requested
+        if self.future is None or self.future.done() == True:
+            self.reload_configurations(configurations, future)
+        else:
+            def previous_reload_done(previous_future):
+                self.reload_configurations(configurations, future)
+            
+            self.future.add_done_callback(previous_reload_done)
+        
+        self.future = future
+        return future
+    
+    def reload_configurations(self, configurations, future):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.reload_configurations")
+        
+        # every configuration is compiled before anything is changed, so an invalid configuration leaves the running servers untouched
+        compiled_configurations = collections.OrderedDict()
+        
+        try:
+            i = 0
+            while i < len(configurations):
+                configuration = twunnel3.configuration.get_configuration(configurations[i])
+                
+                if configuration.local_proxy_server is None:
+                    raise ValueError("CONFIGURATIONS[%d].LOCAL_PROXY_SERVER is missing" % i)
+                
+                server_key = get_server_key(configuration)
+                
+                if server_key in compiled_configurations:
+                    raise ValueError("CONFIGURATIONS[%d].LOCAL_PROXY_SERVER is a duplicate of another local proxy server" % i)
+                
+                # the certificates are loaded before anything is changed, so a missing certificate leaves the running servers untouched
+                if configuration.local_proxy_server.tls is not None:
+                    twunnel3.tls.create_ssl_context(configuration.local_proxy_server.tls)
+                
+                compiled_configurations[server_key] = configuration
+                
+                i = i + 1
+        except (OSError, ValueError) as exception:
+            future.set_exception(exception)
+            
+            return
+        
+        server_keys = []
+        server_futures = []
+        
+        for server_key, configuration in compiled_configurations.items():
+            if server_key not in self.servers:
+                server_keys.append(server_key)
+                server_futures.append(create_server(configuration, self.handoff_sockets.get(server_key)))
+        
+        def create_servers_done(servers_future):
+            if servers_future.cancelled():
+                future.cancel()
+                
+                return
+            
+            servers = servers_future.result()
+            
+            exception = None
+            
+            i = 0
+            while i < len(servers):
+                if isinstance(servers[i], Exception):
+                    if exception is None:
+                        exception = servers[i]
+                
+                i = i + 1
+            
+            # the servers which are not needed anymore are only closed when all new servers are listening
+            if exception is not None:
+                i = 0
+                while i < len(servers):
+                    if isinstance(servers[i], Exception) == False:
+                        servers[i].close()
+                    
+                    i = i + 1
+                
+                future.set_exception(exception)
+                
+                return
+            
+            for server_key in list(self.servers.keys()):
+                if server_key in compiled_configurations:
+                    self.servers[server_key].set_configuration(compiled_configurations[server_key])
+                else:
+                    self.servers.pop(server_key).close()
+            
+            i = 0
+            while i < len(servers):
+                self.servers[server_keys[i]] = servers[i]
+                
+                if server_keys[i] in self.handoff_sockets:
+                    del self.handoff_sockets[server_keys[i]]
+                
+                i = i + 1
+            
+            future.set_result(None)
+        
+        servers_future = asyncio.gather(*server_futures, return_exceptions=True)
+        servers_future.add_done_callback(create_servers_done)
+    
+    def add_signal_handler(self, load_configurations):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.add_signal_handler")
+        
+        # load_configurations is called on every SIGHUP, it returns the configurations which are reloaded
+        def signal_received():
+            twunnel3.logger.log(1, "reloading configuration")
+            
+            try:
+                configurations = load_configurations()
+            except (OSError, ValueError) as exception:
+                twunnel3.logger.log(1, "reloading configuration failed: " + str(exception))
+                
+                return
+            
+            future = self.reload(configurations)
+            
+            def reload_done(future):
+                if future.cancelled() == False and future.exception() is not None:
+                    twunnel3.logger.log(1, "reloading configuration failed: " + str(future.exception()))
+            
+            future.add_done_callback(reload_done)
+        
+        asyncio.get_event_loop().add_signal_handler(signal.SIGHUP, signal_received)
+    
+    def get_connections_length(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.get_connections_length")
+        
+        connections_length = 0
+        
+        for server in self.servers.values():
+            connections_length = connections_length + server.get_connections_length()
+        
+        return connections_length
+    
+    def drain(self, timeout, interval=1):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.drain")
+        
+        self.close_handoff_socket()
+        
+        servers = list(self.servers.values())
+        
+        self.servers = {}
+        
+        future = asyncio.Future()
+        
+        def drain_done(servers_future):
+            future.set_result(sum(servers_future.result()))
+        
+        asyncio.gather(*[server.drain(timeout, interval) for server in servers]).add_done_callback(drain_done)
+        
+        return future
+    
+    def start_handoff(self, path, timeout, interval=1):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.start_handoff")
+        
+        # a stale path is removed, so the process which replaces this process can listen on the same path
+        if os.path.exists(path):
+            os.unlink(path)
+        
+        self.handoff_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.handoff_socket.bind(path)
+        self.handoff_socket.listen(1)
+        self.handoff_socket.setblocking(False)
+        
+        future = asyncio.Future()
+        
+        loop = asyncio.get_event_loop()
+        
+        def handoff_socket_readable():
+            try:
+                connection, address = self.handoff_socket.accept()
+            except OSError:
+                return
+            
+            try:
+                connection.setblocking(True)
+                twunnel3.handoff.send_sockets(connection, [(server_key, server.sockets) for server_key, server in self.servers.items()])
+                connection.setblocking(False)
+            except (OSError, ValueError) as exception:
+                twunnel3.logger.log(1, "handoff failed: " + str(exception))
+                
+                connection.close()
+                
+                return
+            
+            def connection_readable():
+                try:
+                    data = connection.recv(1)
+                except OSError:
+                    data = b""
+                
+                loop.remove_reader(connection.fileno())
+                
+                connection.close()
+                
+                # without an acknowledgement the new process did not start, so this process keeps accepting connections
+                if data != twunnel3.handoff.HANDOFF_ACKNOWLEDGEMENT:
+                    twunnel3.logger.log(1, "handoff failed: handoff was not acknowledged")
+                    
+                    return
+                
+                twunnel3.logger.log(1, "handoff succeeded")
+                
+                def drain_done(drain_future):
+                    future.set_result(drain_future.result())
+                
+                self.drain(timeout, interval).add_done_callback(drain_done)
+            
+            loop.add_reader(connection.fileno(), connection_readable)
+        
+        loop.add_reader(self.handoff_socket.fileno(), handoff_socket_readable)
+        
+        return future
+    
+    def close_handoff_socket(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.close_handoff_socket")
+        
+        if self.handoff_socket is not None:
+            asyncio.get_event_loop().remove_reader(self.handoff_socket.fileno())
+            
+            self.handoff_socket.close()
+            self.handoff_socket = None
+    
+    def close(self):
+        twunnel3.logger.log(3, "trace: LocalProxyServerManager.close")
+        
+        self.close_handoff_socket()
+        
+        for server in self.servers.values():
+            server.close()
+        
+        self.servers = {}
+
+def create_server_manager(configurations, handoff_path=None):
+    twunnel3.logger.log(3, "trace: create_server_manager")
+    
+    manager = LocalProxyServerManager()
+    
+    connection = None
+    
+    # without a process listening on the handoff path, there is nothing to take over
+    if handoff_path is not None and os.path.exists(handoff_path):
+        try:
+            manager.handoff_sockets, connection = twunnel3.handoff.receive_sockets(handoff_path)
+        except (OSError, ValueError) as exception:
+            twunnel3.logger.log(1, "handoff failed: " + str(exception))
+    
+    future = asyncio.Future()
+    
+    def reload_done(reload_future):
+        # the sockets which were handed off but are not used anymore are closed, the old process still has its own copy
+        for sockets in manager.handoff_sockets.values():
+            for server_socket in sockets:
+                server_socket.close()
+        
+        manager.handoff_sockets = {}
+        
+        if reload_future.cancelled():
+            if connection is not None:
+                connection.close()
+            
+            future.cancel()
+        else:
+            if reload_future.exception() is not None:
+                if connection is not None:
+                    connection.close()
+                
+                future.set_exception(reload_future.exception())
+            else:
+                if connection is not None:
+                    twunnel3.handoff.acknowledge(connection)
+                
+                future.set_result(manager)
+    
+    manager.reload(configurations).add_done_callback(reload_done)
+    
+    return future
\ No newline at end of file
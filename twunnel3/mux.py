@@ -0,0 +1,758 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import collections
+import struct
+import twunnel3.address
+import twunnel3.compression
+import twunnel3.configuration
+import twunnel3.logger
+import twunnel3.proxy_server
+
+# frame: type, flags, stream id, payload length
+frame_header = struct.Struct("!BBIH")
+
+FRAME_HELLO = 0x00
+FRAME_HELLO_REPLY = 0x01
+FRAME_OPEN = 0x02
+FRAME_OPEN_REPLY = 0x03
+FRAME_DATA = 0x04
+FRAME_WINDOW_UPDATE = 0x05
+FRAME_CLOSE = 0x06
+
+maximum_frame_length = 65535
+maximum_priority = 7
+
+# a session has at most maximum_streams streams, the stream ids of a session are used once and end at maximum_stream_id
+maximum_streams = 256
+maximum_stream_id = 0xFFFFFFFF
+
+# compressed data can be slightly larger than the data itself and still has to fit in a frame
+minimum_compression_length = 64
+maximum_compression_length = 64512
+
+window_struct = struct.Struct("!I")
+open_struct = struct.Struct("!IHB")
+open_reply_struct = struct.Struct("!BI")
+
+class MUXStream(object):
+    __slots__ = ("session", "stream_id", "priority", "send_window", "receive_window", "receive_length", "received_length", "data", "data_length", "receive_data", "reading_paused", "writing_paused", "connection_state", "close_pending", "compression_type", "compressor", "compression_future", "compression_skip", "compression_skip_length", "decompressors")
+    
+    def __init__(self, session, stream_id, priority):
+        twunnel3.logger.log(3, "trace: MUXStream.__init__")
+        
+        self.session = session
+        self.stream_id = stream_id
+        self.priority = priority
+        self.send_window = 0
+        self.receive_window = session.window
+        self.receive_length = 0
+        # the data which was received since the last window update, the peer can not send more than receive_window of it
+        self.received_length = 0
+        self.data = collections.deque()
+        self.data_length = 0
+        self.receive_data = collections.deque()
+        self.reading_paused = False
+        self.writing_paused = False
+        self.connection_state = 0
+        self.close_pending = False
+        self.compression_type = twunnel3.compression.COMPRESSION_NONE
+        self.compressor = None
+        self.compression_future = None
+        self.compression_skip = 0
+        self.compression_skip_length = 1
+        self.decompressors = {}
+    
+    def set_compression_type(self, compression_type):
+        twunnel3.logger.log(3, "trace: MUXStream.set_compression_type")
+        
+        compressor_class = twunnel3.compression.get_compressor_class(compression_type)
+        
+        if compressor_class is None:
+            return
+        
+        self.compression_type = compression_type
+        self.compressor = compressor_class(self.session.compression_configuration.level)
+    
+    def write(self, data):
+        twunnel3.logger.log(3, "trace: MUXStream.write")
+        
+        if self.connection_state == 2 or self.close_pending == True or len(data) == 0:
+            return
+        
+        self.data.append(data)
+        self.data_length = self.data_length + len(data)
+        
+        self.write_data()
+    
+    def write_data(self):
+        twunnel3.logger.log(3, "trace: MUXStream.write_data")
+        
+        while len(self.data) > 0 and self.send_window > 0 and self.connection_state == 1 and self.compression_future is None:
+            data = self.data.popleft()
+            
+            if self.compressor is None:
+                length = min(len(data), self.send_window, maximum_frame_length)
+            else:
+                length = min(len(data), self.send_window, maximum_compression_length)
+            
+            if length < len(data):
+                self.data.appendleft(data[length:])
+                data = data[:length]
+            
+            self.data_length = self.data_length - length
+            self.send_window = self.send_window - length
+            
+            if self.compressor is None or self.compression_skip > 0 or length < minimum_compression_length:
+                if self.compression_skip > 0:
+                    self.compression_skip = self.compression_skip - 1
+                
+                self.session.write_frame(FRAME_DATA, 0, self.stream_id, data, self.priority)
+            else:
+                if length < self.session.compression_configuration.threshold:
+                    self.write_compressed_data(data, self.compressor.compress(data))
+                else:
+                    self.compress_data(data)
+        
+        if self.close_pending == True:
+            if len(self.data) == 0 and self.compression_future is None:
+                self.close_pending = False
+                
+                self.close()
+            
+            return
+        
+        if self.data_length > self.session.window and self.writing_paused == False:
+            self.writing_paused = True
+            
+            self.stream__pause_writing()
+        else:
+            if self.data_length <= self.session.window // 2 and self.writing_paused == True and self.session.writing_paused == False:
+                self.writing_paused = False
+                
+                self.stream__resume_writing()
+    
+    def compress_data(self, data):
+        twunnel3.logger.log(3, "trace: MUXStream.compress_data")
+        
+        # large chunks are compressed by a worker so that small frames of other streams are not delayed,
+        # the next chunk of this stream waits because the compressor keeps state between chunks
+        # the buffer of a memoryview can be reused by its protocol while the worker compresses it
+        if isinstance(data, memoryview) == True:
+            data = bytes(data)
+        
+        executor = twunnel3.compression.get_executor(self.session.compression_configuration.workers)
+        
+        self.compression_future = asyncio.get_event_loop().run_in_executor(executor, self.compressor.compress, data)
+        
+        def compress_data_done(future):
+            self.compression_future = None
+            
+            if self.connection_state != 1 or future.cancelled():
+                return
+            
+            self.write_compressed_data(data, future.result())
+            self.write_data()
+        
+        self.compression_future.add_done_callback(compress_data_done)
+    
+    def write_compressed_data(self, data, compressed_data):
+        twunnel3.logger.log(3, "trace: MUXStream.write_compressed_data")
+        
+        # data that does not compress well, such as tls, is sent as is for a number of chunks that doubles every time
+        if len(compressed_data) > len(data) * self.session.compression_configuration.ratio:
+            self.compression_skip = self.compression_skip_length
+            self.compression_skip_length = min(self.compression_skip_length * 2, 1024)
+        else:
+            self.compression_skip_length = 1
+        
+        self.session.write_frame(FRAME_DATA, self.compression_type, self.stream_id, compressed_data, self.priority)
+    
+    def decompress_data(self, compression_type, data):
+        twunnel3.logger.log(3, "trace: MUXStream.decompress_data")
+        
+        decompressor = self.decompressors.get(compression_type)
+        
+        if decompressor is None:
+            decompressor_class = twunnel3.compression.get_decompressor_class(compression_type)
+            
+            if decompressor_class is None:
+                return None
+            
+            decompressor = decompressor_class()
+            
+            self.decompressors[compression_type] = decompressor
+        
+        # a frame never holds more than maximum_compression_length bytes of data
+        return decompressor.decompress(data, maximum_compression_length)
+    
+    def window_updated(self, length):
+        twunnel3.logger.log(3, "trace: MUXStream.window_updated")
+        
+        self.send_window = self.send_window + length
+        
+        self.write_data()
+    
+    def data_received(self, data):
+        twunnel3.logger.log(3, "trace: MUXStream.data_received")
+        
+        self.received_length = self.received_length + len(data)
+        
+        if self.close_pending == True:
+            return
+        
+        if self.reading_paused == True:
+            self.receive_data.append(data)
+            
+            return
+        
+        self.stream__data_received(data)
+        
+        self.data_consumed(len(data))
+    
+    def data_consumed(self, length):
+        twunnel3.logger.log(3, "trace: MUXStream.data_consumed")
+        
+        self.receive_length = self.receive_length + length
+        
+        if self.receive_length >= self.receive_window // 2 and self.connection_state == 1:
+            self.session.write_frame(FRAME_WINDOW_UPDATE, 0, self.stream_id, window_struct.pack(self.receive_length), 0)
+            
+            self.received_length = self.received_length - self.receive_length
+            self.receive_length = 0
+    
+    def pause_reading(self):
+        twunnel3.logger.log(3, "trace: MUXStream.pause_reading")
+        
+        self.reading_paused = True
+    
+    def resume_reading(self):
+        twunnel3.logger.log(3, "trace: MUXStream.resume_reading")
+        
+        if self.reading_paused == False:
+            return
+        
+        self.reading_paused = False
+        
+        while len(self.receive_data) > 0 and self.reading_paused == False and self.connection_state == 1:
+            data = self.receive_data.popleft()
+            
+            self.stream__data_received(data)
+            
+            self.data_consumed(len(data))
+    
+    def session__pause_writing(self):
+        twunnel3.logger.log(3, "trace: MUXStream.session__pause_writing")
+        
+        if self.writing_paused == False:
+            self.writing_paused = True
+            
+            self.stream__pause_writing()
+    
+    def session__resume_writing(self):
+        twunnel3.logger.log(3, "trace: MUXStream.session__resume_writing")
+        
+        if self.writing_paused == True and self.data_length <= self.session.window // 2:
+            self.writing_paused = False
+            
+            self.stream__resume_writing()
+    
+    def close(self):
+        twunnel3.logger.log(3, "trace: MUXStream.close")
+        
+        if self.connection_state == 2:
+            return
+        
+        # the data that waits for the send window or for the compressor is sent before the stream is closed
+        if self.connection_state == 1 and (len(self.data) > 0 or self.compression_future is not None):
+            self.close_pending = True
+            self.receive_data.clear()
+            
+            return
+        
+        self.abort()
+    
+    def abort(self):
+        twunnel3.logger.log(3, "trace: MUXStream.abort")
+        
+        if self.connection_state == 2:
+            return
+        
+        self.close_pending = False
+        
+        self.session.write_frame(FRAME_CLOSE, 0, self.stream_id, b"", self.priority)
+        
+        self.connection_state = 2
+        self.data.clear()
+        self.data_length = 0
+        self.receive_data.clear()
+        
+        self.session.remove_stream(self)
+        
+        asyncio.get_event_loop().call_soon(self.stream__connection_lost, None)
+    
+    def session__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: MUXStream.session__connection_lost")
+        
+        if self.connection_state == 2:
+            return
+        
+        self.connection_state = 2
+        self.close_pending = False
+        self.data.clear()
+        self.data_length = 0
+        self.receive_data.clear()
+        
+        self.stream__connection_lost(exception)
+    
+    def stream__data_received(self, data):
+        pass
+    
+    def stream__connection_lost(self, exception):
+        pass
+    
+    def stream__pause_writing(self):
+        pass
+    
+    def stream__resume_writing(self):
+        pass
+
+class MUXSession(asyncio.Protocol):
+    __slots__ = ("window", "compression_configuration", "streams", "data", "data_state", "frames", "frames_length", "writing_paused", "connection_state", "transport")
+    
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: MUXSession.__init__")
+        
+        self.window = 262144
+        self.compression_configuration = None
+        self.streams = {}
+        self.data = bytearray()
+        self.data_state = 0
+        self.frames = [collections.deque() for priority in range(maximum_priority + 1)]
+        self.frames_length = 0
+        self.writing_paused = False
+        self.connection_state = 0
+        self.transport = None
+    
+    def connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: MUXSession.connection_made")
+        
+        self.transport = transport
+        
+        self.connection_state = 1
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: MUXSession.connection_lost")
+        
+        self.connection_state = 2
+        
+        streams = list(self.streams.values())
+        
+        self.streams = {}
+        
+        for frames in self.frames:
+            frames.clear()
+        
+        for stream in streams:
+            stream.session__connection_lost(exception)
+        
+        self.transport = None
+    
+    def data_received(self, data):
+        twunnel3.logger.log(3, "trace: MUXSession.data_received")
+        
+        self.data.extend(data)
+        
+        data = self.data
+        data_length = len(data)
+        
+        i = 0
+        while self.connection_state == 1 and data_length - i >= frame_header.size:
+            frame_type, frame_flags, stream_id, length = frame_header.unpack_from(data, i)
+            
+            if data_length - i - frame_header.size < length:
+                break
+            
+            i = i + frame_header.size
+            
+            payload = bytes(data[i:i + length])
+            
+            i = i + length
+            
+            if self.process_frame(frame_type, frame_flags, stream_id, payload) == False:
+                self.transport.close()
+                
+                break
+        
+        del data[:i]
+    
+    def process_frame(self, frame_type, frame_flags, stream_id, payload):
+        twunnel3.logger.log(3, "trace: MUXSession.process_frame")
+        
+        if frame_type == FRAME_DATA:
+            stream = self.streams.get(stream_id)
+            
+            if stream is not None:
+                if frame_flags != twunnel3.compression.COMPRESSION_NONE:
+                    payload = stream.decompress_data(frame_flags, payload)
+                    
+                    if payload is None:
+                        return False
+                
+                # a peer which sends more than the receive window ignores the flow control, the data would be buffered without a limit while the stream is paused
+                if stream.received_length + len(payload) > stream.receive_window:
+                    return False
+                
+                stream.data_received(payload)
+            
+            return True
+        else:
+            if frame_type == FRAME_WINDOW_UPDATE:
+                if len(payload) != window_struct.size:
+                    return False
+                
+                stream = self.streams.get(stream_id)
+                
+                if stream is not None:
+                    length, = window_struct.unpack(payload)
+                    
+                    stream.window_updated(length)
+                
+                return True
+            else:
+                if frame_type == FRAME_CLOSE:
+                    stream = self.streams.get(stream_id)
+                    
+                    if stream is not None:
+                        self.remove_stream(stream)
+                        
+                        stream.session__connection_lost(None)
+                    
+                    return True
+                else:
+                    return self.process_session_frame(frame_type, frame_flags, stream_id, payload)
+    
+    def process_session_frame(self, frame_type, frame_flags, stream_id, payload):
+        twunnel3.logger.log(3, "trace: MUXSession.process_session_frame")
+        
+        return False
+    
+    def write_frame(self, frame_type, frame_flags, stream_id, payload, priority):
+        twunnel3.logger.log(3, "trace: MUXSession.write_frame")
+        
+        if self.connection_state == 2:
+            return
+        
+        if self.connection_state == 1 and self.frames_length == 0 and self.writing_paused == False:
+            self.transport.write(frame_header.pack(frame_type, frame_flags, stream_id, len(payload)) + payload)
+            
+            return
+        
+        # frames wait while the connection is not writable and go out by priority when it is
+        self.frames[priority].append(frame_header.pack(frame_type, frame_flags, stream_id, len(payload)) + payload)
+        self.frames_length = self.frames_length + 1
+    
+    def write_frames(self):
+        twunnel3.logger.log(3, "trace: MUXSession.write_frames")
+        
+        for frames in self.frames:
+            while len(frames) > 0 and self.writing_paused == False and self.connection_state == 1:
+                self.frames_length = self.frames_length - 1
+                
+                self.transport.write(frames.popleft())
+    
+    def add_stream(self, stream):
+        twunnel3.logger.log(3, "trace: MUXSession.add_stream")
+        
+        self.streams[stream.stream_id] = stream
+        
+        if self.writing_paused == True:
+            stream.session__pause_writing()
+    
+    def remove_stream(self, stream):
+        twunnel3.logger.log(3, "trace: MUXSession.remove_stream")
+        
+        if self.streams.get(stream.stream_id) is stream:
+            del self.streams[stream.stream_id]
+    
+    def pause_writing(self):
+        twunnel3.logger.log(3, "trace: MUXSession.pause_writing")
+        
+        self.writing_paused = True
+        
+        for stream in list(self.streams.values()):
+            stream.session__pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.log(3, "trace: MUXSession.resume_writing")
+        
+        self.writing_paused = False
+        
+        self.write_frames()
+        
+        if self.writing_paused == False:
+            for stream in list(self.streams.values()):
+                stream.session__resume_writing()
+
+class MUXTunnelStream(MUXStream):
+    __slots__ = ("protocol", "protocol_factory", "future", "proxy_server_group_members")
+    
+    def __init__(self, session, stream_id, priority):
+        MUXStream.__init__(self, session, stream_id, priority)
+        
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.__init__")
+        
+        self.protocol = None
+        self.protocol_factory = None
+        self.future = None
+        self.proxy_server_group_members = []
+    
+    def stream__opened(self, status, send_window, compression_type):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.stream__opened")
+        
+        if status != 0x00:
+            self.connection_state = 2
+            
+            self.session.remove_stream(self)
+            self.release_proxy_server_group_members()
+            
+            if not self.future.done():
+                self.future.set_exception(ConnectionRefusedError("multiplexed stream was refused"))
+            
+            return
+        
+        self.connection_state = 1
+        self.send_window = send_window
+        
+        if compression_type != twunnel3.compression.COMPRESSION_NONE:
+            self.set_compression_type(compression_type)
+        
+        self.protocol = self.protocol_factory()
+        self.protocol.connection_made(self)
+        
+        if not self.future.done():
+            self.future.set_result((self, self.protocol))
+        
+        self.write_data()
+    
+    def stream__data_received(self, data):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.stream__data_received")
+        
+        self.protocol.data_received(data)
+    
+    def stream__connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.stream__connection_lost")
+        
+        self.release_proxy_server_group_members()
+        
+        if self.protocol is not None:
+            self.protocol.connection_lost(exception)
+        else:
+            if self.future is not None and not self.future.done():
+                self.future.set_exception(ConnectionResetError("multiplexed connection was lost"))
+    
+    def stream__pause_writing(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.stream__pause_writing")
+        
+        if self.protocol is not None:
+            self.protocol.pause_writing()
+    
+    def stream__resume_writing(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.stream__resume_writing")
+        
+        if self.protocol is not None:
+            self.protocol.resume_writing()
+    
+    def release_proxy_server_group_members(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.release_proxy_server_group_members")
+        
+        while len(self.proxy_server_group_members) > 0:
+            self.proxy_server_group_members.pop().connection_lost()
+    
+    def get_extra_info(self, name, default=None):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.get_extra_info")
+        
+        if self.session.transport is not None:
+            return self.session.transport.get_extra_info(name, default)
+        
+        return default
+    
+    def is_closing(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.is_closing")
+        
+        return self.connection_state == 2 or self.close_pending == True
+    
+    def get_write_buffer_size(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.get_write_buffer_size")
+        
+        return self.data_length
+    
+    def can_write_eof(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelStream.can_write_eof")
+        
+        return False
+
+class MUXTunnelOutputProtocol(MUXSession):
+    __slots__ = ("factory", "stream_id")
+    
+    def __init__(self):
+        MUXSession.__init__(self)
+        
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocol.__init__")
+        
+        self.factory = None
+        self.stream_id = 1
+    
+    def connection_made(self, transport):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocol.connection_made")
+        
+        MUXSession.connection_made(self, transport)
+        
+        name = self.factory.configuration.account.encoded_name
+        password = self.factory.configuration.account.encoded_password
+        
+        payload = struct.pack("!BB%dsB%ds" % (len(name), len(password)), 0x01, len(name), name, len(password), password)
+        
+        # the hello frame precedes the open frames that were queued while connecting
+        self.transport.write(frame_header.pack(FRAME_HELLO, 0, 0, len(payload)) + payload)
+        
+        self.write_frames()
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocol.connection_lost")
+        
+        self.factory.remove_session(self)
+        
+        MUXSession.connection_lost(self, exception)
+    
+    def remove_stream(self, stream):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocol.remove_stream")
+        
+        MUXSession.remove_stream(self, stream)
+        
+        # a session which has used all its stream ids is closed after its last stream
+        if self.stream_id > maximum_stream_id and len(self.streams) == 0 and self.transport is not None:
+            self.transport.close()
+    
+    def process_session_frame(self, frame_type, frame_flags, stream_id, payload):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocol.process_session_frame")
+        
+        if frame_type == FRAME_HELLO_REPLY:
+            if len(payload) < 1 or payload[0] != 0x00:
+                return False
+            
+            return True
+        else:
+            if frame_type == FRAME_OPEN_REPLY:
+                if len(payload) != open_reply_struct.size:
+                    return False
+                
+                stream = self.streams.get(stream_id)
+                
+                if stream is not None:
+                    status, send_window = open_reply_struct.unpack(payload)
+                    
+                    stream.stream__opened(status, send_window, frame_flags)
+                
+                return True
+            else:
+                return False
+    
+    def create_stream(self, address, port):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocol.create_stream")
+        
+        stream = MUXTunnelStream(self, self.stream_id, self.factory.configuration.priority)
+        
+        self.stream_id = self.stream_id + 2
+        
+        if self.stream_id > maximum_stream_id:
+            self.factory.remove_session(self)
+        
+        self.add_stream(stream)
+        
+        address = twunnel3.address.get_address(address).encoded_address
+        
+        # the priority is in the low bits of the flags and the requested compression in the high bits
+        self.write_frame(FRAME_OPEN, stream.priority | self.factory.compression_type << 4, stream.stream_id, open_struct.pack(stream.receive_window, port, len(address)) + address, stream.priority)
+        
+        return stream
+
+class MUXTunnelOutputProtocolFactory(object):
+    __slots__ = ("configuration", "key", "window", "compression_type")
+    
+    def __init__(self, configuration, key):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocolFactory.__init__")
+        
+        self.configuration = configuration
+        self.key = key
+        self.window = configuration.window
+        self.compression_type = configuration.compression.type
+    
+    def __call__(self):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocolFactory.__call__")
+        
+        protocol = MUXTunnelOutputProtocol()
+        protocol.factory = self
+        protocol.window = self.window
+        protocol.compression_configuration = self.configuration.compression
+        return protocol
+    
+    def remove_session(self, session):
+        twunnel3.logger.log(3, "trace: MUXTunnelOutputProtocolFactory.remove_session")
+        
+        sessions = mux_sessions.get(self.key)
+        
+        if sessions is not None and session in sessions:
+            sessions.remove(session)
+            
+            if len(sessions) == 0:
+                del mux_sessions[self.key]
+
+mux_sessions = {}
+
+def create_connection(tunnel, proxy_servers, proxy_server_group_members, output_protocol_factory, address, port, local_address=None, local_port=None, address_family=0, address_protocol=0, address_flags=0, socket_profile=None):
+    twunnel3.logger.log(3, "trace: create_connection")
+    
+    configuration = proxy_servers[-1]
+    
+    key = tuple(id(proxy_server) for proxy_server in proxy_servers)
+    
+    sessions = mux_sessions.setdefault(key, [])
+    
+    session = None
+    for existing_session in sessions:
+        if session is None or len(existing_session.streams) < len(session.streams):
+            session = existing_session
+    
+    # new links are opened until there are CONNECTIONS of them, then streams go to the least busy one, or to a new link when it is full
+    if session is None or (len(session.streams) > 0 and len(sessions) < configuration.connections) or len(session.streams) >= maximum_streams:
+        session_factory = tunnel.get_tunnel_output_protocol_factory_class("MUX")(configuration, key)
+        
+        session = session_factory()
+        
+        sessions.append(session)
+        
+        if len(proxy_servers) == 1 and configuration.path != "":
+            link_future = asyncio.async(asyncio.get_event_loop().create_unix_connection(lambda: session, path=configuration.path))
+        else:
+            link_tunnel = twunnel3.proxy_server.create_tunnel(twunnel3.configuration.Configuration(tuple(proxy_servers[:-1]), None))
+            link_future = asyncio.async(link_tunnel.create_connection(lambda: session, configuration.address, configuration.port, local_address=local_address, local_port=local_port, address_family=address_family, address_protocol=address_protocol, address_flags=address_flags, socket_profile=socket_profile))
+        
+        def link_done(link_future):
+            twunnel3.logger.log(3, "trace: link_done")
+            
+            if link_future.cancelled() or link_future.exception() is not None:
+                session_factory.remove_session(session)
+                
+                if session.connection_state == 0:
+                    session.connection_lost(None if link_future.cancelled() else link_future.exception())
+        
+        link_future.add_done_callback(link_done)
+    
+    stream = session.create_stream(address, port)
+    stream.protocol_factory = output_protocol_factory
+    stream.proxy_server_group_members = proxy_server_group_members
+    stream.future = asyncio.Future()
+    
+    return stream.future
\ No newline at end of file
@@ -3,134 +3,287 @@
 
 import asyncio
 import base64
-import socket
-import struct
+import twunnel3.address
+import twunnel3.configuration
 import twunnel3.logger
+import twunnel3.mux
+import twunnel3.proxy_server_group
+import twunnel3.socket_profile
+import twunnel3.socks
+import twunnel3.tracing
+
+# the reply of a HTTPS proxy server is at most this length, a longer reply closes the connection
+maximum_head_length = 65536
 
 def is_ipv4_address(address):
-    try:
-        socket.inet_pton(socket.AF_INET, address)
-    except socket.error:
-        return False
-    return True
+    return twunnel3.address.get_address(address).address_type == twunnel3.address.ADDRESS_TYPE_IPV4
 
 def is_ipv6_address(address):
-    try:
-        socket.inet_pton(socket.AF_INET6, address)
-    except socket.error:
-        return False
-    return True
-
-def set_default_configuration(configuration, keys):
-    if "PROXY_SERVERS" in keys:
-        configuration.setdefault("PROXY_SERVERS", [])
-        i = 0
-        while i < len(configuration["PROXY_SERVERS"]):
-            configuration["PROXY_SERVERS"][i].setdefault("TYPE", "")
-            if configuration["PROXY_SERVERS"][i]["TYPE"] == "HTTPS":
-                configuration["PROXY_SERVERS"][i].setdefault("ADDRESS", "")
-                configuration["PROXY_SERVERS"][i].setdefault("PORT", 0)
-                configuration["PROXY_SERVERS"][i].setdefault("ACCOUNT", {})
-                configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("NAME", "")
-                configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("PASSWORD", "")
-            else:
-                if configuration["PROXY_SERVERS"][i]["TYPE"] == "SOCKS4":
-                    configuration["PROXY_SERVERS"][i].setdefault("ADDRESS", "")
-                    configuration["PROXY_SERVERS"][i].setdefault("PORT", 0)
-                    configuration["PROXY_SERVERS"][i].setdefault("ACCOUNT", {})
-                    configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("NAME", "")
-                else:
-                    if configuration["PROXY_SERVERS"][i]["TYPE"] == "SOCKS5":
-                        configuration["PROXY_SERVERS"][i].setdefault("ADDRESS", "")
-                        configuration["PROXY_SERVERS"][i].setdefault("PORT", 0)
-                        configuration["PROXY_SERVERS"][i].setdefault("ACCOUNT", {})
-                        configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("NAME", "")
-                        configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("PASSWORD", "")
-            i = i + 1
+    return twunnel3.address.get_address(address).address_type == twunnel3.address.ADDRESS_TYPE_IPV6
 
 class TunnelProtocol(asyncio.Protocol):
-    def __init__(self):
+    __slots__ = ("tunnel_output_protocol", "tunnel_output_protocol_factory", "output_protocol", "output_protocol_factory", "address", "port", "ssl", "ssl_address", "socket_profile", "proxy_server_group_member", "proxy_server_group_members", "time", "data", "span", "hop_span", "state_span", "future", "transport")
+    
+    def __init__(self, tunnel_output_protocol_factory, output_protocol_factory, address, port, ssl, ssl_address):
         twunnel3.logger.log(3, "trace: TunnelProtocol.__init__")
         
+        self.tunnel_output_protocol = None
+        self.tunnel_output_protocol_factory = tunnel_output_protocol_factory
+        self.output_protocol = None
+        self.output_protocol_factory = output_protocol_factory
+        self.address = address
+        self.port = port
+        self.ssl = ssl
+        self.ssl_address = ssl_address
+        self.socket_profile = None
+        self.proxy_server_group_member = None
+        self.proxy_server_group_members = []
+        self.time = 0
         self.data = b""
-        self.factory = None
+        self.span = None
+        self.hop_span = None
+        self.state_span = None
+        self.future = None
         self.transport = None
     
+    def __call__(self):
+        twunnel3.logger.log(3, "trace: TunnelProtocol.__call__")
+        
+        # a tunnel protocol is built per connection and per proxy server, so it is its own protocol factory
+        return self
+    
     def connection_made(self, transport):
         twunnel3.logger.log(3, "trace: TunnelProtocol.connection_made")
         
         self.transport = transport
         
-        if self.factory.tunnel_output_protocol is None:
-            self.factory.tunnel_output_protocol_factory.tunnel_protocol = self
-            self.factory.tunnel_output_protocol = self.factory.tunnel_output_protocol_factory()
-            self.factory.tunnel_output_protocol.connection_made(self.transport)
+        if self.tunnel_output_protocol is None:
+            if self.proxy_server_group_member is not None:
+                self.time = asyncio.get_event_loop().time()
+            
+            self.tunnel_output_protocol = self.tunnel_output_protocol_factory()
+            self.tunnel_output_protocol.tunnel_protocol = self
+            
+            if self.span is not None:
+                configuration = self.tunnel_output_protocol_factory.configuration
+                
+                self.hop_span = self.span.create_span(configuration.type + " handshake", twunnel3.tracing.SPAN_KIND_CLIENT)
+                self.hop_span.set_attribute("twunnel3.proxy_server.type", configuration.type)
+                self.hop_span.set_attribute("twunnel3.proxy_server.address", configuration.address or configuration.path)
+                self.hop_span.set_attribute("twunnel3.proxy_server.port", configuration.port)
+                self.state_span = self.hop_span.create_span("process_data_state0")
+            
+            self.tunnel_output_protocol.connection_made(self.transport)
         else:
-            if self.factory.output_protocol is None:
-                self.factory.tunnel_output_protocol = None
+            if self.output_protocol is None:
+                self.tunnel_output_protocol = None
                 
-                self.factory.output_protocol = self.factory.output_protocol_factory()
-                self.factory.output_protocol.connection_made(self.transport)
+                if self.state_span is not None:
+                    self.state_span.end()
+                    self.state_span = None
+                
+                if self.socket_profile is not None:
+                    twunnel3.socket_profile.set_no_delay(self.transport.get_extra_info("socket"), self.socket_profile)
+                
+                self.output_protocol = self.output_protocol_factory()
+                self.output_protocol_factory = None
+                self.output_protocol.connection_made(self.transport)
+                
+                if isinstance(self.output_protocol, TunnelProtocol) == False:
+                    if self.span is not None:
+                        self.span.end()
+                    
+                    self.set_future(None)
                 
                 if len(self.data) > 0:
-                    self.factory.output_protocol.data_received(self.data)
+                    self.output_protocol.data_received(self.data)
                     
                     self.data = b""
+                
+                self.set_output_protocol()
     
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: TunnelProtocol.connection_lost")
         
-        if self.factory.tunnel_output_protocol is not None:
-            self.factory.tunnel_output_protocol.connection_lost(exception)
-        else:
-            if self.factory.output_protocol is not None:
-                self.factory.output_protocol.connection_lost(exception)
+        if self.tunnel_output_protocol is not None:
+            self.tunnel_output_protocol.connection_lost(exception)
+            
+            # the connection was lost during the handshake of the proxy server
+            if self.proxy_server_group_member is not None:
+                self.proxy_server_group_member.handshake_failed()
+            
+            # the output protocol of an optimistic proxy server was made before the reply of the proxy server
+            if self.output_protocol is not None and exception is None:
+                exception = ConnectionRefusedError("proxy server refused the connection")
+        
+        if self.span is not None:
+            self.end_spans(exception or ConnectionRefusedError("proxy server closed the connection"))
+        
+        # a proxy server which refuses the connection or closes it during its handshake fails the tunnel, the output protocol was never made
+        self.set_future(exception or ConnectionRefusedError("proxy server refused the connection"))
+        
+        if self.output_protocol is not None:
+            self.output_protocol.connection_lost(exception)
+        
+        while len(self.proxy_server_group_members) > 0:
+            self.proxy_server_group_members.pop().connection_lost()
         
         self.transport = None
     
     def data_received(self, data):
         twunnel3.logger.log(3, "trace: TunnelProtocol.data_received")
         
-        if self.factory.tunnel_output_protocol is not None:
-            self.factory.tunnel_output_protocol.data_received(data)
+        if self.tunnel_output_protocol is not None:
+            if self.state_span is not None:
+                self.process_data_traced(data)
+            else:
+                self.tunnel_output_protocol.data_received(data)
+        else:
+            if self.output_protocol is not None:
+                self.output_protocol.data_received(data)
+    
+    def process_data_traced(self, data):
+        twunnel3.logger.log(3, "trace: TunnelProtocol.process_data_traced")
+        
+        tunnel_output_protocol = self.tunnel_output_protocol
+        data_state = tunnel_output_protocol.data_state
+        
+        tunnel_output_protocol.data_received(data)
+        
+        # every state of the handshake of the proxy server gets a span, from the data which moves it to the state to the data which moves it to the next one
+        if self.tunnel_output_protocol is tunnel_output_protocol and tunnel_output_protocol.data_state != data_state and self.hop_span.end_time == 0:
+            self.state_span.end()
+            self.state_span = self.hop_span.create_span("process_data_state" + str(tunnel_output_protocol.data_state))
+    
+    def end_spans(self, exception):
+        twunnel3.logger.log(3, "trace: TunnelProtocol.end_spans")
+        
+        # the spans which already ended keep their end
+        if self.state_span is not None:
+            self.state_span.end(exception)
+        
+        if self.hop_span is not None:
+            self.hop_span.end(exception)
+        
+        self.span.end(exception)
+    
+    def set_future(self, exception):
+        twunnel3.logger.log(3, "trace: TunnelProtocol.set_future")
+        
+        # the future of the tunnel is done when the output protocol is made, or when the tunnel fails before it is made
+        if self.future is None or self.future.done() == True:
+            return
+        
+        if exception is None:
+            self.future.set_result((self.transport, self.output_protocol))
         else:
-            if self.factory.output_protocol is not None:
-                self.factory.output_protocol.data_received(data)
+            self.future.set_exception(exception)
+    
+    def set_output_protocol(self):
+        twunnel3.logger.log(3, "trace: TunnelProtocol.set_output_protocol")
+        
+        # the output protocol of the last proxy server gets the data, the flow control and the connection_lost of the transport directly, so the tunnel protocols of the proxy servers are no longer in the data path
+        if isinstance(self.output_protocol, TunnelProtocol) == True:
+            return
+        
+        # the proxy server group members are told when the connection is lost by the tunnel protocol
+        if len(self.proxy_server_group_members) > 0:
+            return
+        
+        self.transport.set_protocol(self.output_protocol)
+    
+    def tunnel_output_protocol__request_sent(self):
+        twunnel3.logger.log(3, "trace: TunnelProtocol.tunnel_output_protocol__request_sent")
+        
+        # the data of the next proxy server or of the output protocol is sent after the request, the reply is still read by the tunnel output protocol
+        # with ssl the handshake can only start after the reply
+        if self.ssl:
+            return
+        
+        if self.socket_profile is not None:
+            twunnel3.socket_profile.set_no_delay(self.transport.get_extra_info("socket"), self.socket_profile)
+        
+        self.output_protocol = self.output_protocol_factory()
+        self.output_protocol_factory = None
+        self.output_protocol.connection_made(self.transport)
+        
+        if isinstance(self.output_protocol, TunnelProtocol) == False:
+            if self.span is not None:
+                self.span.end()
+            
+            self.set_future(None)
     
     def tunnel_output_protocol__connection_made(self, transport, data):
         twunnel3.logger.log(3, "trace: TunnelProtocol.tunnel_output_protocol__connection_made")
         
+        if self.proxy_server_group_member is not None:
+            self.proxy_server_group_member.handshake_made(asyncio.get_event_loop().time() - self.time)
+        
+        if self.span is not None:
+            self.state_span.end()
+            self.state_span = None
+            self.hop_span.end()
+            
+            # the ssl handshake goes through all of the proxy servers, so it is a part of the tunnel and not of the hop
+            if self.ssl and self.output_protocol is None:
+                self.state_span = self.span.create_span("tls handshake", twunnel3.tracing.SPAN_KIND_CLIENT)
+                self.state_span.set_attribute("tls.server.name", str(self.ssl_address))
+        
+        if self.output_protocol is not None:
+            self.tunnel_output_protocol = None
+            
+            if len(data) > 0:
+                self.output_protocol.data_received(data)
+            
+            self.set_output_protocol()
+            
+            return
+        
         self.data = data
         
-        asyncio.async(asyncio.get_event_loop().create_connection(lambda: self, sock=self.transport.get_extra_info("socket"), ssl=self.factory.ssl, server_hostname=self.factory.ssl_address))
-
-class TunnelProtocolFactory(object):
-    def __init__(self, tunnel_output_protocol_factory, output_protocol_factory, ssl, ssl_address):
-        twunnel3.logger.log(3, "trace: TunnelProtocolFactory.__init__")
+        # without ssl the output protocol gets the transport of the handshake, a new transport of the same socket would be made in a later iteration of the event loop
+        if not self.ssl:
+            self.connection_made(self.transport)
+            
+            return
         
-        self.tunnel_output_protocol = None
-        self.tunnel_output_protocol_factory = tunnel_output_protocol_factory
-        self.output_protocol = None
-        self.output_protocol_factory = output_protocol_factory
-        self.ssl = ssl
-        self.ssl_address = ssl_address
-    
-    def __call__(self):
-        twunnel3.logger.log(3, "trace: TunnelProtocolFactory.__call__")
+        # the data after the reply is read by the ssl transport, so the transport of the handshake stops reading
+        self.transport.pause_reading()
         
-        protocol = TunnelProtocol()
-        protocol.factory = self
-        return protocol
+        future = asyncio.async(asyncio.get_event_loop().create_connection(self, sock=self.transport.get_extra_info("socket"), ssl=self.ssl, server_hostname=self.ssl_address))
+        
+        def create_connection_done(future):
+            if future.cancelled() == True:
+                exception = asyncio.CancelledError()
+            else:
+                exception = future.exception()
+            
+            # a failed ssl handshake never makes the output protocol, so it fails the tunnel
+            if exception is not None:
+                if self.state_span is not None:
+                    self.end_spans(exception)
+                
+                self.set_future(exception)
+        
+        future.add_done_callback(create_connection_done)
 
 class Tunnel(object):
     def __init__(self, configuration):
         twunnel3.logger.log(3, "trace: Tunnel.__init__")
         
         self.configuration = configuration
+        # the proxy servers of the last connection, with the members which were selected from the groups
+        self.proxy_servers = ()
     
-    def create_connection(self, output_protocol_factory, address=None, port=None, *, local_address=None, local_port=None, address_family=0, address_protocol=0, address_flags=0, ssl=None, ssl_address=None):
+    def create_connection(self, output_protocol_factory, address=None, port=None, *, local_address=None, local_port=None, address_family=0, address_protocol=0, address_flags=0, ssl=None, ssl_address=None, socket_profile=None, span=None):
         twunnel3.logger.log(3, "trace: Tunnel.create_connection")
         
+        if span is not None:
+            span = span.create_span("tunnel")
+            span.set_attribute("server.address", str(address))
+            span.set_attribute("server.port", port)
+            span.set_attribute("twunnel3.proxy_servers", len(self.configuration.proxy_servers))
+        
         local_address_port = None
         if local_address is not None or local_port is not None:
             local_address_port = (local_address, local_port)
@@ -138,33 +291,162 @@ class Tunnel(object):
         if ssl and not ssl_address:
             ssl_address = address
         
-        if len(self.configuration["PROXY_SERVERS"]) == 0:
-            return asyncio.get_event_loop().create_connection(output_protocol_factory, host=address, port=port, local_addr=local_address_port, family=address_family, proto=address_protocol, flags=address_flags, ssl=ssl, server_hostname=ssl_address)
+        if len(self.configuration.proxy_servers) == 0:
+            future = twunnel3.socket_profile.create_connection(output_protocol_factory, socket_profile, host=address, port=port, local_addr=local_address_port, family=address_family, proto=address_protocol, flags=address_flags, ssl=ssl, server_hostname=ssl_address, span=span)
+            
+            if span is not None:
+                future = asyncio.async(future)
+                future.add_done_callback(span.future_done)
+            
+            return future
         else:
-            i = len(self.configuration["PROXY_SERVERS"])
+            proxy_servers, proxy_server_group_members = self.select_proxy_servers(address, port)
+            
+            if proxy_servers is not None:
+                self.proxy_servers = tuple(proxy_server[0] for proxy_server in proxy_servers)
+            
+            if proxy_servers is None:
+                while len(proxy_server_group_members) > 0:
+                    proxy_server_group_members.pop().connection_lost()
+                
+                future = asyncio.Future()
+                future.set_exception(ConnectionRefusedError("proxy server group has no proxy servers"))
+                
+                if span is not None:
+                    span.end(future.exception())
+                
+                return future
+            
+            # the socket to the first proxy server is tuned with its SOCKET_PROFILE, or else with the one of the caller
+            if proxy_servers[0][0].socket_profile is not None:
+                socket_profile = proxy_servers[0][0].socket_profile
+            
+            # the address is classified and encoded once and reused by the proxy servers
+            address = twunnel3.address.get_address(address)
             
-            configuration = {}
-            configuration["PROXY_SERVER"] = self.configuration["PROXY_SERVERS"][i - 1]
+            i = len(proxy_servers)
             
-            tunnel_output_protocol_factory_class = self.get_tunnel_output_protocol_factory_class(configuration["PROXY_SERVER"]["TYPE"])
-            tunnel_output_protocol_factory = tunnel_output_protocol_factory_class(configuration, address, port)
+            # a MUX proxy server carries streams instead of connections, so it can only be the last one
+            proxy_server_types = [proxy_server[0].type for proxy_server in proxy_servers]
             
-            tunnel_protocol_factory = TunnelProtocolFactory(tunnel_output_protocol_factory, output_protocol_factory, ssl, ssl_address)
+            if "MUX" in proxy_server_types:
+                if proxy_server_types.index("MUX") != i - 1 or ssl:
+                    while len(proxy_server_group_members) > 0:
+                        proxy_server_group_members.pop().connection_lost()
+                    
+                    future = asyncio.Future()
+                    future.set_exception(ValueError("a MUX proxy server must be the last proxy server and does not support ssl"))
+                    
+                    if span is not None:
+                        span.end(future.exception())
+                    
+                    return future
+                
+                # the streams of a MUX session share its connection, so a stream only gets the span of the tunnel
+                future = twunnel3.mux.create_connection(self, [proxy_server[0] for proxy_server in proxy_servers], proxy_server_group_members, output_protocol_factory, address, port, local_address=local_address, local_port=local_port, address_family=address_family, address_protocol=address_protocol, address_flags=address_flags, socket_profile=socket_profile)
+                
+                if span is not None:
+                    future = asyncio.async(future)
+                    future.add_done_callback(span.future_done)
+                
+                return future
+            
+            # the future of the tunnel is shared by its tunnel protocols, like loop.create_connection it is done when the output protocol is made
+            tunnel_future = asyncio.Future()
+            
+            tunnel_protocol = TunnelProtocol(self.get_tunnel_output_protocol_factory(proxy_servers[i - 1][0]), output_protocol_factory, address, port, ssl, ssl_address)
+            tunnel_protocol.socket_profile = socket_profile
+            tunnel_protocol.proxy_server_group_member = proxy_servers[i - 1][1]
+            tunnel_protocol.proxy_server_group_members = proxy_server_group_members
+            tunnel_protocol.span = span
+            tunnel_protocol.future = tunnel_future
             
             i = i - 1
             
             while i > 0:
-                configuration = {}
-                configuration["PROXY_SERVER"] = self.configuration["PROXY_SERVERS"][i - 1]
+                tunnel_protocol = TunnelProtocol(self.get_tunnel_output_protocol_factory(proxy_servers[i - 1][0]), tunnel_protocol, twunnel3.address.get_address(proxy_servers[i][0].address), proxy_servers[i][0].port, None, None)
+                tunnel_protocol.socket_profile = socket_profile
+                tunnel_protocol.proxy_server_group_member = proxy_servers[i - 1][1]
+                tunnel_protocol.proxy_server_group_members = proxy_server_group_members
+                tunnel_protocol.span = span
+                tunnel_protocol.future = tunnel_future
+                
+                i = i - 1
+            
+            if proxy_servers[i][0].path != "":
+                future = asyncio.async(asyncio.get_event_loop().create_unix_connection(tunnel_protocol, path=proxy_servers[i][0].path))
+            else:
+                future = asyncio.async(twunnel3.socket_profile.create_connection(tunnel_protocol, socket_profile, host=proxy_servers[i][0].address, port=proxy_servers[i][0].port, local_addr=local_address_port, family=address_family, proto=address_protocol, flags=address_flags, span=span))
+            
+            # the tunnel span ends when the output protocol is made, or when the connection to the first proxy server fails
+            if span is not None:
+                def connection_done(future):
+                    if future.cancelled() == True or future.exception() is not None:
+                        span.future_done(future)
                 
-                tunnel_output_protocol_factory_class = self.get_tunnel_output_protocol_factory_class(configuration["PROXY_SERVER"]["TYPE"])
-                tunnel_output_protocol_factory = tunnel_output_protocol_factory_class(configuration, self.configuration["PROXY_SERVERS"][i]["ADDRESS"], self.configuration["PROXY_SERVERS"][i]["PORT"])
+                future.add_done_callback(connection_done)
+            
+            if len(proxy_server_group_members) > 0:
+                def create_connection_done(future):
+                    if future.cancelled() or future.exception() is not None:
+                        # the first proxy server could not be connected to
+                        if proxy_servers[0][1] is not None:
+                            proxy_servers[0][1].handshake_failed()
+                        
+                        while len(proxy_server_group_members) > 0:
+                            proxy_server_group_members.pop().connection_lost()
                 
-                tunnel_protocol_factory = TunnelProtocolFactory(tunnel_output_protocol_factory, tunnel_protocol_factory, None, None)
+                future.add_done_callback(create_connection_done)
+            
+            def tunnel_connection_done(future):
+                if tunnel_future.done() == True:
+                    return
                 
-                i = i - 1
+                if future.cancelled() == True:
+                    tunnel_future.cancel()
+                else:
+                    if future.exception() is not None:
+                        tunnel_future.set_exception(future.exception())
             
-            return asyncio.get_event_loop().create_connection(tunnel_protocol_factory, host=self.configuration["PROXY_SERVERS"][i]["ADDRESS"], port=self.configuration["PROXY_SERVERS"][i]["PORT"], local_addr=local_address_port, family=address_family, proto=address_protocol, flags=address_flags)
+            future.add_done_callback(tunnel_connection_done)
+            
+            return tunnel_future
+    
+    def select_proxy_servers(self, address, port):
+        twunnel3.logger.log(3, "trace: Tunnel.select_proxy_servers")
+        
+        proxy_servers = []
+        proxy_server_group_members = []
+        
+        for proxy_server in self.configuration.proxy_servers:
+            if proxy_server.type == "GROUP":
+                proxy_server_group = twunnel3.proxy_server_group.get_proxy_server_group(proxy_server)
+                proxy_server_group_member = proxy_server_group.select_proxy_server_group_member(address, port)
+                
+                if proxy_server_group_member is None:
+                    return (None, proxy_server_group_members)
+                
+                proxy_server_group_member.connection_made()
+                
+                proxy_servers.append((proxy_server_group_member.configuration, proxy_server_group_member))
+                proxy_server_group_members.append(proxy_server_group_member)
+            else:
+                proxy_servers.append((proxy_server, None))
+        
+        return (proxy_servers, proxy_server_group_members)
+    
+    def get_tunnel_output_protocol_factory(self, configuration):
+        twunnel3.logger.log(3, "trace: Tunnel.get_tunnel_output_protocol_factory")
+        
+        # the factory of a proxy server is kept by its configuration and shared by all connections through it, so a reloaded configuration gets a new factory and the factory of the old one goes with it
+        tunnel_output_protocol_factory = getattr(configuration, "tunnel_output_protocol_factory", None)
+        
+        if tunnel_output_protocol_factory is None:
+            tunnel_output_protocol_factory = self.get_tunnel_output_protocol_factory_class(configuration.type)(configuration)
+            
+            configuration.tunnel_output_protocol_factory = tunnel_output_protocol_factory
+        
+        return tunnel_output_protocol_factory
     
     def get_tunnel_output_protocol_factory_class(self, type):
         twunnel3.logger.log(3, "trace: Tunnel.get_tunnel_output_protocol_factory_class")
@@ -178,7 +460,10 @@ class Tunnel(object):
                 if type == "SOCKS5":
                     return SOCKS5TunnelOutputProtocolFactory
                 else:
-                    return None
+                    if type == "MUX":
+                        return twunnel3.mux.MUXTunnelOutputProtocolFactory
+                    else:
+                        return None
 
 default_tunnel_class = Tunnel
 
@@ -193,7 +478,7 @@ def set_default_tunnel_class(tunnel_class):
     default_tunnel_class = tunnel_class
 
 def create_tunnel(configuration):
-    set_default_configuration(configuration, ["PROXY_SERVERS"])
+    configuration = twunnel3.configuration.get_configuration(configuration)
     
     tunnel_class = get_default_tunnel_class()
     tunnel = tunnel_class(configuration)
@@ -201,12 +486,17 @@ def create_tunnel(configuration):
     return tunnel
 
 class HTTPSTunnelOutputProtocol(asyncio.Protocol):
+    __slots__ = ("data", "data_offset", "data_state", "factory", "tunnel_protocol", "transport")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: HTTPSTunnelOutputProtocol.__init__")
         
-        self.data = b""
+        # the reply grows in place and is searched from data_offset, so a reply which is received in small parts is not copied and searched again for every part
+        self.data = bytearray()
+        self.data_offset = 0
         self.data_state = 0
         self.factory = None
+        self.tunnel_protocol = None
         self.transport = None
         
     def connection_made(self, transport):
@@ -215,21 +505,17 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
         self.transport = transport
         
         request = b"CONNECT "
-        
-        if is_ipv6_address(self.factory.address) == True:
-            request = request + b"[" + self.factory.address.encode() + b"]:" + str(self.factory.port).encode()
-        else:
-            request = request + self.factory.address.encode() + b":" + str(self.factory.port).encode()
+        request = request + self.tunnel_protocol.address.http_address + b":" + str(self.tunnel_protocol.port).encode()
         
         request = request + b" HTTP/1.1\r\n"
         
-        if self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode() != b"":
-            request = request + b"Proxy-Authorization: Basic " + base64.standard_b64encode(self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode() + b":" + self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"].encode()) + b"\r\n"
-        
-        request = request + b"\r\n"
+        request = request + self.factory.authorization + b"\r\n"
         
         self.transport.write(request)
         
+        if self.factory.configuration.optimistic == True:
+            self.tunnel_protocol.tunnel_output_protocol__request_sent()
+        
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: HTTPSTunnelOutputProtocol.connection_lost")
         
@@ -238,7 +524,7 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
     def data_received(self, data):
         twunnel3.logger.log(3, "trace: HTTPSTunnelOutputProtocol.data_received")
         
-        self.data = self.data + data
+        self.data += data
         if self.data_state == 0:
             if self.process_data_state0():
                 return
@@ -248,16 +534,24 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
         
         data = self.data
         
-        i = data.find(b"\r\n\r\n")
+        i = data.find(b"\r\n\r\n", self.data_offset)
         
         if i == -1:
-            return True
+            if len(data) > maximum_head_length:
+                self.transport.close()
+                
+                return True
+            
+            # the end of the reply can be split over two parts
+            self.data_offset = max(len(data) - 3, 0)
             
+            return True
+        
         i = i + 4
         
-        response = data[:i]
+        response = bytes(data[:i])
         
-        data = data[i:]
+        data = bytes(data[i:])
         
         response_lines = response.split(b"\r\n")
         response_line = response_lines[0].split(b" ", 2)
@@ -276,20 +570,24 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
             
             return True
         
-        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
+        self.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
         
-        self.data = b""
+        self.data = bytearray()
+        self.data_offset = 0
         
         return True
 
 class HTTPSTunnelOutputProtocolFactory(object):
-    def __init__(self, configuration, address, port):
+    __slots__ = ("configuration", "authorization")
+    
+    def __init__(self, configuration):
         twunnel3.logger.log(3, "trace: HTTPSTunnelOutputProtocolFactory.__init__")
         
         self.configuration = configuration
-        self.address = address
-        self.port = port
-        self.tunnel_protocol = None
+        
+        self.authorization = b""
+        if self.configuration.account.encoded_name != b"":
+            self.authorization = b"Proxy-Authorization: Basic " + base64.standard_b64encode(self.configuration.account.encoded_name + b":" + self.configuration.account.encoded_password) + b"\r\n"
     
     def __call__(self):
         twunnel3.logger.log(3, "trace: HTTPSTunnelOutputProtocolFactory.__call__")
@@ -299,12 +597,15 @@ class HTTPSTunnelOutputProtocolFactory(object):
         return protocol
 
 class SOCKS4TunnelOutputProtocol(asyncio.Protocol):
+    __slots__ = ("data", "data_state", "factory", "tunnel_protocol", "transport")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: SOCKS4TunnelOutputProtocol.__init__")
         
         self.data = b""
         self.data_state = 0
         self.factory = None
+        self.tunnel_protocol = None
         self.transport = None
     
     def connection_made(self, transport):
@@ -312,44 +613,15 @@ class SOCKS4TunnelOutputProtocol(asyncio.Protocol):
         
         self.transport = transport
         
-        address_type = 0x03
-        if is_ipv4_address(self.factory.address) == True:
-            address_type = 0x01
-        
-        request = struct.pack("!BB", 0x04, 0x01)
-        
-        port = self.factory.port
-        
-        request = request + struct.pack("!H", port)
-        
-        address = 0
-        if address_type == 0x01:
-            address = self.factory.address
-            address = socket.inet_pton(socket.AF_INET, address)
-            address, = struct.unpack("!I", address)
-        else:
-            if address_type == 0x03:
-                address = 1
-        
-        request = request + struct.pack("!I", address)
-        
-        name = self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode()
-        name = name + b"\x00"
-        name_length = len(name)
-        
-        request = request + struct.pack("!%ds" % name_length, name)
-        
-        if address_type == 0x03:
-            address = self.factory.address.encode()
-            address = address + b"\x00"
-            address_length = len(address)
-            
-            request = request + struct.pack("!%ds" % address_length, address)
+        request = twunnel3.socks.encode_socks4_request(self.tunnel_protocol.address, self.tunnel_protocol.port, self.factory.name)
         
         self.transport.write(request)
         
         self.data_state = 0
         
+        if self.factory.configuration.optimistic == True:
+            self.tunnel_protocol.tunnel_output_protocol__request_sent()
+        
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: SOCKS4TunnelOutputProtocol.connection_lost")
         
@@ -368,32 +640,33 @@ class SOCKS4TunnelOutputProtocol(asyncio.Protocol):
         
         data = self.data
         
-        if len(data) < 8:
+        if len(data) < twunnel3.socks.socks4_reply_struct.size:
             return True
         
-        status, = struct.unpack("!B", data[1:2])
+        version, status, port, address = twunnel3.socks.socks4_reply_struct.unpack_from(data)
         
-        data = data[8:]
+        data = data[twunnel3.socks.socks4_reply_struct.size:]
         
         if status != 0x5a:
             self.transport.close()
             
             return True
         
-        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
+        self.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
         
         self.data = b""
         
         return True
 
 class SOCKS4TunnelOutputProtocolFactory(object):
-    def __init__(self, configuration, address, port):
+    __slots__ = ("configuration", "name")
+    
+    def __init__(self, configuration):
         twunnel3.logger.log(3, "trace: SOCKS4TunnelOutputProtocolFactory.__init__")
         
         self.configuration = configuration
-        self.address = address
-        self.port = port
-        self.tunnel_protocol = None
+        
+        self.name = self.configuration.account.encoded_name + b"\x00"
     
     def __call__(self):
         twunnel3.logger.log(3, "trace: SOCKS4TunnelOutputProtocolFactory.__call__")
@@ -403,12 +676,15 @@ class SOCKS4TunnelOutputProtocolFactory(object):
         return protocol
 
 class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
+    __slots__ = ("data", "data_state", "factory", "tunnel_protocol", "transport")
+    
     def __init__(self):
         twunnel3.logger.log(3, "trace: SOCKS5TunnelOutputProtocol.__init__")
         
         self.data = b""
         self.data_state = 0
         self.factory = None
+        self.tunnel_protocol = None
         self.transport = None
     
     def connection_made(self, transport):
@@ -416,12 +692,16 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         
         self.transport = transport
         
-        request = struct.pack("!BBBB", 0x05, 0x02, 0x00, 0x02)
-        
-        self.transport.write(request)
-        
         self.data_state = 0
         
+        # an optimistic proxy server gets one method, the authentication request and the request at once
+        if self.factory.configuration.optimistic == True:
+            self.transport.write(self.factory.optimistic_request + twunnel3.socks.encode_socks5_request(self.tunnel_protocol.address, self.tunnel_protocol.port))
+            
+            self.tunnel_protocol.tunnel_output_protocol__request_sent()
+        else:
+            self.transport.write(twunnel3.socks.SOCKS5_METHOD_REQUEST)
+        
     def connection_lost(self, exception):
         twunnel3.logger.log(3, "trace: SOCKS5TunnelOutputProtocol.connection_lost")
         
@@ -449,12 +729,12 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         
         data = self.data
         
-        if len(data) < 2:
+        if len(data) < twunnel3.socks.socks5_method_struct.size:
             return True
         
-        version, method = struct.unpack("!BB", data[:2])
+        version, method = twunnel3.socks.socks5_method_struct.unpack_from(data)
         
-        data = data[2:]
+        data = data[twunnel3.socks.socks5_method_struct.size:]
         
         self.data = data
         
@@ -464,21 +744,12 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
             return False
         else:
             if method == 0x02:
-                name = self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode()
-                name_length = len(name)
-                
-                password = self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"].encode()
-                password_length = len(password)
-                
-                request = struct.pack("!B", 0x01)
-                request = request + struct.pack("!B%ds" % name_length, name_length, name)
-                request = request + struct.pack("!B%ds" % password_length, password_length, password)
-                
-                self.transport.write(request)
+                if self.factory.configuration.optimistic == False:
+                    self.transport.write(self.factory.authentication_request)
                 
                 self.data_state = 1
                 
-                return True
+                return False
             else:
                 self.transport.close()
                 
@@ -489,12 +760,12 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         
         data = self.data
         
-        if len(data) < 2:
+        if len(data) < twunnel3.socks.socks5_method_struct.size:
             return True
         
-        version, status = struct.unpack("!BB", data[:2])
+        version, status = twunnel3.socks.socks5_method_struct.unpack_from(data)
         
-        data = data[2:]
+        data = data[twunnel3.socks.socks5_method_struct.size:]
         
         self.data = data
         
@@ -510,118 +781,58 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
     def process_data_state2(self):
         twunnel3.logger.log(3, "trace: SOCKS5TunnelOutputProtocol.process_data_state2")
         
-        address_type = 0x03
-        if is_ipv4_address(self.factory.address) == True:
-            address_type = 0x01
-        else:
-            if is_ipv6_address(self.factory.address) == True:
-                address_type = 0x04
-        
-        request = struct.pack("!BBB", 0x05, 0x01, 0x00)
-        
-        if address_type == 0x01:
-            address = self.factory.address
-            address = socket.inet_pton(socket.AF_INET, address)
-            address, = struct.unpack("!I", address)
+        if self.factory.configuration.optimistic == False:
+            request = twunnel3.socks.encode_socks5_request(self.tunnel_protocol.address, self.tunnel_protocol.port)
             
-            request = request + struct.pack("!BI", 0x01, address)
-        else:
-            if address_type == 0x03:
-                address = self.factory.address.encode()
-                address_length = len(address)
-                
-                request = request + struct.pack("!BB%ds" % address_length, 0x03, address_length, address)
-            else:
-                if address_type == 0x04:
-                    address = self.factory.address
-                    address = socket.inet_pton(socket.AF_INET6, address)
-                    address1, address2, address3, address4 = struct.unpack("!IIII", address)
-                    
-                    request = request + struct.pack("!BIIII", 0x04, address1, address2, address3, address4)
-        
-        port = self.factory.port
-        
-        request = request + struct.pack("!H", port)
-        
-        self.transport.write(request)
+            self.transport.write(request)
         
         self.data_state = 3
         
-        return True
+        return False
     
     def process_data_state3(self):
         twunnel3.logger.log(3, "trace: SOCKS5TunnelOutputProtocol.process_data_state3")
         
         data = self.data
         
-        if len(data) < 4:
+        if len(data) < twunnel3.socks.socks5_header_struct.size:
             return True
         
-        version, status, reserved, address_type = struct.unpack("!BBBB", data[:4])
-        
-        data = data[4:]
+        version, status, reserved = twunnel3.socks.socks5_header_struct.unpack_from(data)
         
         if status != 0x00:
             self.transport.close()
             
             return True
         
-        if address_type == 0x01:
-            if len(data) < 4:
-                return True
-            
-            address, = struct.unpack("!I", data[:4])
-            address = struct.pack("!I", address)
-            address = socket.inet_ntop(socket.AF_INET, address)
-            
-            data = data[4:]
-        else:
-            if address_type == 0x03:
-                if len(data) < 1:
-                    return True
-                
-                address_length, = struct.unpack("!B", data[:1])
-                
-                data = data[1:]
-                
-                if len(data) < address_length:
-                    return True
-                
-                address, = struct.unpack("!%ds" % address_length, data[:address_length])
-                
-                data = data[address_length:]
-            else:
-                if address_type == 0x04:
-                    if len(data) < 16:
-                        return True
-                    
-                    address1, address2, address3, address4 = struct.unpack("!IIII", data[:16])
-                    address = struct.pack("!IIII", address1, address2, address3, address4)
-                    address = socket.inet_ntop(socket.AF_INET6, address)
-                    
-                    data = data[16:]
-        
-        if len(data) < 2:
+        address = twunnel3.socks.decode_socks5_address(data, twunnel3.socks.socks5_header_struct.size)
+        if address is None:
             return True
         
-        port, = struct.unpack("!H", data[:2])
+        address, port, offset = address
         
-        data = data[2:]
+        data = data[offset:]
         
-        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
+        self.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
         
         self.data = b""
         
         return True
 
 class SOCKS5TunnelOutputProtocolFactory(object):
-    def __init__(self, configuration, address, port):
+    __slots__ = ("configuration", "authentication_request", "optimistic_request")
+    
+    def __init__(self, configuration):
         twunnel3.logger.log(3, "trace: SOCKS5TunnelOutputProtocolFactory.__init__")
         
         self.configuration = configuration
-        self.address = address
-        self.port = port
-        self.tunnel_protocol = None
+        
+        self.authentication_request = twunnel3.socks.encode_socks5_authentication_request(self.configuration.account.encoded_name, self.configuration.account.encoded_password)
+        
+        if self.configuration.account.encoded_name == b"":
+            self.optimistic_request = twunnel3.socks.SOCKS5_METHOD_REQUEST_NO_AUTHENTICATION
+        else:
+            self.optimistic_request = twunnel3.socks.SOCKS5_METHOD_REQUEST_AUTHENTICATION + self.authentication_request
     
     def __call__(self):
         twunnel3.logger.log(3, "trace: SOCKS5TunnelOutputProtocolFactory.__call__")
@@ -0,0 +1,357 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import bisect
+import hashlib
+import heapq
+import random
+import twunnel3.configuration
+import twunnel3.logger
+import twunnel3.proxy_server
+
+# the latency of a failed handshake is at least this many seconds, and a latency is at most maximum_latency seconds
+failed_handshake_latency = 1.0
+maximum_latency = 60.0
+
+def get_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class ProxyServerGroupMember(object):
+    def __init__(self, group, configuration):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.__init__")
+        
+        self.group = group
+        self.configuration = configuration
+        self.weight = max(configuration.weight, 1)
+        self.virtual_start_time = 0.0
+        self.virtual_finish_time = 0.0
+        self.active_connections = 0
+        self.latency = 0.0
+        self.removed = False
+        self.heap_entry = None
+    
+    def connection_made(self):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.connection_made")
+        
+        self.active_connections = self.active_connections + 1
+        
+        if self.removed == False:
+            self.group.strategy.update_proxy_server_group_member(self)
+    
+    def connection_lost(self):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.connection_lost")
+        
+        self.active_connections = self.active_connections - 1
+        
+        if self.removed == False:
+            self.group.strategy.update_proxy_server_group_member(self)
+    
+    def handshake_made(self, latency):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.handshake_made")
+        
+        self.group.handshake_made(latency)
+        
+        self.update_latency(latency)
+    
+    def handshake_failed(self):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.handshake_failed")
+        
+        # a member which refuses connections or closes them during the handshake counts as slow until its handshakes succeed again
+        self.update_latency(min(max(self.get_latency(), failed_handshake_latency) * 2, maximum_latency))
+    
+    def update_latency(self, latency):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.update_latency")
+        
+        if self.latency == 0.0:
+            self.latency = latency
+        else:
+            self.latency = self.latency + (latency - self.latency) * self.group.latency_factor
+    
+    def get_latency(self):
+        twunnel3.logger.log(3, "trace: ProxyServerGroupMember.get_latency")
+        
+        # a member without a handshake yet gets the latency of the group
+        if self.latency == 0.0:
+            return self.group.latency
+        
+        return self.latency
+
+class WeightedRoundRobinStrategy(object):
+    def __init__(self, group):
+        twunnel3.logger.log(3, "trace: WeightedRoundRobinStrategy.__init__")
+        
+        self.group = group
+        self.total_weight = 0
+        self.virtual_time = 0.0
+        # the members which have started, by their virtual finish time, and the members which have not, by their virtual start time
+        self.heap = []
+        self.waiting_heap = []
+        self.counter = 0
+    
+    def update_proxy_server_group_members(self):
+        twunnel3.logger.log(3, "trace: WeightedRoundRobinStrategy.update_proxy_server_group_members")
+        
+        self.total_weight = 0
+        
+        for member in self.group.members:
+            self.total_weight = self.total_weight + member.weight
+            
+            # a new member starts at the virtual time, the entries of the removed members are discarded lazily
+            if member.heap_entry is None:
+                member.virtual_start_time = self.virtual_time
+                
+                self.push_proxy_server_group_member(member)
+    
+    def update_proxy_server_group_member(self, member):
+        pass
+    
+    def push_proxy_server_group_member(self, member):
+        twunnel3.logger.log(3, "trace: WeightedRoundRobinStrategy.push_proxy_server_group_member")
+        
+        self.counter = self.counter + 1
+        
+        member.virtual_finish_time = member.virtual_start_time + 1 / member.weight
+        
+        if member.virtual_start_time <= self.virtual_time:
+            member.heap_entry = [member.virtual_finish_time, self.counter, member]
+            
+            heapq.heappush(self.heap, member.heap_entry)
+        else:
+            member.heap_entry = [member.virtual_start_time, self.counter, member]
+            
+            heapq.heappush(self.waiting_heap, member.heap_entry)
+    
+    def select_proxy_server_group_member(self, address, port):
+        twunnel3.logger.log(3, "trace: WeightedRoundRobinStrategy.select_proxy_server_group_member")
+        
+        # weighted fair queueing, the virtual time advances by 1 / total weight per selection and a member takes 1 / its weight of it,
+        # the member which finishes first of the members which have started is selected, so the selections of a heavy member are spread out
+        while True:
+            while len(self.waiting_heap) > 0 and (self.waiting_heap[0][0] <= self.virtual_time or len(self.heap) == 0):
+                heap_entry = heapq.heappop(self.waiting_heap)
+                heap_entry[0] = heap_entry[2].virtual_finish_time
+                
+                heapq.heappush(self.heap, heap_entry)
+            
+            heap_entry = heapq.heappop(self.heap)
+            
+            if heap_entry[2].removed == False:
+                break
+        
+        member = heap_entry[2]
+        
+        self.virtual_time = self.virtual_time + 1 / self.total_weight
+        
+        member.virtual_start_time = member.virtual_finish_time
+        
+        self.push_proxy_server_group_member(member)
+        
+        return member
+
+class LeastConnectionsStrategy(object):
+    def __init__(self, group):
+        twunnel3.logger.log(3, "trace: LeastConnectionsStrategy.__init__")
+        
+        self.group = group
+        self.heap = []
+        self.counter = 0
+    
+    def update_proxy_server_group_members(self):
+        twunnel3.logger.log(3, "trace: LeastConnectionsStrategy.update_proxy_server_group_members")
+        
+        self.heap = []
+        
+        for member in self.group.members:
+            self.push_proxy_server_group_member(member)
+    
+    def update_proxy_server_group_member(self, member):
+        twunnel3.logger.log(3, "trace: LeastConnectionsStrategy.update_proxy_server_group_member")
+        
+        # the previous entry of the member becomes stale and is discarded lazily
+        self.push_proxy_server_group_member(member)
+        
+        if len(self.heap) > 4 * len(self.group.members) + 16:
+            self.update_proxy_server_group_members()
+    
+    def push_proxy_server_group_member(self, member):
+        twunnel3.logger.log(3, "trace: LeastConnectionsStrategy.push_proxy_server_group_member")
+        
+        self.counter = self.counter + 1
+        
+        member.heap_entry = [member.active_connections / member.weight, self.counter, member]
+        
+        heapq.heappush(self.heap, member.heap_entry)
+    
+    def select_proxy_server_group_member(self, address, port):
+        twunnel3.logger.log(3, "trace: LeastConnectionsStrategy.select_proxy_server_group_member")
+        
+        while self.heap[0][2].heap_entry is not self.heap[0] or self.heap[0][2].removed == True:
+            heapq.heappop(self.heap)
+        
+        return self.heap[0][2]
+
+class PowerOfTwoChoicesStrategy(object):
+    def __init__(self, group):
+        twunnel3.logger.log(3, "trace: PowerOfTwoChoicesStrategy.__init__")
+        
+        self.group = group
+    
+    def update_proxy_server_group_members(self):
+        pass
+    
+    def update_proxy_server_group_member(self, member):
+        pass
+    
+    def select_proxy_server_group_member(self, address, port):
+        twunnel3.logger.log(3, "trace: PowerOfTwoChoicesStrategy.select_proxy_server_group_member")
+        
+        members = self.group.members
+        
+        if len(members) == 1:
+            return members[0]
+        
+        i = random.randrange(len(members))
+        j = random.randrange(len(members) - 1)
+        if j >= i:
+            j = j + 1
+        
+        member1 = members[i]
+        member2 = members[j]
+        
+        cost1 = member1.get_latency() * (member1.active_connections + 1)
+        cost2 = member2.get_latency() * (member2.active_connections + 1)
+        
+        # while no latency is known, or the costs are the same, the member with fewer connections is selected
+        if cost1 == cost2:
+            if member1.active_connections <= member2.active_connections:
+                return member1
+            else:
+                return member2
+        
+        if cost1 < cost2:
+            return member1
+        else:
+            return member2
+
+class ConsistentHashingStrategy(object):
+    def __init__(self, group):
+        twunnel3.logger.log(3, "trace: ConsistentHashingStrategy.__init__")
+        
+        self.group = group
+        self.hashes = []
+        self.hash_members = []
+    
+    def update_proxy_server_group_members(self):
+        twunnel3.logger.log(3, "trace: ConsistentHashingStrategy.update_proxy_server_group_members")
+        
+        ring = []
+        
+        for member in self.group.members:
+            i = 0
+            while i < member.weight * self.group.virtual_nodes:
+                ring.append((get_hash("%s:%d-%d" % (member.configuration.address, member.configuration.port, i)), member.configuration.address, member.configuration.port, member))
+                i = i + 1
+        
+        ring.sort(key=lambda node: node[:3])
+        
+        self.hashes = [node[0] for node in ring]
+        self.hash_members = [node[3] for node in ring]
+    
+    def update_proxy_server_group_member(self, member):
+        pass
+    
+    def select_proxy_server_group_member(self, address, port):
+        twunnel3.logger.log(3, "trace: ConsistentHashingStrategy.select_proxy_server_group_member")
+        
+        i = bisect.bisect(self.hashes, get_hash(address))
+        if i == len(self.hashes):
+            i = 0
+        
+        return self.hash_members[i]
+
+def get_proxy_server_group_strategy_class(type):
+    if type == "WEIGHTED_ROUND_ROBIN":
+        return WeightedRoundRobinStrategy
+    else:
+        if type == "LEAST_CONNECTIONS":
+            return LeastConnectionsStrategy
+        else:
+            if type == "POWER_OF_TWO_CHOICES":
+                return PowerOfTwoChoicesStrategy
+            else:
+                if type == "CONSISTENT_HASHING":
+                    return ConsistentHashingStrategy
+                else:
+                    return None
+
+class ProxyServerGroup(object):
+    def __init__(self, configuration):
+        twunnel3.logger.log(3, "trace: ProxyServerGroup.__init__")
+        
+        self.configuration = configuration
+        self.latency_factor = configuration.latency_factor
+        self.virtual_nodes = configuration.virtual_nodes
+        # the latency of the handshakes of all members
+        self.latency = 0.0
+        self.members = []
+        
+        strategy_class = get_proxy_server_group_strategy_class(configuration.strategy)
+        self.strategy = strategy_class(self)
+        
+        for proxy_server_configuration in configuration.proxy_servers:
+            self.members.append(ProxyServerGroupMember(self, proxy_server_configuration))
+        
+        self.strategy.update_proxy_server_group_members()
+    
+    def handshake_made(self, latency):
+        twunnel3.logger.log(3, "trace: ProxyServerGroup.handshake_made")
+        
+        if self.latency == 0.0:
+            self.latency = latency
+        else:
+            self.latency = self.latency + (latency - self.latency) * self.latency_factor
+    
+    def add_proxy_server(self, configuration):
+        twunnel3.logger.log(3, "trace: ProxyServerGroup.add_proxy_server")
+        
+        configuration = twunnel3.configuration.create_proxy_server_configuration(configuration)
+        
+        # existing tunnels keep their reference to the member they were created with
+        self.members = self.members + [ProxyServerGroupMember(self, configuration)]
+        
+        self.strategy.update_proxy_server_group_members()
+        
+        return configuration
+    
+    def remove_proxy_server(self, configuration):
+        twunnel3.logger.log(3, "trace: ProxyServerGroup.remove_proxy_server")
+        
+        members = []
+        for member in self.members:
+            if member.configuration is configuration:
+                member.removed = True
+            else:
+                members.append(member)
+        
+        self.members = members
+        
+        self.strategy.update_proxy_server_group_members()
+    
+    def select_proxy_server_group_member(self, address, port):
+        twunnel3.logger.log(3, "trace: ProxyServerGroup.select_proxy_server_group_member")
+        
+        if len(self.members) == 0:
+            return None
+        
+        return self.strategy.select_proxy_server_group_member(address, port)
+
+def get_proxy_server_group(configuration):
+    # the group is kept by its configuration, so a reloaded configuration gets a new group and the group of the old one goes with it
+    proxy_server_group = getattr(configuration, "proxy_server_group", None)
+    
+    if proxy_server_group is None:
+        proxy_server_group = ProxyServerGroup(configuration)
+        
+        configuration.proxy_server_group = proxy_server_group
+    
+    return proxy_server_group
\ No newline at end of file
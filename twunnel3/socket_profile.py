@@ -0,0 +1,219 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import socket
+import sys
+import twunnel3.logger
+import twunnel3.tracing
+
+# the options which are not defined by every version of Python have the values of Linux
+linux = sys.platform.startswith("linux")
+
+TCP_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", 25 if linux == True else None)
+TCP_FASTOPEN = getattr(socket, "TCP_FASTOPEN", 23 if linux == True else None)
+TCP_FASTOPEN_CONNECT = getattr(socket, "TCP_FASTOPEN_CONNECT", 30 if linux == True else None)
+TCP_KEEPIDLE = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+TCP_KEEPINTVL = getattr(socket, "TCP_KEEPINTVL", None)
+TCP_KEEPCNT = getattr(socket, "TCP_KEEPCNT", None)
+
+maximum_fast_open_connections_length = 256
+
+def set_socket_option(sock, level, option, value):
+    if option is None:
+        return
+    
+    try:
+        sock.setsockopt(level, option, value)
+    except OSError as exception:
+        twunnel3.logger.log(2, "socket option %d could not be set: %s" % (option, str(exception)))
+
+def set_socket_options(sock, socket_profile, connecting=False):
+    twunnel3.logger.log(3, "trace: set_socket_options")
+    
+    if socket_profile.send_buffer_size > 0:
+        set_socket_option(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, socket_profile.send_buffer_size)
+    
+    if socket_profile.receive_buffer_size > 0:
+        set_socket_option(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, socket_profile.receive_buffer_size)
+    
+    if sock.family != socket.AF_INET and sock.family != socket.AF_INET6:
+        return
+    
+    set_socket_option(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, int(socket_profile.no_delay))
+    
+    if socket_profile.keep_alive == True:
+        set_socket_option(sock, socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_KEEPIDLE, socket_profile.keep_alive_idle)
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_KEEPINTVL, socket_profile.keep_alive_interval)
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_KEEPCNT, socket_profile.keep_alive_count)
+    
+    if socket_profile.not_sent_low_water_mark > 0:
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, socket_profile.not_sent_low_water_mark)
+    
+    # with TCP_FASTOPEN_CONNECT the connect is delayed until the first write, so the first request goes with the SYN
+    if connecting == True and socket_profile.fast_open == True:
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1)
+
+def set_no_delay(sock, socket_profile):
+    # the event loop enables TCP_NODELAY on every transport, also on a transport of a socket which was already tuned
+    if sock.family == socket.AF_INET or sock.family == socket.AF_INET6:
+        set_socket_option(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, int(socket_profile.no_delay))
+
+def set_listening_socket_options(sock, socket_profile):
+    twunnel3.logger.log(3, "trace: set_listening_socket_options")
+    
+    # the accepted sockets get the buffer sizes of the listening socket before their handshake, so the window scale is chosen for them
+    if socket_profile.send_buffer_size > 0:
+        set_socket_option(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, socket_profile.send_buffer_size)
+    
+    if socket_profile.receive_buffer_size > 0:
+        set_socket_option(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, socket_profile.receive_buffer_size)
+    
+    if sock.family != socket.AF_INET and sock.family != socket.AF_INET6:
+        return
+    
+    # the queue of connections which sent data with their SYN but did not complete their handshake yet
+    if socket_profile.fast_open == True:
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_FASTOPEN, maximum_fast_open_connections_length)
+    else:
+        set_socket_option(sock, socket.IPPROTO_TCP, TCP_FASTOPEN, 0)
+
+def create_connection(protocol_factory, socket_profile, host=None, port=None, *, local_addr=None, family=0, proto=0, flags=0, ssl=None, server_hostname=None, span=None):
+    twunnel3.logger.log(3, "trace: create_connection")
+    
+    loop = asyncio.get_event_loop()
+    
+    if socket_profile is None:
+        if span is None:
+            return loop.create_connection(protocol_factory, host=host, port=port, local_addr=local_addr, family=family, proto=proto, flags=flags, ssl=ssl, server_hostname=server_hostname)
+        
+        # the event loop resolves and connects in one step, so they get one span
+        connect_span = span.create_span("connect", twunnel3.tracing.SPAN_KIND_CLIENT)
+        connect_span.set_attribute("server.address", str(host))
+        connect_span.set_attribute("server.port", port)
+        
+        connection_future = asyncio.async(loop.create_connection(protocol_factory, host=host, port=port, local_addr=local_addr, family=family, proto=proto, flags=flags, ssl=ssl, server_hostname=server_hostname))
+        connection_future.add_done_callback(connect_span.future_done)
+        return connection_future
+    
+    # the socket is created and connected here instead of by the event loop, because some options must be set before the connect
+    future = asyncio.Future()
+    
+    exceptions = []
+    
+    def connect(addresses, i):
+        if future.cancelled() == True:
+            return
+        
+        if i >= len(addresses):
+            if len(exceptions) == 1:
+                future.set_exception(exceptions[0])
+            else:
+                future.set_exception(OSError("multiple exceptions: " + ", ".join(str(exception) for exception in exceptions)))
+            
+            return
+        
+        address_family, address_type, address_protocol, canonical_name, address = addresses[i]
+        
+        sock = socket.socket(address_family, address_type, address_protocol)
+        
+        try:
+            sock.setblocking(False)
+            
+            set_socket_options(sock, socket_profile, True)
+            
+            if local_addr is not None:
+                sock.bind(local_addr)
+        except OSError as exception:
+            sock.close()
+            
+            exceptions.append(exception)
+            
+            connect(addresses, i + 1)
+            
+            return
+        
+        connect_future = asyncio.async(loop.sock_connect(sock, address))
+        
+        if span is not None:
+            connect_span = span.create_span("connect", twunnel3.tracing.SPAN_KIND_CLIENT)
+            connect_span.set_attribute("network.peer.address", address[0])
+            connect_span.set_attribute("network.peer.port", address[1])
+            
+            connect_future.add_done_callback(connect_span.future_done)
+        
+        def connect_done(connect_future):
+            if connect_future.cancelled() == True:
+                sock.close()
+                
+                future.cancel()
+                
+                return
+            
+            if connect_future.exception() is not None:
+                sock.close()
+                
+                exceptions.append(connect_future.exception())
+                
+                connect(addresses, i + 1)
+                
+                return
+            
+            connection_future = asyncio.async(loop.create_connection(protocol_factory, sock=sock, ssl=ssl, server_hostname=server_hostname))
+            
+            def connection_done(connection_future):
+                if future.cancelled() == True:
+                    if connection_future.cancelled() == False and connection_future.exception() is None:
+                        connection_future.result()[0].close()
+                    
+                    return
+                
+                if connection_future.cancelled() == True:
+                    future.cancel()
+                else:
+                    if connection_future.exception() is not None:
+                        future.set_exception(connection_future.exception())
+                    else:
+                        set_no_delay(sock, socket_profile)
+                        
+                        future.set_result(connection_future.result())
+            
+            connection_future.add_done_callback(connection_done)
+        
+        connect_future.add_done_callback(connect_done)
+    
+    addresses_future = asyncio.async(loop.getaddrinfo(host, port, family=family, type=socket.SOCK_STREAM, proto=proto, flags=flags))
+    
+    if span is not None:
+        dns_span = span.create_span("dns")
+        dns_span.set_attribute("server.address", str(host))
+        
+        addresses_future.add_done_callback(dns_span.future_done)
+    
+    def getaddrinfo_done(addresses_future):
+        if future.cancelled() == True:
+            return
+        
+        if addresses_future.cancelled() == True:
+            future.cancel()
+            
+            return
+        
+        if addresses_future.exception() is not None:
+            future.set_exception(addresses_future.exception())
+            
+            return
+        
+        addresses = addresses_future.result()
+        
+        if len(addresses) == 0:
+            future.set_exception(OSError("getaddrinfo() returned empty list"))
+            
+            return
+        
+        connect(addresses, 0)
+    
+    addresses_future.add_done_callback(getaddrinfo_done)
+    
+    return future
\ No newline at end of file
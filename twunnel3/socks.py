@@ -0,0 +1,88 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import socket
+import struct
+
+socks4_request_struct = struct.Struct("!BBH4s")
+socks4_reply_struct = struct.Struct("!BBHI")
+socks5_method_struct = struct.Struct("!BB")
+socks5_header_struct = struct.Struct("!BBB")
+socks5_empty_reply_struct = struct.Struct("!BBBBIH")
+port_struct = struct.Struct("!H")
+
+SOCKS4_REPLY_GRANTED = socks4_reply_struct.pack(0x00, 0x5a, 0, 0)
+SOCKS4_REPLY_REJECTED = socks4_reply_struct.pack(0x00, 0x5b, 0, 0)
+
+SOCKS5_METHOD_REQUEST = struct.pack("!BBBB", 0x05, 0x02, 0x00, 0x02)
+SOCKS5_METHOD_REQUEST_NO_AUTHENTICATION = struct.pack("!BBB", 0x05, 0x01, 0x00)
+SOCKS5_METHOD_REQUEST_AUTHENTICATION = struct.pack("!BBB", 0x05, 0x01, 0x02)
+SOCKS5_REQUEST_HEADER = socks5_header_struct.pack(0x05, 0x01, 0x00)
+SOCKS5_METHOD_REPLY_NO_AUTHENTICATION = socks5_method_struct.pack(0x05, 0x00)
+SOCKS5_METHOD_REPLY_AUTHENTICATION = socks5_method_struct.pack(0x05, 0x02)
+SOCKS5_METHOD_REPLY_NOT_ACCEPTABLE = socks5_method_struct.pack(0x05, 0xFF)
+SOCKS5_AUTHENTICATION_REPLY_SUCCEEDED = socks5_method_struct.pack(0x05, 0x00)
+SOCKS5_AUTHENTICATION_REPLY_FAILED = socks5_method_struct.pack(0x05, 0x01)
+SOCKS5_REPLY_SUCCEEDED = socks5_empty_reply_struct.pack(0x05, 0x00, 0x00, 0x01, 0, 0)
+SOCKS5_REPLY_CONNECTION_NOT_ALLOWED = socks5_empty_reply_struct.pack(0x05, 0x02, 0x00, 0x01, 0, 0)
+SOCKS5_REPLY_CONNECTION_REFUSED = socks5_empty_reply_struct.pack(0x05, 0x05, 0x00, 0x01, 0, 0)
+SOCKS5_REPLY_COMMAND_NOT_SUPPORTED = socks5_empty_reply_struct.pack(0x05, 0x07, 0x00, 0x01, 0, 0)
+
+maximum_addresses_length = 1024
+
+decoded_socks5_addresses = {}
+
+def encode_socks4_request(address, port, name):
+    return socks4_request_struct.pack(0x04, 0x01, port, address.socks4_address) + name + address.socks4_address_suffix
+
+def encode_socks5_authentication_request(name, password):
+    return bytes((0x01, len(name))) + name + bytes((len(password),)) + password
+
+def encode_socks5_request(address, port):
+    return SOCKS5_REQUEST_HEADER + address.socks5_address + port_struct.pack(port)
+
+def decode_socks5_address(data, offset):
+    if len(data) < offset + 2:
+        return None
+    
+    address_type = data[offset]
+    
+    address_offset = offset + 1
+    address_length = 0
+    if address_type == 0x01:
+        address_length = 4
+    else:
+        if address_type == 0x03:
+            address_offset = offset + 2
+            address_length = data[offset + 1]
+        else:
+            if address_type == 0x04:
+                address_length = 16
+    
+    end_offset = address_offset + address_length
+    
+    if len(data) < end_offset + port_struct.size:
+        return None
+    
+    encoded_address = bytes(data[offset:end_offset])
+    
+    address = decoded_socks5_addresses.get(encoded_address)
+    if address is None:
+        address = ""
+        if address_type == 0x01:
+            address = socket.inet_ntop(socket.AF_INET, encoded_address[1:])
+        else:
+            if address_type == 0x03:
+                address = encoded_address[2:].decode()
+            else:
+                if address_type == 0x04:
+                    address = socket.inet_ntop(socket.AF_INET6, encoded_address[1:])
+        
+        if len(decoded_socks5_addresses) >= maximum_addresses_length:
+            decoded_socks5_addresses.clear()
+        
+        decoded_socks5_addresses[encoded_address] = address
+    
+    port, = port_struct.unpack_from(data, end_offset)
+    
+    return (address, port, end_offset + port_struct.size)
\ No newline at end of file
@@ -0,0 +1,35 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import ssl
+import twunnel3.logger
+
+def create_ssl_context(configuration):
+    twunnel3.logger.log(3, "trace: create_ssl_context")
+    
+    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    
+    configure_ssl_context(ssl_context, configuration)
+    
+    return ssl_context
+
+def configure_ssl_context(ssl_context, configuration):
+    twunnel3.logger.log(3, "trace: configure_ssl_context")
+    
+    # one SSLContext is shared by every connection of a local proxy server, and a reload configures it again instead of replacing it
+    # the session tickets are encrypted with keys of the SSLContext, so a client can keep resuming its session instead of doing a full handshake
+    ssl_context.load_cert_chain(configuration.certificate_file, configuration.key_file or None)
+    
+    if configuration.ciphers != "":
+        ssl_context.set_ciphers(configuration.ciphers)
+    
+    if len(configuration.alpn_protocols) > 0:
+        if hasattr(ssl_context, "set_alpn_protocols") == False:
+            raise ValueError("ALPN is not supported by this version of Python")
+        
+        ssl_context.set_alpn_protocols(list(configuration.alpn_protocols))
+    
+    if configuration.session_tickets == True:
+        ssl_context.options &= ~ssl.OP_NO_TICKET
+    else:
+        ssl_context.options |= ssl.OP_NO_TICKET
\ No newline at end of file
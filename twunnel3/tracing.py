@@ -0,0 +1,279 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import json
+import random
+import time
+import urllib.request
+import twunnel3.configuration
+import twunnel3.logger
+
+# the spans which are not exported yet are kept up to this length, the spans which end while the exports are late are dropped
+maximum_spans_length = 65536
+
+# the OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+class Span(object):
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_span_id", "name", "kind", "start_time", "end_time", "attributes", "error")
+    
+    def __init__(self, tracer, trace_id, parent_span_id, name, kind):
+        twunnel3.logger.log(3, "trace: Span.__init__")
+        
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64) | 1
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_time = time.time()
+        self.end_time = 0
+        self.attributes = {}
+        self.error = ""
+    
+    def create_span(self, name, kind=SPAN_KIND_INTERNAL):
+        twunnel3.logger.log(3, "trace: Span.create_span")
+        
+        return Span(self.tracer, self.trace_id, self.span_id, name, kind)
+    
+    def set_attribute(self, name, value):
+        twunnel3.logger.log(3, "trace: Span.set_attribute")
+        
+        self.attributes[name] = value
+    
+    def end(self, exception=None):
+        twunnel3.logger.log(3, "trace: Span.end")
+        
+        # a span ends once, the first end is kept
+        if self.end_time != 0:
+            return
+        
+        self.end_time = time.time()
+        
+        if exception is not None:
+            self.error = str(exception) or exception.__class__.__name__
+        
+        self.tracer.export_span(self)
+    
+    def future_done(self, future):
+        twunnel3.logger.log(3, "trace: Span.future_done")
+        
+        if future.cancelled() == True:
+            self.end(asyncio.CancelledError())
+        else:
+            self.end(future.exception())
+
+class Tracer(object):
+    def __init__(self):
+        twunnel3.logger.log(3, "trace: Tracer.__init__")
+        
+        self.sample_rate = 0.0
+        self.service_name = "twunnel3"
+        self.file = ""
+        self.url = ""
+        self.batch_size = 512
+        self.interval = 5.0
+        self.spans = []
+        self.dropped_spans = 0
+        self.exported_spans = 0
+        self.export_handle = None
+        self.export_future = None
+    
+    def create_span(self, name, kind=SPAN_KIND_SERVER):
+        twunnel3.logger.log(3, "trace: Tracer.create_span")
+        
+        # a connection which is not sampled gets no span, so it only checks its span against None
+        if self.sample_rate == 0 or random.random() >= self.sample_rate:
+            return None
+        
+        return Span(self, random.getrandbits(128) | 1, 0, name, kind)
+    
+    def export_span(self, span):
+        twunnel3.logger.log(3, "trace: Tracer.export_span")
+        
+        if len(self.spans) >= maximum_spans_length:
+            self.dropped_spans = self.dropped_spans + 1
+            
+            return
+        
+        self.spans.append(span)
+        
+        if len(self.spans) >= self.batch_size:
+            self.export_spans()
+        else:
+            if self.export_handle is None and self.export_future is None:
+                self.export_handle = asyncio.get_event_loop().call_later(self.interval, self.export_spans)
+    
+    def export_spans(self):
+        twunnel3.logger.log(3, "trace: Tracer.export_spans")
+        
+        if self.export_handle is not None:
+            self.export_handle.cancel()
+            self.export_handle = None
+        
+        # one batch is exported at a time, the spans which end in the meantime are exported when it is done
+        if self.export_future is not None:
+            return
+        
+        if len(self.spans) == 0:
+            return
+        
+        spans = self.spans
+        self.spans = []
+        
+        # the spans are encoded and written by a thread of the executor, so the connections do not wait for the file or the collector
+        self.export_future = asyncio.get_event_loop().run_in_executor(None, write_spans, spans, self.service_name, self.file, self.url)
+        
+        def export_spans_done(export_future):
+            self.export_future = None
+            
+            if export_future.cancelled() == False and export_future.exception() is not None:
+                self.dropped_spans = self.dropped_spans + len(spans)
+                
+                twunnel3.logger.log(1, "spans could not be exported: %s" % str(export_future.exception()))
+            else:
+                self.exported_spans = self.exported_spans + len(spans)
+            
+            if len(self.spans) >= self.batch_size:
+                self.export_spans()
+            else:
+                if len(self.spans) > 0 and self.export_handle is None:
+                    self.export_handle = asyncio.get_event_loop().call_later(self.interval, self.export_spans)
+        
+        self.export_future.add_done_callback(export_spans_done)
+    
+    def flush(self):
+        twunnel3.logger.log(3, "trace: Tracer.flush")
+        
+        # the spans which are left when the process stops are written by the caller
+        if self.export_handle is not None:
+            self.export_handle.cancel()
+            self.export_handle = None
+        
+        if len(self.spans) == 0:
+            return
+        
+        spans = self.spans
+        self.spans = []
+        
+        try:
+            write_spans(spans, self.service_name, self.file, self.url)
+            
+            self.exported_spans = self.exported_spans + len(spans)
+        except (OSError, ValueError) as exception:
+            self.dropped_spans = self.dropped_spans + len(spans)
+            
+            twunnel3.logger.log(1, "spans could not be exported: %s" % str(exception))
+
+def encode_attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    else:
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        else:
+            if isinstance(value, float):
+                return {"doubleValue": value}
+            else:
+                return {"stringValue": str(value)}
+
+def encode_attributes(attributes):
+    return [{"key": name, "value": encode_attribute_value(value)} for name, value in attributes.items()]
+
+def encode_span(span):
+    encoded_span = \
+    {
+        "traceId": "%032x" % span.trace_id,
+        "spanId": "%016x" % span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(int(span.start_time * 1000000000)),
+        "endTimeUnixNano": str(int(span.end_time * 1000000000)),
+        "attributes": encode_attributes(span.attributes)
+    }
+    
+    if span.parent_span_id != 0:
+        encoded_span["parentSpanId"] = "%016x" % span.parent_span_id
+    
+    # the OTLP status codes are 0 (unset), 1 (ok) and 2 (error)
+    if span.error != "":
+        encoded_span["status"] = {"code": 2, "message": span.error}
+    
+    return encoded_span
+
+def encode_spans(spans, service_name):
+    # the OTLP/JSON encoding of an ExportTraceServiceRequest
+    request = \
+    {
+        "resourceSpans":
+        [
+            {
+                "resource":
+                {
+                    "attributes": encode_attributes({"service.name": service_name})
+                },
+                "scopeSpans":
+                [
+                    {
+                        "scope":
+                        {
+                            "name": "twunnel3"
+                        },
+                        "spans": [encode_span(span) for span in spans]
+                    }
+                ]
+            }
+        ]
+    }
+    
+    return json.dumps(request, separators=(",", ":")).encode()
+
+def write_spans(spans, service_name, file, url):
+    data = encode_spans(spans, service_name)
+    
+    # a FILE gets a request per line, like the file exporter of the OpenTelemetry Collector
+    if file != "":
+        with open(file, "ab") as spans_file:
+            spans_file.write(data + b"\n")
+    
+    # a URL gets a request per batch, like an OTLP/HTTP exporter
+    if url != "":
+        request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+        
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+tracer = Tracer()
+
+def configure(configuration):
+    tracing_configuration = twunnel3.configuration.get_dictionary(configuration, "TRACING", "")
+    
+    # SAMPLE_RATE is the part of the connections which is traced, 0 is none and 1 is all
+    sample_rate = twunnel3.configuration.get_value(tracing_configuration, "SAMPLE_RATE", 0.0, "TRACING.")
+    file = twunnel3.configuration.get_value(tracing_configuration, "FILE", "", "TRACING.")
+    url = twunnel3.configuration.get_value(tracing_configuration, "URL", "", "TRACING.")
+    service_name = twunnel3.configuration.get_value(tracing_configuration, "SERVICE_NAME", "twunnel3", "TRACING.")
+    batch_size = twunnel3.configuration.get_value(tracing_configuration, "BATCH_SIZE", 512, "TRACING.")
+    interval = twunnel3.configuration.get_value(tracing_configuration, "INTERVAL", 5.0, "TRACING.")
+    
+    if sample_rate < 0 or sample_rate > 1:
+        raise ValueError("TRACING.SAMPLE_RATE must be from 0 to 1")
+    
+    if sample_rate > 0 and file == "" and url == "":
+        raise ValueError("TRACING.FILE or TRACING.URL must be set")
+    
+    if batch_size < 1:
+        raise ValueError("TRACING.BATCH_SIZE must be 1 or more")
+    
+    if interval <= 0:
+        raise ValueError("TRACING.INTERVAL must be more than 0")
+    
+    tracer.sample_rate = sample_rate
+    tracer.file = file
+    tracer.url = url
+    tracer.service_name = service_name
+    tracer.batch_size = batch_size
+    tracer.interval = interval
\ No newline at end of file